@@ -1,21 +1,126 @@
 from django.contrib import admin
-from .models import Customer, Loan
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from .models import Customer, Loan, ArchivedLoan
+
+# Largest value a BigIntegerField can hold
+MAX_BIGINT = 2 ** 63 - 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts the database's row estimate instead of running
+    COUNT(*) on unfiltered changelists of large tables
+    """
+    exact_count_threshold = 100000
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_count_threshold:
+                return estimate
+        return super().count
+
+
+def estimated_row_count(model, using='default'):
+    """Cheap row count estimate from the planner statistics, or None"""
+    connection = connections[using]
+    table = model._meta.db_table
+    
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # Auto-increment keys are an index lookup away and close enough
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin defaults for multi-million-row tables: estimated counts and
+    searches restricted to indexed exact or prefix lookups
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Lookups applied when the search term is a number, OR-ed together
+    numeric_search_fields = []
+    # Prefix lookups applied to other search terms
+    prefix_search_fields = []
+    
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        
+        # isdigit() alone accepts non-ASCII digits such as '²' that int() rejects
+        if search_term.isascii() and search_term.isdigit():
+            if int(search_term) > MAX_BIGINT:
+                # Matches no integer column and would overflow the query parameter
+                return queryset.none(), False
+            fields = self.numeric_search_fields
+        else:
+            fields = [f'{field}__startswith' for field in self.prefix_search_fields]
+        
+        if not fields:
+            return queryset.none(), False
+        
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{field: search_term})
+        return queryset.filter(condition), False
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LargeTableAdmin):
     list_display = ['customer_id', 'first_name', 'last_name', 'phone_number', 
                    'monthly_salary', 'approved_limit', 'current_debt']
-    list_filter = ['created_at', 'approved_limit']
-    search_fields = ['first_name', 'last_name', 'phone_number']
+    list_filter = ['created_at']
+    date_hierarchy = 'created_at'
+    search_fields = ['phone_number', 'last_name']
+    numeric_search_fields = ['phone_number', 'customer_id']
+    prefix_search_fields = ['last_name']
+    search_help_text = 'Exact phone number or customer ID, or last name prefix'
     readonly_fields = ['customer_id', 'created_at', 'updated_at']
 
 
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(LargeTableAdmin):
     list_display = ['loan_id', 'customer', 'loan_amount', 'interest_rate', 
                    'tenure', 'monthly_repayment', 'start_date', 'end_date']
-    list_filter = ['start_date', 'end_date', 'interest_rate']
-    search_fields = ['customer__first_name', 'customer__last_name', 'loan_id']
+    list_select_related = ['customer']
+    list_filter = ['start_date', 'end_date']
+    date_hierarchy = 'start_date'
+    search_fields = ['loan_id', 'customer__phone_number']
+    numeric_search_fields = ['loan_id', 'customer__phone_number', 'customer_id']
+    search_help_text = 'Exact loan ID, customer ID or customer phone number'
     readonly_fields = ['loan_id', 'created_at', 'updated_at']
-    raw_id_fields = ['customer']
\ No newline at end of file
+    raw_id_fields = ['customer']
+
+
+@admin.register(ArchivedLoan)
+class ArchivedLoanAdmin(LargeTableAdmin):
+    """Read-only view of the closed loans moved out of the loans table"""
+    list_display = ['loan_id', 'customer', 'loan_amount', 'interest_rate',
+                    'tenure', 'monthly_repayment', 'start_date', 'end_date', 'archived_at']
+    list_select_related = ['customer']
+    list_filter = ['start_date', 'end_date']
+    date_hierarchy = 'start_date'
+    search_fields = ['loan_id', 'customer__phone_number']
+    numeric_search_fields = ['loan_id', 'customer__phone_number', 'customer_id']
+    search_help_text = 'Exact loan ID, customer ID or customer phone number'
+    raw_id_fields = ['customer']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+Offline backtest of a candidate credit policy against the loan book.
+
+Every booked loan (hot and archived) is replayed as the eligibility
+decision that approved it: the score inputs and current EMIs are rebuilt
+from the customer's earlier loans, and both policies decide the loan with
+the vectorized kernel in loans.vectorized. The report counts the decisions
+that would flip, the rate corrections that change and the resulting EMI
+deltas, overall and by segment.
+
+Approximations: the booked (possibly corrected) rate stands in for the
+requested one, earlier loans count as paid on time by their status today,
+and the customer's current salary and approved limit apply throughout.
+"""
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .models import ArchivedLoan, Customer, Loan
+from .sharding import scatter
+from .vectorized import APPROVED, REJECTED_EMI, REJECTED_SCORE, evaluate_policy
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = {APPROVED: 'approved', REJECTED_SCORE: 'rejected_score', REJECTED_EMI: 'rejected_emi'}
+
+
+def policy_arrays(policy):
+    """Band tables of a compiled credit policy as arrays for evaluate_policy"""
+    loan_count_bounds, loan_count_points = policy.loan_count
+    current_year_bounds, current_year_points = policy.current_year_loans
+    volume_bounds, volume_points = policy.volume_ratio
+    rate_bounds, min_rates = policy.rate_bands
+    return {
+        'new_customer_score': float(policy.new_customer_score),
+        'on_time_points': policy.on_time_points,
+        'loan_count_bounds': np.asarray(loan_count_bounds, dtype=np.float64),
+        'loan_count_points': np.asarray(loan_count_points, dtype=np.float64),
+        'current_year_bounds': np.asarray(current_year_bounds, dtype=np.float64),
+        'current_year_points': np.asarray(current_year_points, dtype=np.float64),
+        'volume_bounds': np.asarray([float(bound) for bound in volume_bounds]),
+        'volume_points': np.asarray(volume_points, dtype=np.float64),
+        'rate_bounds': np.asarray(rate_bounds, dtype=np.float64),
+        'rate_approve': np.asarray(policy.rate_approve, dtype=bool),
+        'rate_min': np.asarray([np.nan if rate is None else float(rate) for rate in min_rates]),
+    }
+
+
+class DecisionBook:
+    """Columnar view of every booked loan with its point-in-time decision inputs"""
+    
+    COLUMNS = (
+        'loan_id', 'customer_id', 'loan_amount', 'interest_rate', 'tenure', 'start_year',
+        'monthly_salary', 'approved_limit', 'total_loans', 'loans_paid_on_time',
+        'current_year_loans', 'total_volume', 'current_emis'
+    )
+    
+    def __init__(self, **columns):
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+    
+    def __len__(self):
+        return len(self.loan_id)
+    
+    def columns(self, rows=slice(None)):
+        return {name: getattr(self, name)[rows] for name in self.COLUMNS}
+    
+    @classmethod
+    def load(cls, chunk_size=5000):
+        """Load the book of every shard once and derive the decision inputs"""
+        # Customers never span shards, so the columns can be concatenated first
+        shards = [columns for _, columns in scatter(_load_shard, chunk_size)]
+        raw = {name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]}
+        return cls(**_decision_inputs(raw))
+
+
+_LOAN_FIELDS = (
+    'loan_id', 'customer_id', 'loan_amount', 'interest_rate', 'tenure',
+    'monthly_repayment', 'emis_paid_on_time', 'start_date', 'end_date'
+)
+
+
+def _load_shard(chunk_size):
+    columns = {name: [] for name in _LOAN_FIELDS}
+    for model in (Loan, ArchivedLoan):
+        for row in model.objects.order_by().values_list(*_LOAN_FIELDS).iterator(chunk_size=chunk_size):
+            for name, value in zip(_LOAN_FIELDS, row):
+                columns[name].append(value)
+    
+    customers = {
+        customer_id: (salary, limit)
+        for customer_id, salary, limit in Customer.objects.order_by().values_list(
+            'customer_id', 'monthly_salary', 'approved_limit'
+        ).iterator(chunk_size=chunk_size)
+    }
+    salaries = [customers[customer_id] for customer_id in columns['customer_id']]
+    tenure = np.asarray(columns['tenure'], dtype=np.int64)
+    
+    return {
+        'loan_id': np.asarray(columns['loan_id'], dtype=np.int64),
+        'customer_id': np.asarray(columns['customer_id'], dtype=np.int64),
+        'loan_amount': np.asarray(columns['loan_amount'], dtype=np.float64),
+        'interest_rate': np.asarray(columns['interest_rate'], dtype=np.float64),
+        'tenure': tenure,
+        'monthly_repayment': np.asarray(columns['monthly_repayment'], dtype=np.float64),
+        'paid_on_time': np.asarray(columns['emis_paid_on_time'], dtype=np.int64) >= tenure,
+        'start': np.asarray([day.toordinal() for day in columns['start_date']], dtype=np.int64),
+        'start_year': np.asarray([day.year for day in columns['start_date']], dtype=np.int64),
+        'end': np.asarray([day.toordinal() for day in columns['end_date']], dtype=np.int64),
+        'monthly_salary': np.asarray([float(salary) for salary, _ in salaries], dtype=np.float64),
+        'approved_limit': np.asarray([float(limit) for _, limit in salaries], dtype=np.float64),
+    }
+
+
+def _exclusive_group_cumsum(values, group_start):
+    """Sum of the preceding values of each row's group, for rows sorted by group"""
+    totals = np.concatenate(([0], np.cumsum(values)))
+    return totals[:-1] - totals[group_start]
+
+
+def _decision_inputs(raw):
+    """
+    What create_loan saw for every loan: the aggregates of the customer's
+    loans that started before it, and the EMIs of those still running
+    """
+    # Each customer's loans in booking order
+    order = np.lexsort((raw['loan_id'], raw['start'], raw['customer_id']))
+    raw = {name: values[order] for name, values in raw.items()}
+    customer_id = raw['customer_id']
+    count = len(customer_id)
+    
+    first = np.ones(count, dtype=bool)
+    first[1:] = customer_id[1:] != customer_id[:-1]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(count), 0))
+    position = np.arange(count) - group_start
+    
+    # Loans of the customer earlier in the same year
+    year_first = first.copy()
+    year_first[1:] |= raw['start_year'][1:] != raw['start_year'][:-1]
+    year_start = np.maximum.accumulate(np.where(year_first, np.arange(count), 0))
+    
+    # EMIs of earlier loans minus those that ended before this loan started:
+    # with the customer's loans sorted by end date, searchsorted counts them
+    group_index = np.cumsum(first) - 1
+    days = np.concatenate((raw['start'], raw['end']))
+    base = days.min() if count else 0
+    span = int(days.max() - base) + 2 if count else 1
+    end_keys = group_index * span + (raw['end'] - base)
+    by_end = np.argsort(end_keys, kind='stable')
+    ended_emis = np.concatenate(([0.0], np.cumsum(raw['monthly_repayment'][by_end])))
+    ended = np.searchsorted(end_keys[by_end], group_index * span + (raw['start'] - base), side='left')
+    emis_before = _exclusive_group_cumsum(raw['monthly_repayment'], group_start)
+    
+    return {
+        'loan_id': raw['loan_id'],
+        'customer_id': customer_id,
+        'loan_amount': raw['loan_amount'],
+        'interest_rate': raw['interest_rate'],
+        'tenure': raw['tenure'],
+        'start_year': raw['start_year'],
+        'monthly_salary': raw['monthly_salary'],
+        'approved_limit': raw['approved_limit'],
+        'total_loans': position,
+        'loans_paid_on_time': _exclusive_group_cumsum(raw['paid_on_time'].astype(np.int64), group_start),
+        'current_year_loans': np.arange(count) - year_start,
+        'total_volume': _exclusive_group_cumsum(raw['loan_amount'], group_start),
+        'current_emis': np.maximum(emis_before - (ended_emis[ended] - ended_emis[group_start]), 0.0),
+    }
+
+
+def _evaluate(columns, baseline, candidate):
+    return evaluate_policy(columns, baseline), evaluate_policy(columns, candidate)
+
+
+def run_backtest(book, baseline, candidate, workers=1, chunk_size=200000, examples=20):
+    """
+    Decide every loan of ``book`` under the compiled ``baseline`` and
+    ``candidate`` policies, in chunks spread over ``workers`` processes,
+    and return the diff report
+    """
+    started = time.monotonic()
+    baseline_arrays, candidate_arrays = policy_arrays(baseline), policy_arrays(candidate)
+    chunks = [
+        book.columns(slice(start, start + chunk_size)) for start in range(0, len(book), chunk_size)
+    ]
+    arguments = [(chunk, baseline_arrays, candidate_arrays) for chunk in chunks]
+    
+    if workers > 1 and len(arguments) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_evaluate, *zip(*arguments)))
+    else:
+        results = [_evaluate(*args) for args in arguments]
+    
+    before = _concatenate([result[0] for result in results])
+    after = _concatenate([result[1] for result in results])
+    report = _report(book, before, after, baseline, candidate, examples)
+    report['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    logger.info(f"Backtested {len(book)} loans in {report['elapsed_seconds']}s")
+    return report
+
+
+def _concatenate(chunks):
+    return {
+        name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.zeros(0)
+        for name in ('credit_score', 'outcome', 'interest_rate', 'monthly_installment')
+    }
+
+
+def _band_labels(bounds):
+    labels, low = [], None
+    for bound in bounds:
+        labels.append(f'<={bound:g}' if low is None else f'{low:g}-{bound:g}')
+        low = bound + 1
+    labels.append(f'>{bounds[-1]:g}' if len(bounds) else 'all')
+    return labels
+
+
+def _diff(before, after, mask=slice(None)):
+    was = before['outcome'][mask] == APPROVED
+    now = after['outcome'][mask] == APPROVED
+    both = was & now
+    rate_delta = (after['interest_rate'][mask] - before['interest_rate'][mask])[both]
+    emi_delta = (after['monthly_installment'][mask] - before['monthly_installment'][mask])[both]
+    return {
+        'loans': int(was.size),
+        'approved_before': int(was.sum()),
+        'approved_after': int(now.sum()),
+        'flipped_to_rejected': int((was & ~now).sum()),
+        'flipped_to_approved': int((~was & now).sum()),
+        'rate_raised': int((rate_delta > 0).sum()),
+        'rate_lowered': int((rate_delta < 0).sum()),
+        'mean_rate_change': round(float(rate_delta.mean()), 4) if rate_delta.size else 0.0,
+        'emi_delta_total': round(float(emi_delta.sum()), 2),
+        'emi_delta_mean': round(float(emi_delta.mean()), 2) if emi_delta.size else 0.0,
+    }
+
+
+def _report(book, before, after, baseline, candidate, examples):
+    report = {
+        'baseline_version': baseline.version,
+        'candidate_version': candidate.version,
+        'summary': _diff(before, after),
+        'outcomes': {
+            side: {label: int((outcomes['outcome'] == code).sum()) for code, label in OUTCOMES.items()}
+            for side, outcomes in (('baseline', before), ('candidate', after))
+        },
+        'segments': {},
+    }
+    
+    # Segments by the baseline score band, origination year and tenure
+    band_bounds = baseline.rate_bands[0]
+    bands = np.searchsorted(np.asarray(band_bounds, dtype=np.float64), before['credit_score'], side='left')
+    segment_keys = {
+        'score_band': [(label, bands == index) for index, label in enumerate(_band_labels(band_bounds))],
+        'start_year': [(str(year), book.start_year == year) for year in np.unique(book.start_year)],
+        'tenure': [(str(tenure), book.tenure == tenure) for tenure in np.unique(book.tenure)],
+    }
+    for segment, keys in segment_keys.items():
+        report['segments'][segment] = {
+            label: _diff(before, after, mask) for label, mask in keys if mask.any()
+        }
+    
+    flipped = np.flatnonzero((before['outcome'] == APPROVED) != (after['outcome'] == APPROVED))
+    report['flipped_examples'] = [
+        {
+            'loan_id': int(book.loan_id[i]),
+            'customer_id': int(book.customer_id[i]),
+            'credit_score': [int(before['credit_score'][i]), int(after['credit_score'][i])],
+            'outcome': [OUTCOMES[int(before['outcome'][i])], OUTCOMES[int(after['outcome'][i])]],
+        }
+        for i in flipped[:examples]
+    ]
+    return report
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Bloom filter of registered phone numbers.
+
+Registration and ingestion ask the filter before looking a phone number up:
+a miss means the number is definitely new and needs no query, a hit means
+it is probably taken and is confirmed with the indexed phone_number lookup
+on every shard. The filter is add-only, so numbers changed or deleted since
+the last rebuild only cost a false positive, never a missed duplicate.
+
+The filter is persisted as a PhoneFilterSnapshot rebuilt from the customers
+table by the rebuild_phone_filter task (rebuild_snapshot). Every process
+keeps a copy in memory: it loads the latest snapshot, adds the numbers of
+customers created since it was built, and repeats that delta sync every
+SYNC_INTERVAL seconds. Numbers inserted by this process are added
+immediately.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+
+def _mix(values):
+    """splitmix64 finalizer, vectorized over uint64"""
+    with np.errstate(over='ignore'):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class BloomFilter:
+    """Bloom filter of integer keys over a numpy bit array"""
+    
+    def __init__(self, bit_count, hash_count, bits=None):
+        self.bit_count = int(bit_count)
+        self.hash_count = int(hash_count)
+        if bits is None:
+            self.bits = np.zeros((self.bit_count + 7) // 8, dtype=np.uint8)
+        else:
+            self.bits = np.frombuffer(bytes(bits), dtype=np.uint8).copy()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        """Filter sized for ``capacity`` keys at a false positive rate of ``error_rate``"""
+        capacity = max(int(capacity), 1)
+        bit_count = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(bit_count / capacity * math.log(2)))
+        return cls(bit_count, hash_count)
+    
+    def _positions(self, keys):
+        """Bit positions of every key, shape (len(keys), hash_count), by double hashing"""
+        keys = np.asarray(keys, dtype=np.int64).astype(np.uint64)
+        first = _mix(keys)
+        second = _mix(first ^ np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            hashes = first[:, None] + second[:, None] * steps[None, :]
+        return (hashes % np.uint64(self.bit_count)).astype(np.int64)
+    
+    def add_many(self, keys):
+        positions = self._positions(keys).ravel()
+        if positions.size:
+            with self._lock:
+                np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+    
+    def contains_many(self, keys):
+        """Boolean array: False means the key was definitely never added"""
+        positions = self._positions(keys)
+        return ((self.bits[positions >> 3] >> (positions & 7)) & 1).astype(bool).all(axis=1)
+    
+    def __contains__(self, key):
+        return bool(self.contains_many([key])[0])
+    
+    def to_bytes(self):
+        return self.bits.tobytes()
+
+
+def build_phone_filter(phone_numbers, count):
+    """Filter sized for ``count`` numbers with PHONE_FILTER headroom, holding ``phone_numbers``"""
+    config = settings.PHONE_FILTER
+    bloom = BloomFilter.for_capacity(
+        max(config['MIN_CAPACITY'], count * config['GROWTH']), config['ERROR_RATE']
+    )
+    for chunk in phone_numbers:
+        bloom.add_many(chunk)
+    return bloom
+
+
+class _PhoneFilterCache:
+    """This process's copy of the phone filter, kept current with delta syncs"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._snapshot_id = None
+        self._synced_at = None
+        self._checked_at = 0.0
+    
+    def get(self):
+        interval = settings.PHONE_FILTER['SYNC_INTERVAL']
+        if self._filter is None or time.monotonic() - self._checked_at >= interval:
+            with self._lock:
+                self._sync()
+                self._checked_at = time.monotonic()
+        return self._filter
+    
+    def _sync(self):
+        from .models import Customer, PhoneFilterSnapshot
+        from .sharding import scatter
+        
+        started = timezone.now()
+        snapshot = PhoneFilterSnapshot.objects.order_by('-built_at').first()
+        if snapshot is None:
+            # Nothing persisted yet: build from the table until a snapshot is rebuilt
+            if self._filter is None or self._snapshot_id is not None:
+                self._filter = _build_from_table()
+                self._snapshot_id = None
+                self._synced_at = started
+                return
+        elif snapshot.pk != self._snapshot_id:
+            self._filter = BloomFilter(snapshot.bit_count, snapshot.hash_count, snapshot.bits)
+            self._snapshot_id = snapshot.pk
+            self._synced_at = snapshot.built_at
+        
+        # Customers created since the last sync; the overlap catches transactions
+        # that committed after rows with a later created_at
+        since = self._synced_at - timedelta(seconds=settings.PHONE_FILTER['SYNC_OVERLAP'])
+        for _, phone_numbers in scatter(lambda: list(
+                Customer.objects.filter(created_at__gte=since).values_list('phone_number', flat=True))):
+            self._filter.add_many(phone_numbers)
+        self._synced_at = started
+    
+    def add(self, phone_numbers):
+        bloom = self._filter
+        if bloom is not None:
+            bloom.add_many(phone_numbers)
+    
+    def clear(self):
+        with self._lock:
+            self._filter = None
+            self._snapshot_id = None
+            self._checked_at = 0.0
+
+
+_cache = _PhoneFilterCache()
+
+
+def phone_filter():
+    """The phone number filter of this process, synced at most every SYNC_INTERVAL seconds"""
+    return _cache.get()
+
+
+def remember_phone_numbers(phone_numbers):
+    """Add newly inserted phone numbers to this process's filter"""
+    _cache.add(list(phone_numbers))
+
+
+def reset_phone_filter():
+    """Drop this process's filter so the next lookup loads the latest snapshot"""
+    _cache.clear()
+
+
+def _phone_number_chunks(chunk_size):
+    from .models import Customer
+    from .sharding import shard_aliases, use_shard
+    
+    for alias in shard_aliases():
+        with use_shard(alias):
+            chunk = []
+            for phone_number in Customer.objects.order_by().values_list(
+                    'phone_number', flat=True).iterator(chunk_size=chunk_size):
+                chunk.append(phone_number)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+
+def _build_from_table(chunk_size=10000):
+    from .models import Customer
+    from .sharding import scatter
+    
+    count = sum(shard_count for _, shard_count in scatter(Customer.objects.count))
+    return build_phone_filter(_phone_number_chunks(chunk_size), count)
+
+
+def rebuild_snapshot(chunk_size=10000):
+    """Rebuild the filter from the customers table and persist it as the new snapshot"""
+    from .models import PhoneFilterSnapshot
+    
+    built_at = timezone.now()
+    bloom = _build_from_table(chunk_size)
+    snapshot = PhoneFilterSnapshot.objects.create(
+        bit_count=bloom.bit_count, hash_count=bloom.hash_count, bits=bloom.to_bytes(), built_at=built_at
+    )
+    PhoneFilterSnapshot.objects.exclude(pk=snapshot.pk).delete()
+    reset_phone_filter()
+    return snapshot
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+Single-flight coalescing of concurrent identical service calls.
+
+Callers that ask for a key while a computation for the same key is in
+flight wait for it and share its result instead of computing it again.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+_registry = {}
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls within one process"""
+    
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+    
+    def do(self, key, fn):
+        """Return fn(), sharing the result with concurrent callers of the same key"""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = self._compute(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    def _compute(self, key, fn):
+        return fn()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+            }
+
+
+class CacheSingleFlight(SingleFlight):
+    """
+    Extends coalescing across processes through the Django cache.
+    
+    The process that wins ``cache.add`` on the key's lock computes the
+    result and publishes it under the lock's token; other processes poll
+    for that result until the lock is released, and compute it themselves
+    if the leader failed or the wait times out.
+    """
+    
+    def __init__(self, name, lock_timeout=10, result_ttl=5, poll_interval=0.005):
+        super().__init__(name)
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.coalesced_remote = 0
+    
+    def _compute(self, key, fn):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        lock_key = f'singleflight:{self.name}:{digest}'
+        token = uuid.uuid4().hex
+        
+        if cache.add(lock_key, token, self.lock_timeout):
+            try:
+                result = fn()
+                cache.set(f'{lock_key}:{token}', result, self.result_ttl)
+                return result
+            finally:
+                cache.delete(lock_key)
+        
+        deadline = time.monotonic() + self.lock_timeout
+        leader_token = cache.get(lock_key)
+        while leader_token is not None:
+            result_key = f'{lock_key}:{leader_token}'
+            result = cache.get(result_key, _MISSING)
+            if result is _MISSING and cache.get(lock_key) != leader_token:
+                # The leader released its lock: the result is published now or it failed
+                result = cache.get(result_key, _MISSING)
+                if result is _MISSING:
+                    break
+            if result is not _MISSING:
+                with self._lock:
+                    self.coalesced_remote += 1
+                return result
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+        
+        return fn()
+    
+    def stats(self):
+        stats = super().stats()
+        stats['coalesced_remote'] = self.coalesced_remote
+        return stats
+
+
+def single_flight(name):
+    """Return the process-wide coalescer for ``name``, built from settings"""
+    flight = _registry.get(name)
+    if flight is None:
+        options = settings.REQUEST_COALESCING
+        if options['BACKEND'] == 'cache':
+            flight = CacheSingleFlight(
+                name,
+                lock_timeout=options['LOCK_TIMEOUT'],
+                result_ttl=options['RESULT_TTL']
+            )
+        else:
+            flight = SingleFlight(name)
+        flight = _registry.setdefault(name, flight)
+    return flight
+
+
+def coalescing_stats():
+    return {name: flight.stats() for name, flight in _registry.items()}
\ No newline at end of file
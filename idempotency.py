@@ -0,0 +1,125 @@
+"""
+Idempotency keys for endpoints that create things.
+
+A request carrying the IDEMPOTENCY['HEADER'] header runs once per key and
+view: its response is stored compressed, with the STORED_HEADERS it set,
+for IDEMPOTENCY['TTL'] seconds and replayed to retries without calling the
+view again. A request whose key is still in progress waits for the first
+one to finish. Reusing a key with a different payload is rejected with 422.
+"""
+import hashlib
+import json
+import time
+import zlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# Response headers replayed along with the body, e.g. the status URL of a 202
+STORED_HEADERS = ('Location',)
+
+
+def _fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{payload}'.encode()).hexdigest()
+
+
+def _claim(scope, key, fingerprint):
+    """
+    Insert the in-progress record for the key. Returns (record, True) if
+    this request owns the key, else the existing record (None if it just
+    went away) and False.
+    """
+    now = timezone.now()
+    # Expired responses and abandoned leases free the key
+    IdempotencyRecord.objects.filter(scope=scope, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyRecord.objects.create(
+                scope=scope, key=key, fingerprint=fingerprint,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY['LOCK_TIMEOUT'])
+            )
+        return record, True
+    except IntegrityError:
+        return IdempotencyRecord.objects.filter(scope=scope, key=key).first(), False
+
+
+def _replay(record):
+    response = Response(
+        json.loads(zlib.decompress(bytes(record.body))), status=record.status_code, headers=record.headers
+    )
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Run the view once per idempotency key and replay its stored response.
+    Place it below @api_view so request.data is parsed.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        options = settings.IDEMPOTENCY
+        key = request.headers.get(options['HEADER'])
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not 0 < len(key) <= 255:
+            return Response(
+                {'error': f"{options['HEADER']} must be 1 to 255 characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        scope = view.__name__
+        fingerprint = _fingerprint(request)
+        deadline = time.monotonic() + options['WAIT_TIMEOUT']
+        while True:
+            record, owner = _claim(scope, key, fingerprint)
+            if owner:
+                break
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    return Response(
+                        {'error': 'Idempotency key was already used with a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                if record.status_code is not None:
+                    return _replay(record)
+            if time.monotonic() >= deadline:
+                return Response(
+                    {'error': 'A request with this idempotency key is still in progress'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            time.sleep(options['POLL_INTERVAL'])
+        
+        try:
+            # The view's writes on default commit together with the stored response
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if response.status_code < 500:
+                    record.status_code = response.status_code
+                    record.body = zlib.compress(json.dumps(
+                        response.data, cls=DjangoJSONEncoder, separators=(',', ':')
+                    ).encode())
+                    record.headers = {
+                        name: response[name] for name in STORED_HEADERS if response.has_header(name)
+                    }
+                    record.expires_at = timezone.now() + timedelta(seconds=options['TTL'])
+                    record.save(update_fields=['status_code', 'body', 'headers', 'expires_at'])
+        except Exception:
+            record.delete()
+            raise
+        
+        if response.status_code >= 500:
+            # Server errors are not replayed, so the client can retry
+            record.delete()
+        return response
+    return wrapped
\ No newline at end of file
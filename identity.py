@@ -0,0 +1,100 @@
+"""
+Request-scoped identity map for customers and their loans.
+
+Within a unit of work, which IdentityMapMiddleware opens for every request,
+get_customer and get_loans load each customer and each customer's loan set
+at most once. Later calls return the same instances without a query, and
+that includes customers that were not found.
+
+Writes drop the entries of the customer they touch. Customer.save,
+Loan.save and Loan.delete do this themselves. Services that write with
+queryset updates call forget(). The map is thrown away at the end of the
+request.
+
+Outside a unit of work, such as in Celery tasks and shells, every call
+reads from the database.
+"""
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('identity_map', default=None)
+
+
+class IdentityMap:
+    """Customers and loan sets loaded in one unit of work, keyed by customer_id"""
+    
+    def __init__(self):
+        self.customers = {}  # None for customers that do not exist
+        self.loans = {}
+    
+    def forget(self, customer_id=None):
+        if customer_id is None:
+            self.customers.clear()
+            self.loans.clear()
+        else:
+            self.customers.pop(customer_id, None)
+            self.loans.pop(customer_id, None)
+
+
+@contextmanager
+def unit_of_work():
+    """Scope in which customers and loans are loaded at most once"""
+    token = _current.set(IdentityMap())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+class IdentityMapMiddleware:
+    """Opens a unit of work for every request"""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        with unit_of_work():
+            return self.get_response(request)
+
+
+def get_customer(customer_id):
+    """The customer with its archive summary; raises Customer.DoesNotExist"""
+    from .models import Customer
+    
+    identity_map = _current.get()
+    if identity_map is not None and customer_id in identity_map.customers:
+        customer = identity_map.customers[customer_id]
+    else:
+        customer = Customer.objects.select_related('archive_summary').filter(customer_id=customer_id).first()
+        if identity_map is not None:
+            identity_map.customers[customer_id] = customer
+    
+    if customer is None:
+        raise Customer.DoesNotExist(f'Customer {customer_id} does not exist')
+    return customer
+
+
+def get_loans(customer_id):
+    """The customer's loans in the hot table, in booking order"""
+    from .models import Loan
+    
+    identity_map = _current.get()
+    if identity_map is not None and customer_id in identity_map.loans:
+        return identity_map.loans[customer_id]
+    
+    loans = list(Loan.objects.filter(customer_id=customer_id).order_by('loan_id'))
+    if identity_map is not None:
+        # Loans point at the mapped customer instead of lazily loading their own copy
+        customer = identity_map.customers.get(customer_id)
+        if customer is not None:
+            for loan in loans:
+                loan.customer = customer
+        identity_map.loans[customer_id] = loans
+    return loans
+
+
+def forget(customer_id=None):
+    """Drop a customer's entries (every entry without customer_id) after a write"""
+    identity_map = _current.get()
+    if identity_map is not None:
+        identity_map.forget(customer_id)
\ No newline at end of file
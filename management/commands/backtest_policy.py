@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.backtest import DecisionBook, run_backtest
+from loans.models import CreditPolicy
+from loans.policy import DEFAULT_RULES, active_policy, compile_policy
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay every booked loan under a candidate credit policy and report the decisions, '
+        'rate corrections and EMIs that would change against the active (or another) version'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('candidate', help='Candidate policy JSON file')
+        parser.add_argument('--baseline-version', type=int,
+                            help='Published version to compare against; the active one by default')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes used to evaluate chunks of the book')
+        parser.add_argument('--chunk-size', type=int, default=200000,
+                            help='Loans evaluated per task')
+        parser.add_argument('--examples', type=int, default=20,
+                            help='Flipped loans listed in the report')
+        parser.add_argument('--output', help='Write the report as JSON to this file instead of stdout')
+    
+    def handle(self, *args, **options):
+        try:
+            with open(options['candidate']) as f:
+                candidate = compile_policy(json.load(f))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Invalid policy {options['candidate']}: {str(e)}")
+        
+        version = options['baseline_version']
+        if version is None:
+            baseline = active_policy()
+        elif version == 0:
+            baseline = compile_policy(DEFAULT_RULES, 0)
+        else:
+            try:
+                baseline = compile_policy(CreditPolicy.objects.get(version=version).rules, version)
+            except CreditPolicy.DoesNotExist:
+                raise CommandError(f'Credit policy v{version} does not exist')
+        
+        book = DecisionBook.load()
+        report = run_backtest(
+            book, baseline, candidate, workers=options['workers'],
+            chunk_size=options['chunk_size'], examples=options['examples']
+        )
+        
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            summary = report['summary']
+            self.stdout.write(
+                f"{summary['loans']} loans: {summary['flipped_to_rejected']} would be rejected, "
+                f"{summary['flipped_to_approved']} approved; report written to {options['output']}"
+            )
+        else:
+            self.stdout.write(output)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from loans.exports import DATASETS, FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Stream all customers or loans as CSV or NDJSON to a file or stdout'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', dest='file_format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='Output file (defaults to stdout)')
+        parser.add_argument('--start-date', type=date.fromisoformat)
+        parser.add_argument('--end-date', type=date.fromisoformat)
+    
+    def handle(self, *args, **options):
+        chunks = stream_export(
+            options['dataset'],
+            options['file_format'],
+            start_date=options['start_date'],
+            end_date=options['end_date']
+        )
+        
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
\ No newline at end of file
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from loans.profiling import profiling_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed value for the request profiling header'
+    
+    def handle(self, *args, **options):
+        header = settings.REQUEST_PROFILING['HEADER']
+        self.stdout.write(f'{header}: {profiling_token()}')
\ No newline at end of file
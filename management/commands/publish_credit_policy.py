@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.policy import active_policy, compile_policy, publish_policy
+
+
+class Command(BaseCommand):
+    help = (
+        'Publish a credit policy JSON document as the next policy version. Every process '
+        'switches to it within CREDIT_POLICY["RELOAD_INTERVAL"] seconds.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Policy JSON file in the format of loans.policy.DEFAULT_RULES')
+        parser.add_argument('--notes', default='', help='What changed and why')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate the policy and show the changed rules without publishing')
+    
+    def handle(self, *args, **options):
+        try:
+            with open(options['path']) as f:
+                rules = json.load(f)
+            compile_policy(rules)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Invalid policy {options['path']}: {str(e)}")
+        
+        current = active_policy()
+        changed = sorted(
+            name for name in set(rules) | set(current.rules)
+            if rules.get(name) != current.rules.get(name)
+        )
+        self.stdout.write(
+            f"Changes from v{current.version}: {', '.join(changed) if changed else 'none'}"
+        )
+        if options['dry_run']:
+            return
+        if not changed:
+            raise CommandError(f'Policy is identical to the active v{current.version}')
+        
+        policy = publish_policy(rules, options['notes'])
+        self.stdout.write(self.style.SUCCESS(f'Published credit policy v{policy.version}'))
\ No newline at end of file
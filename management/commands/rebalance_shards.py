@@ -0,0 +1,46 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.models import Customer
+from loans.sharding import move_customers, shard_aliases, shard_for, sharding_enabled
+
+
+class Command(BaseCommand):
+    help = (
+        'Move customers that the current shard map places on another shard, '
+        'together with their loans, archived loans and scores'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Customers moved per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many customers would move')
+    
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('Sharding is not configured (SHARD_DATABASE_URLS is empty)')
+        
+        batch_size = options['batch_size']
+        total = 0
+        for source in shard_aliases():
+            misplaced = defaultdict(list)
+            customer_ids = Customer.objects.using(source).order_by('customer_id').values_list(
+                'customer_id', flat=True
+            ).iterator(chunk_size=batch_size)
+            for customer_id in customer_ids:
+                target = shard_for(customer_id)
+                if target != source:
+                    misplaced[target].append(customer_id)
+            
+            for target, ids in sorted(misplaced.items()):
+                self.stdout.write(f'{source} -> {target}: {len(ids)} customers')
+                total += len(ids)
+                if options['dry_run']:
+                    continue
+                for start in range(0, len(ids), batch_size):
+                    move_customers(ids[start:start + batch_size], source, target)
+        
+        verb = 'would move' if options['dry_run'] else 'moved'
+        self.stdout.write(self.style.SUCCESS(f'Rebalance {verb} {total} customers'))
\ No newline at end of file
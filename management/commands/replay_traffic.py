@@ -0,0 +1,85 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.models import Customer
+from loans.sharding import scatter
+from loans.traffic import compare_reports, customer_remapper, load_capture, replay
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay captured production traffic against this build in-process and report '
+        'per-endpoint latency and throughput. Replayed writes land in the configured '
+        'database: run it against a staging copy, never production.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('captures', nargs='+', help='Capture files or directories')
+        parser.add_argument('--speedup', type=float, default=1.0,
+                            help='Replay this many times faster than captured; 0 for as fast as possible')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Requests in flight at once')
+        parser.add_argument('--remap-customers', action='store_true',
+                            help='Map captured pseudonymous customer ids onto existing customers')
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+        parser.add_argument('--compare', help='Baseline report (from --output of another build) to diff against')
+    
+    def handle(self, *args, **options):
+        records = load_capture(options['captures'])
+        if not records:
+            raise CommandError('No captured requests found')
+        if options['speedup'] < 0 or options['concurrency'] < 1:
+            raise CommandError('--speedup must be >= 0 and --concurrency >= 1')
+        
+        remap = None
+        if options['remap_customers']:
+            customer_ids = [
+                customer_id
+                for _, ids in scatter(lambda: list(Customer.objects.values_list('customer_id', flat=True)))
+                for customer_id in ids
+            ]
+            remap = customer_remapper(customer_ids)
+        
+        report = replay(
+            records, speedup=options['speedup'], concurrency=options['concurrency'], remap=remap
+        )
+        
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        
+        self.stdout.write(
+            f"{report['requests']} requests in {report['elapsed_seconds']:.3f}s "
+            f"({report['throughput_rps']} req/s), max schedule lag {report['max_schedule_lag_ms']} ms"
+        )
+        self.stdout.write(
+            f"{'endpoint':<22}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'req/s':>10}{'errors':>8}"
+        )
+        for view, endpoint in report['endpoints'].items():
+            self.stdout.write(
+                f"{view:<22}{endpoint['requests']:>10}{_ms(endpoint['p50_ms']):>10}"
+                f"{_ms(endpoint['p95_ms']):>10}{_ms(endpoint['p99_ms']):>10}"
+                f"{endpoint['throughput_rps']:>10}{endpoint['errors']:>8}"
+            )
+        
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write('')
+            self.stdout.write(f"{'endpoint':<22}{'metric':<16}{'baseline':>12}{'candidate':>12}{'change':>10}")
+            for view, metrics in compare_reports(baseline, report).items():
+                for metric, values in metrics.items():
+                    change = values['change_pct']
+                    self.stdout.write(
+                        f"{view:<22}{metric:<16}{_ms(values['baseline']):>12}"
+                        f"{_ms(values['candidate']):>12}"
+                        f"{'' if change is None else f'{change:+.1f}%':>10}"
+                    )
+
+
+def _ms(value):
+    if value is None:
+        return '-'
+    return str(value) if isinstance(value, int) else f'{value:.3f}'
\ No newline at end of file
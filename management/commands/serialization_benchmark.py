@@ -0,0 +1,144 @@
+import io
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from loans.messagepack import MessagePackParser, MessagePackRenderer
+from loans.models import Loan
+from loans.serializers import (
+    CustomerLoanSerializer, LoanEligibilityGridResponseSerializer, PaymentSerializer
+)
+
+
+def _money(rng, low, high):
+    return Decimal(rng.randrange(low * 100, high * 100)) / 100
+
+
+def customer_loans_payload(rng, count):
+    """Response of view_customer_loans for a customer with ``count`` loans"""
+    today = date.today()
+    loans = [
+        Loan(
+            loan_id=100000 + i,
+            loan_amount=_money(rng, 10000, 2000000),
+            tenure=rng.choice([6, 12, 24, 36, 60]),
+            interest_rate=_money(rng, 8, 20),
+            monthly_repayment=_money(rng, 500, 60000),
+            emis_paid_on_time=rng.randrange(0, 60),
+            start_date=today - timedelta(days=rng.randrange(0, 1800)),
+            end_date=today + timedelta(days=rng.randrange(0, 1800)),
+        )
+        for i in range(count)
+    ]
+    return CustomerLoanSerializer(loans, many=True).data
+
+
+def eligibility_grid_payload(rng, count):
+    """Response of check_eligibility_grid with ``count`` cells"""
+    cells = []
+    for _ in range(count):
+        interest_rate = _money(rng, 8, 20)
+        approval = rng.random() < 0.7
+        cells.append({
+            'loan_amount': _money(rng, 10000, 2000000),
+            'tenure': rng.choice([6, 12, 24, 36, 60]),
+            'interest_rate': interest_rate,
+            'approval': approval,
+            'message': 'Loan approved' if approval else 'EMI exceeds 50% of monthly salary',
+            'corrected_interest_rate': max(interest_rate, Decimal('12.00')),
+            'monthly_installment': _money(rng, 500, 60000),
+        })
+    return LoanEligibilityGridResponseSerializer(
+        {'customer_id': 1, 'policy_version': 1, 'cells': cells}
+    ).data
+
+
+def payments_payload(rng, count):
+    """Request body of a payments batch with ``count`` events"""
+    today = date.today()
+    return PaymentSerializer([
+        {
+            'payment_reference': f'PAY-{i:08d}',
+            'loan_id': 100000 + rng.randrange(count),
+            'amount': _money(rng, 500, 60000),
+            'paid_on': today - timedelta(days=rng.randrange(0, 365)),
+            'emis': 1,
+            'on_time': rng.random() < 0.9,
+        }
+        for i in range(count)
+    ], many=True).data
+
+
+PAYLOADS = {
+    'view_customer_loans': customer_loans_payload,
+    'eligibility_grid': eligibility_grid_payload,
+    'payments_batch': payments_payload,
+}
+
+
+def _best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def benchmark(data, repeat):
+    """Size and best encode/decode time of ``data`` as JSON and MessagePack"""
+    results = {}
+    for name, renderer, parser in (
+            ('json', JSONRenderer(), JSONParser()),
+            ('msgpack', MessagePackRenderer(), MessagePackParser())):
+        payload = renderer.render(data)
+        results[name] = {
+            'bytes': len(payload),
+            'encode_ms': round(_best_time(lambda: renderer.render(data), repeat) * 1000, 3),
+            'decode_ms': round(
+                _best_time(lambda: parser.parse(io.BytesIO(payload)), repeat) * 1000, 3
+            ),
+        }
+    results['size_ratio'] = round(results['msgpack']['bytes'] / results['json']['bytes'], 3)
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and encode/decode time of JSON and MessagePack'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000,
+                            help='Loans, grid cells or payments per payload')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Timed runs per measurement; the best one is reported')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        report = {
+            name: benchmark(build(rng, options['items']), options['repeat'])
+            for name, build in PAYLOADS.items()
+        }
+        
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        
+        self.stdout.write(
+            f"{'payload':<22}{'format':<10}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}"
+        )
+        for name, results in report.items():
+            for format_name in ('json', 'msgpack'):
+                result = results[format_name]
+                self.stdout.write(
+                    f"{name:<22}{format_name:<10}{result['bytes']:>12}"
+                    f"{result['encode_ms']:>12.3f}{result['decode_ms']:>12.3f}"
+                )
+            self.stdout.write(f"{'':<22}{'ratio':<10}{results['size_ratio']:>12.3f}")
\ No newline at end of file
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loans.simulation import run_portfolio_simulation
+
+
+class Command(BaseCommand):
+    help = 'Run the Monte Carlo loss simulation over the active loan book and cache the report'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes used to simulate scenario batches')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Scenarios simulated per batch')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Loans held in memory per scenario batch')
+    
+    def handle(self, *args, **options):
+        if options['seed'] < 0:
+            raise CommandError('--seed must be a non-negative integer')
+        report = run_portfolio_simulation(
+            scenarios=options['scenarios'],
+            seed=options['seed'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            loan_chunk_size=options['chunk_size'],
+            use_cache=False
+        )
+        self.stdout.write(json.dumps(report, indent=2))
\ No newline at end of file
@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that only ingestion code paths may import
+HEAVY_MODULES = ('pandas', 'openpyxl', 'xlrd', 'pyarrow')
+
+# Runs in a fresh interpreter. "web" loads the WSGI application like a
+# gunicorn worker and serves one request; "worker" loads the Celery app and
+# imports its task modules like a worker at startup.
+PROBE = '''
+import importlib, json, os, sys, time
+started = time.perf_counter()
+mode, path, heavy = sys.argv[1], sys.argv[2], sys.argv[3].split(',')
+project = os.environ['DJANGO_SETTINGS_MODULE'].rpartition('.')[0]
+result = {'mode': mode}
+if mode == 'web':
+    application = importlib.import_module(project + '.wsgi').application
+    result['import_seconds'] = time.perf_counter() - started
+    from wsgiref.util import setup_testing_defaults
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    result['status'] = statuses[0]
+    result['first_request_seconds'] = time.perf_counter() - started
+else:
+    import django
+    importlib.import_module(project)
+    django.setup()
+    from celery import current_app
+    current_app.loader.import_default_modules()
+    result['import_seconds'] = time.perf_counter() - started
+try:
+    import resource
+    result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+except ImportError:
+    result['max_rss_mb'] = None
+result['heavy_modules'] = sorted(name for name in heavy if name in sys.modules)
+print(json.dumps(result))
+'''
+
+
+def run_probe(mode, path='/metrics/coalescing/', heavy_modules=HEAVY_MODULES):
+    """Start one fresh process in ``mode`` and return its startup measurements"""
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'credit_system.settings'),
+        PYTHONPATH=os.pathsep.join(path_entry for path_entry in sys.path if path_entry),
+    )
+    completed = subprocess.run(
+        [sys.executable, '-c', PROBE, mode, path, ','.join(heavy_modules)],
+        capture_output=True, text=True, env=env, cwd=str(settings.BASE_DIR)
+    )
+    if completed.returncode != 0:
+        raise CommandError(f'{mode} probe failed:\n{completed.stderr}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure time-to-first-request and resident memory of fresh web and worker '
+        'processes, and fail if startup imports ingestion-only modules'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3,
+                            help='Fresh web processes started concurrently')
+        parser.add_argument('--path', default='/metrics/coalescing/',
+                            help='Path of the first request served by each web process')
+        parser.add_argument('--max-first-request-seconds', type=float,
+                            help='Fail if any web process takes longer to serve its first request')
+        parser.add_argument('--max-rss-mb', type=float,
+                            help='Fail if any process exceeds this resident memory')
+        parser.add_argument('--skip-worker', action='store_true',
+                            help='Do not measure the Celery worker startup')
+    
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(
+                lambda _: run_probe('web', options['path']), range(options['workers'])
+            ))
+        if not options['skip_worker']:
+            results.append(run_probe('worker'))
+        
+        failures = []
+        for result in results:
+            self.stdout.write(json.dumps(result))
+            if result['heavy_modules']:
+                failures.append(f"{result['mode']} startup imported {', '.join(result['heavy_modules'])}")
+            first_request = result.get('first_request_seconds')
+            if options['max_first_request_seconds'] and first_request and (
+                    first_request > options['max_first_request_seconds']):
+                failures.append(f'first request took {first_request:.3f}s')
+            rss = result['max_rss_mb']
+            if options['max_rss_mb'] and rss and rss > options['max_rss_mb']:
+                failures.append(f"{result['mode']} process used {rss:.1f} MB")
+        
+        if failures:
+            raise CommandError('Startup budget exceeded: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Startup within budget'))
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+MessagePack parser and renderer for machine-to-machine callers.
+
+Selected with ``Accept: application/msgpack`` / ``Content-Type:
+application/msgpack``. Money, dates and UUIDs use compact extension types
+that round-trip exactly instead of the strings JSON needs:
+
+* Decimal: ext 1, a signed exponent byte followed by the signed big-endian
+  coefficient (``Decimal('1234.50')`` is 4 bytes of payload)
+* date: ext 2, the proleptic ordinal as a 4-byte unsigned integer
+* UUID: ext 3, the 16 raw bytes
+* aware datetime: the standard MessagePack timestamp (ext -1)
+
+Serializers render Decimal, date, datetime and UUID fields as strings; the
+renderer encodes those strings compactly using the serializer that produced
+the response data, so no view has to know which format was negotiated.
+"""
+import struct
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import msgpack
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+MEDIA_TYPE = 'application/msgpack'
+
+EXT_DECIMAL = 1
+EXT_DATE = 2
+EXT_UUID = 3
+
+_DATE = struct.Struct('>I')
+
+
+# Signed exponent byte of every encodable exponent
+_EXPONENTS = {exponent: struct.pack('>b', exponent) for exponent in range(-128, 128)}
+
+
+def _decimal_ext(coefficient, exponent):
+    return msgpack.ExtType(EXT_DECIMAL, _EXPONENTS[exponent] + coefficient.to_bytes(
+        coefficient.bit_length() // 8 + 1, 'big', signed=True
+    ))
+
+
+def _pack_decimal(value):
+    sign, digits, exponent = value.as_tuple()
+    if exponent not in _EXPONENTS:
+        raise ValueError(f'Cannot encode {value} as MessagePack')
+    coefficient = int(''.join(map(str, digits)) or '0')
+    return _decimal_ext(-coefficient if sign else coefficient, exponent)
+
+
+def _pack_decimal_string(value):
+    """Ext type of a plain decimal string such as DecimalField renders, without parsing a Decimal"""
+    whole, _, fraction = value.partition('.')
+    return _decimal_ext(int(whole + fraction), -len(fraction))
+
+
+def _unpack_decimal(data):
+    exponent = struct.unpack_from('>b', data)[0]
+    return Decimal(int.from_bytes(data[1:], 'big', signed=True)).scaleb(exponent)
+
+
+def _pack_date(value):
+    return msgpack.ExtType(EXT_DATE, _DATE.pack(value.toordinal()))
+
+
+def _pack_uuid(value):
+    return msgpack.ExtType(EXT_UUID, value.bytes)
+
+
+def _pack_datetime(value):
+    # Naive datetimes have no timestamp encoding and stay strings
+    return value if value.tzinfo is not None else None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return _pack_decimal(value)
+    if isinstance(value, datetime):
+        raise TypeError(f'Cannot encode naive datetime {value} as MessagePack')
+    if isinstance(value, date):
+        return _pack_date(value)
+    if isinstance(value, uuid.UUID):
+        return _pack_uuid(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} as MessagePack')
+
+
+def _ext_hook(code, data):
+    if code == EXT_DECIMAL:
+        return _unpack_decimal(data)
+    if code == EXT_DATE:
+        return date.fromordinal(_DATE.unpack(data)[0])
+    if code == EXT_UUID:
+        return uuid.UUID(bytes=data)
+    return msgpack.ExtType(code, data)
+
+
+def packb(data):
+    return msgpack.packb(data, default=_default, datetime=True, use_bin_type=True)
+
+
+def unpackb(payload):
+    return msgpack.unpackb(payload, ext_hook=_ext_hook, timestamp=3, raw=False)
+
+
+# Rendered string -> wire value (None keeps the string)
+_CONVERTERS = (
+    (serializers.DecimalField, _pack_decimal_string),
+    (serializers.DateTimeField, lambda value: _pack_datetime(datetime.fromisoformat(value))),
+    (serializers.DateField, lambda value: _pack_date(date.fromisoformat(value))),
+    (serializers.UUIDField, lambda value: _pack_uuid(uuid.UUID(value))),
+)
+
+
+def _scalar_converter(pack):
+    def convert(value):
+        if not isinstance(value, str):
+            return value
+        try:
+            packed = pack(value)
+        except ValueError:
+            return value  # a custom output format; keep the rendered string
+        return value if packed is None else packed
+    return convert
+
+
+def _list_converter(child):
+    if child is None:
+        return None
+    return lambda items: [child(item) for item in items] if isinstance(items, list) else items
+
+
+def _converter(field):
+    """How to encode the rendered value of ``field`` compactly, or None to keep it"""
+    if isinstance(field, serializers.ListSerializer):
+        return _list_converter(_converter(field.child))
+    if isinstance(field, serializers.BaseSerializer):
+        return _serializer_converter(field)
+    if isinstance(field, serializers.ListField):
+        return _list_converter(_converter(field.child))
+    for field_class, pack in _CONVERTERS:
+        if isinstance(field, field_class):
+            return _scalar_converter(pack)
+    return None
+
+
+def _serializer_converter(serializer):
+    plan = [
+        (name, convert) for name, convert in (
+            (field.field_name, _converter(field))
+            for field in serializer.fields.values() if not field.write_only
+        )
+        if convert is not None
+    ]
+    if not plan:
+        return None
+    
+    def convert(row):
+        if not isinstance(row, dict):
+            return row
+        # A copy: response data may be shared with coalesced requests
+        row = dict(row)
+        for name, convert_value in plan:
+            value = row.get(name)
+            if value is not None:
+                row[name] = convert_value(value)
+        return row
+    return convert
+
+
+def native_values(data):
+    """
+    Replace the strings rendered for Decimal, date, datetime and UUID fields
+    with their compact encoding, for data that knows its serializer
+    """
+    serializer = getattr(data, 'serializer', None)
+    if serializer is None:
+        return data
+    convert = _converter(serializer)
+    return convert(data) if convert else data
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(native_values(data))
+
+
+class MessagePackParser(BaseParser):
+    media_type = MEDIA_TYPE
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            # Malformed extension payloads raise struct.error in the ext hook
+            return unpackb(stream.read())
+        except (ValueError, TypeError, struct.error, msgpack.UnpackException) as e:
+            raise ParseError(f'MessagePack parse error - {str(e)}')
\ No newline at end of file
@@ -1,6 +1,119 @@
 from django.db import models
+from django.db.models import (
+    Case, Count, DecimalField, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+)
+from django.db.models.functions import Cast, Coalesce, Floor, Greatest, Least
 from django.core.validators import MinValueValidator, MaxValueValidator
+from datetime import date
+from decimal import Decimal
 import math
+import uuid
+from .identity import forget
+
+
+def loan_score_aggregates(prefix='', current_year=None):
+    """Aggregate expressions feeding the credit score, relative to ``prefix``"""
+    if current_year is None:
+        current_year = date.today().year
+    return {
+        'total_loans': Count(f'{prefix}loan_id'),
+        'loans_paid_on_time': Count(
+            f'{prefix}loan_id',
+            filter=Q(**{f'{prefix}emis_paid_on_time__gte': F(f'{prefix}tenure')})
+        ),
+        'current_year_loans': Count(
+            f'{prefix}loan_id',
+            filter=Q(**{f'{prefix}start_date__year': current_year})
+        ),
+        'total_volume': Sum(f'{prefix}loan_amount'),
+    }
+
+
+def customer_score_aggregates(current_year=None):
+    """
+    Customer-level score aggregates: the hot loans plus the per-customer
+    summary of archived loans. Archived loans all ended before the current
+    year and were paid on time, so they never count as current-year loans.
+    """
+    hot = loan_score_aggregates('loans__', current_year)
+    money = DecimalField(max_digits=14, decimal_places=2)
+    return {
+        'total_loans': hot['total_loans'] + Coalesce(F('archive_summary__loan_count'), Value(0)),
+        'loans_paid_on_time': hot['loans_paid_on_time'] + Coalesce(
+            F('archive_summary__loans_paid_on_time'), Value(0)
+        ),
+        'current_year_loans': hot['current_year_loans'],
+        'total_volume': ExpressionWrapper(
+            Coalesce(hot['total_volume'], Value(0), output_field=money)
+            + Coalesce(F('archive_summary__total_volume'), Value(0), output_field=money),
+            output_field=money
+        ),
+    }
+
+
+def _bands(field, bands, default):
+    """Case expression for the score band of ``field``: bands are (upper bound, score)"""
+    return Case(
+        *[When(**{f'{field}__lte': upper, 'then': Value(score)}) for upper, score in bands],
+        default=Value(default)
+    )
+
+
+class CustomerQuerySet(models.QuerySet):
+    def with_credit_score(self, today=None, policy=None):
+        """
+        Annotate the CreditScoreService score, its components and EMI
+        headroom as SQL expressions, in one grouped query over loans.
+        Components are NULL where the score is a fixed value (no loans, or
+        volume above the approved limit), as in score_from_aggregates.
+        Bands come from ``policy``, the active credit policy by default.
+        """
+        from .policy import active_policy
+        
+        today = today or date.today()
+        policy = policy or active_policy()
+        money = DecimalField(max_digits=14, decimal_places=2)
+        scored = Q(total_loans__gt=0, total_volume__lte=F('approved_limit'))
+        volume_bands, volume_default = policy.sql_bands('volume_ratio')
+        
+        return self.annotate(
+            **customer_score_aggregates(current_year=today.year),
+            current_emis=Coalesce(
+                Sum('loans__monthly_repayment', filter=Q(loans__end_date__gte=today)),
+                Value(0), output_field=money
+            ),
+        ).annotate(
+            on_time_score=Case(When(scored, then=(
+                Cast('loans_paid_on_time', FloatField()) * Value(policy.on_time_points)
+                / Cast('total_loans', FloatField())
+            ))),
+            loan_count_score=Case(When(scored, then=_bands(
+                'total_loans', *policy.sql_bands('loan_count')
+            ))),
+            current_year_score=Case(When(scored, then=_bands(
+                'current_year_loans', *policy.sql_bands('current_year_loans')
+            ))),
+            volume_score=Case(When(scored, then=Case(
+                *[
+                    When(total_volume__lte=F('approved_limit') * Value(bound), then=Value(points))
+                    for bound, points in volume_bands
+                ],
+                default=Value(volume_default)
+            ))),
+            emi_headroom=ExpressionWrapper(
+                F('monthly_salary') * Value(Decimal('0.5')) - F('current_emis'), output_field=money
+            ),
+        ).annotate(
+            credit_score=Case(
+                When(total_loans=0, then=Value(policy.new_customer_score)),  # Default score for new customers
+                When(total_volume__gt=F('approved_limit'), then=Value(0)),
+                default=Least(Value(100), Greatest(Value(0), Cast(Floor(
+                    F('on_time_score') + F('loan_count_score')
+                    + F('current_year_score') + F('volume_score')
+                ), models.IntegerField()))),
+                output_field=models.IntegerField()
+            ),
+        )
 
 
 class Customer(models.Model):
@@ -16,15 +129,46 @@ class Customer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CustomerQuerySet.as_manager()
+    
     class Meta:
         db_table = 'customers'
+        indexes = [
+            models.Index(fields=['phone_number']),
+            # Pattern opclass so the admin's last name prefix search can use the index
+            models.Index(fields=['last_name'], name='customers_last_name_like', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['created_at']),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.approved_limit:
-            # approved_limit = 36 * monthly_salary (rounded to nearest lakh)
-            limit = 36 * self.monthly_salary
-            self.approved_limit = round(limit / 100000) * 100000
+            self.approved_limit = self.calculate_approved_limit(self.monthly_salary)
+        if self.customer_id is None:
+            # The shard is picked from the customer_id, so it must be known before the insert
+            from .sharding import assign_ids
+            assign_ids([self])
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        # The persisted score depends on approved_limit; unknown previous limits count as changed
+        if not adding and self.approved_limit != getattr(self, '_loaded_approved_limit', None):
+            CreditScore.objects.using(self._state.db).filter(customer_id=self.customer_id).delete()
+        self._loaded_approved_limit = self.approved_limit
+        forget(self.customer_id)
+        if adding:
+            from .bloom import remember_phone_numbers
+            remember_phone_numbers([self.phone_number])
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_approved_limit = instance.__dict__.get('approved_limit')
+        return instance
+    
+    @staticmethod
+    def calculate_approved_limit(monthly_salary):
+        # approved_limit = 36 * monthly_salary (rounded to nearest lakh)
+        limit = 36 * monthly_salary
+        return round(limit / 100000) * 100000
     
     @property
     def name(self):
@@ -44,12 +188,18 @@ class Loan(models.Model):
     emis_paid_on_time = models.IntegerField(default=0)
     start_date = models.DateField()
     end_date = models.DateField()
+    # Credit policy version that approved the loan; null for ingested loans
+    policy_version = models.IntegerField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'loans'
+        indexes = [
+            models.Index(fields=['start_date']),
+            models.Index(fields=['end_date']),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.monthly_repayment:
@@ -65,11 +215,327 @@ class Loan(models.Model):
                 emi = principal * monthly_rate * (1 + monthly_rate)**n / ((1 + monthly_rate)**n - 1)
                 self.monthly_repayment = round(emi, 2)
         
+        if self.loan_id is None:
+            from .sharding import assign_ids
+            assign_ids([self])
+        
         super().save(*args, **kwargs)
+        # Any change to a customer's loans invalidates their persisted score
+        CreditScore.objects.using(self._state.db).filter(customer_id=self.customer_id).delete()
+        forget(self.customer_id)
+    
+    def delete(self, *args, **kwargs):
+        CreditScore.objects.using(self._state.db).filter(customer_id=self.customer_id).delete()
+        forget(self.customer_id)
+        return super().delete(*args, **kwargs)
+    
+    @property
+    def repayments_left(self):
+        return self.tenure - self.emis_paid_on_time
+    
+    def __str__(self):
+        return f"Loan {self.loan_id} - {self.customer.name}"
+
+
+class ArchivedLoan(models.Model):
+    """
+    Closed loan moved out of the hot loans table by the archival job. Keeps
+    the original loan_id so loan lookups and payments still resolve.
+    """
+    loan_id = models.IntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='archived_loans')
+    loan_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    tenure = models.IntegerField()  # in months
+    interest_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    monthly_repayment = models.DecimalField(max_digits=12, decimal_places=2)
+    emis_paid_on_time = models.IntegerField(default=0)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    policy_version = models.IntegerField(null=True, blank=True)
+    
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    COPIED_FIELDS = [
+        'loan_id', 'customer_id', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment',
+        'emis_paid_on_time', 'start_date', 'end_date', 'policy_version', 'created_at', 'updated_at'
+    ]
+    
+    class Meta:
+        db_table = 'loans_archive'
+        indexes = [
+            models.Index(fields=['start_date']),
+        ]
+    
+    @classmethod
+    def from_loan(cls, loan):
+        return cls(**{field: getattr(loan, field) for field in cls.COPIED_FIELDS})
     
     @property
     def repayments_left(self):
         return self.tenure - self.emis_paid_on_time
     
     def __str__(self):
-        return f"Loan {self.loan_id} - {self.customer.name}"
\ No newline at end of file
+        return f"Archived loan {self.loan_id} - customer {self.customer_id}"
+
+
+class LoanArchiveSummary(models.Model):
+    """Per-customer aggregates of archived loans, added to the hot loans by scoring"""
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='archive_summary'
+    )
+    loan_count = models.IntegerField(default=0)
+    loans_paid_on_time = models.IntegerField(default=0)
+    total_volume = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'loan_archive_summaries'
+    
+    def __str__(self):
+        return f"{self.loan_count} archived loans for customer {self.customer_id}"
+
+
+class CreditScore(models.Model):
+    """Persisted credit score written by the scheduled re-scoring job"""
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='credit_score_record'
+    )
+    credit_score = models.IntegerField()
+    on_time_score = models.FloatField(null=True, blank=True)
+    loan_count_score = models.IntegerField(null=True, blank=True)
+    current_year_score = models.IntegerField(null=True, blank=True)
+    volume_score = models.IntegerField(null=True, blank=True)
+    total_loans = models.IntegerField(default=0)
+    score_year = models.IntegerField()  # scores depend on the current year
+    policy_version = models.IntegerField(default=0)  # and on the credit policy
+    
+    scored_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'credit_scores'
+    
+    def __str__(self):
+        return f"Credit score {self.credit_score} for customer {self.customer_id}"
+
+
+class ScoringRun(models.Model):
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    score_year = models.IntegerField()
+    chunk_size = models.IntegerField()
+    total_chunks = models.IntegerField(default=0)
+    customers_scored = models.IntegerField(default=0)
+    customers_per_second = models.FloatField(null=True, blank=True)
+    
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'scoring_runs'
+    
+    def __str__(self):
+        return f"Scoring run {self.pk} ({self.status})"
+
+
+class ScoringChunk(models.Model):
+    """A customer_id range of a scoring run; completed chunks are skipped on resume"""
+    run = models.ForeignKey(ScoringRun, on_delete=models.CASCADE, related_name='chunks')
+    first_customer_id = models.IntegerField()
+    last_customer_id = models.IntegerField()
+    customers_scored = models.IntegerField(default=0)
+    duration_seconds = models.FloatField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'scoring_chunks'
+        unique_together = [('run', 'first_customer_id')]
+    
+    def __str__(self):
+        return f"Chunk {self.first_customer_id}-{self.last_customer_id} of run {self.run_id}"
+
+
+class IdBlock(models.Model):
+    """High-water mark of the global primary key allocator used when sharding"""
+    name = models.CharField(max_length=64, primary_key=True)  # db_table of the model
+    next_id = models.BigIntegerField()
+    
+    class Meta:
+        db_table = 'id_blocks'
+    
+    def __str__(self):
+        return f"{self.name}: next id {self.next_id}"
+
+
+class CreditPolicy(models.Model):
+    """Published version of the credit policy rules; the highest version is active"""
+    version = models.PositiveIntegerField(unique=True)
+    rules = models.JSONField()  # see loans.policy
+    notes = models.CharField(max_length=255, blank=True)
+    
+    published_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'credit_policies'
+    
+    def __str__(self):
+        return f"Credit policy v{self.version}"
+
+
+class PhoneFilterSnapshot(models.Model):
+    """Persisted Bloom filter of customer phone numbers (see loans.bloom)"""
+    bit_count = models.BigIntegerField()
+    hash_count = models.PositiveSmallIntegerField()
+    bits = models.BinaryField()
+    # Customers created before this are in the filter; later ones are synced from the table
+    built_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'phone_filter_snapshots'
+    
+    def __str__(self):
+        return f"Phone filter of {self.built_at:%Y-%m-%d %H:%M} ({self.bit_count} bits)"
+
+
+class IdempotencyRecord(models.Model):
+    """Response stored for a request made with an idempotency key"""
+    scope = models.CharField(max_length=64)  # view name
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the method, path and payload
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # null while in progress
+    body = models.BinaryField(null=True, blank=True)  # zlib-compressed JSON
+    headers = models.JSONField(null=True, blank=True)  # idempotency.STORED_HEADERS set by the view
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Lease of the request in progress, then the retention of the stored response
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        db_table = 'idempotency_records'
+        unique_together = [('scope', 'key')]
+    
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status_code or 'in progress'})"
+
+
+class IngestionCheckpoint(models.Model):
+    """Rows of a spreadsheet committed so far, keyed by the file's content hash"""
+    KIND_CUSTOMERS = 'customers'
+    KIND_LOANS = 'loans'
+    KIND_CHOICES = [
+        (KIND_CUSTOMERS, 'Customers'),
+        (KIND_LOANS, 'Loans'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    file_hash = models.CharField(max_length=64)
+    rows_committed = models.IntegerField(default=0)
+    total_rows = models.IntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'ingestion_checkpoints'
+        unique_together = [('kind', 'file_hash')]
+    
+    def __str__(self):
+        return f"{self.kind} {self.file_hash[:12]}: {self.rows_committed}/{self.total_rows} rows"
+
+
+class Payment(models.Model):
+    """Ledger of posted EMI repayments, idempotent by payment reference"""
+    payment_reference = models.CharField(max_length=64, unique=True)
+    # No database constraint so the ledger outlives archived or moved loans
+    loan = models.ForeignKey(
+        Loan, on_delete=models.DO_NOTHING, db_constraint=False, related_name='payments'
+    )
+    emis = models.PositiveSmallIntegerField(default=1)
+    on_time = models.BooleanField(default=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    paid_on = models.DateField()
+    # Set once the loan has been updated; pending payments are applied by apply_pending_payments
+    applied = models.BooleanField(default=False)
+    
+    posted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'payments'
+        indexes = [
+            models.Index(fields=['posted_at'], name='payments_pending_idx', condition=Q(applied=False)),
+        ]
+    
+    def __str__(self):
+        return f"Payment {self.payment_reference} for loan {self.loan_id}"
+
+
+class AppliedPayment(models.Model):
+    """
+    Marks a ledger payment as applied to its loan. Stored on the customer's
+    shard and written in the same transaction as the loan update, so a
+    payment is applied once however often applying it is retried.
+    """
+    payment_reference = models.CharField(max_length=64, unique=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='applied_payments')
+    
+    applied_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'applied_payments'
+    
+    def __str__(self):
+        return f"Payment {self.payment_reference} applied for customer {self.customer_id}"
+
+
+class LoanApplication(models.Model):
+    """
+    A loan request accepted by the asynchronous origination endpoint and
+    decided later by the origination workers. Stored on the customer's
+    shard so the decision and the booked loan commit together.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+    
+    application_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Not a foreign key: unknown customers are decided like create_loan decides them
+    customer_id = models.IntegerField()
+    loan_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    interest_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    tenure = models.IntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    
+    # Outcome, in the shape of the create_loan response
+    loan_approved = models.BooleanField(null=True, blank=True)
+    loan_id = models.IntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    monthly_installment = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    policy_version = models.IntegerField(null=True, blank=True)
+    
+    claim_token = models.UUIDField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    decided_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'loan_applications'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Loan application {self.application_id} ({self.status})"
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Versioned credit policy: the score bands of CreditScoreService and the
+rate correction of LoanEligibilityService.
+
+Policies are JSON documents stored as immutable CreditPolicy versions; the
+highest version is active. With no published version the built-in
+DEFAULT_RULES apply as version 0. Band tables are lists of inclusive upper
+``bounds`` and one more value than bounds, the last one applying above the
+highest bound:
+    
+    {"bounds": [2, 5, 10], "points": [20, 15, 10, 5]}
+
+gives 20 points up to 2 loans, 15 up to 5, 10 up to 10 and 5 above.
+``rate_bands`` gives per score band whether to approve and the minimum
+interest rate, null for no minimum.
+
+The active policy is compiled once into sorted threshold lists evaluated
+with bisection (count bands into tables indexed by the count) and cached
+per process; every RELOAD_INTERVAL seconds the
+process checks for a newer version, so a published policy is live
+everywhere within that interval without a deploy.
+"""
+import bisect
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+
+DEFAULT_RULES = {
+    'new_customer_score': 50,
+    'on_time_points': 40,
+    'loan_count': {'bounds': [2, 5, 10], 'points': [20, 15, 10, 5]},
+    'current_year_loans': {'bounds': [0, 2, 4], 'points': [20, 15, 10, 5]},
+    'volume_ratio': {'bounds': ['0.3', '0.6', '0.8'], 'points': [20, 15, 10, 5]},
+    'rate_bands': {
+        'bounds': [10, 30, 50],
+        'approve': [False, True, True, True],
+        'min_rates': [None, '16.0', '12.0', None],
+    },
+}
+
+APPROVED = 'Loan approved'
+APPROVED_CORRECTED = 'Loan approved with corrected interest rate'
+REJECTED_LOW_SCORE = 'Loan not approved due to low credit score'
+
+MAX_COUNT_BOUND = 10000
+
+
+class PolicyError(ValueError):
+    """A credit policy document that cannot be compiled"""
+
+
+class CompiledPolicy:
+    """A credit policy version ready for evaluation"""
+    
+    def __init__(self, version, rules):
+        self.version = version
+        self.rules = rules
+        try:
+            self.new_customer_score = int(rules['new_customer_score'])
+            self.on_time_points = float(rules['on_time_points'])
+            self.loan_count = _table(rules['loan_count'], 'points', int, int)
+            self.current_year_loans = _table(rules['current_year_loans'], 'points', int, int)
+            self.volume_ratio = _table(rules['volume_ratio'], 'points', Decimal, int)
+            self.rate_bands = _table(rules['rate_bands'], 'min_rates', float, _min_rate)
+            self.rate_approve = [bool(value) for value in rules['rate_bands']['approve']]
+            if len(self.rate_approve) != len(self.rate_bands[1]):
+                raise PolicyError('rate_bands needs one approve flag per min_rates entry')
+        except PolicyError:
+            raise
+        except KeyError as e:
+            raise PolicyError(f'Missing policy rule {e}')
+        except (TypeError, ValueError, InvalidOperation) as e:
+            raise PolicyError(f'Invalid policy rule: {str(e)}')
+        self._loan_count_points = _dense(*self.loan_count)
+        self._current_year_points = _dense(*self.current_year_loans)
+        self._volume_bounds = [float(bound) for bound in self.volume_ratio[0]]
+        self._rate_bounds = self.rate_bands[0]
+        self._rate_decisions = list(zip(self.rate_approve, self.rate_bands[1]))
+    
+    def loan_count_points(self, total_loans):
+        points = self._loan_count_points
+        return points[total_loans] if total_loans < len(points) else points[-1]
+    
+    def current_year_points(self, current_year_loans):
+        points = self._current_year_points
+        return points[current_year_loans] if current_year_loans < len(points) else points[-1]
+    
+    def volume_points(self, volume_ratio):
+        return self.volume_ratio[1][bisect.bisect_left(self._volume_bounds, volume_ratio)]
+    
+    def apply(self, credit_score, interest_rate):
+        """
+        Approval and corrected interest rate for a credit score.
+        Returns (approval, corrected_interest_rate, message).
+        """
+        approve, min_rate = self._rate_decisions[bisect.bisect_left(self._rate_bounds, credit_score)]
+        if not approve:
+            return False, interest_rate, REJECTED_LOW_SCORE
+        if min_rate is None or interest_rate >= min_rate:
+            return True, interest_rate, APPROVED
+        return True, min_rate, APPROVED_CORRECTED
+    
+    def sql_bands(self, name):
+        """(upper bound, points) pairs and the default points of a band table, for SQL"""
+        bounds, points = getattr(self, name)
+        return list(zip(bounds, points)), points[-1]
+
+
+def _min_rate(value):
+    return None if value is None else Decimal(str(value))
+
+
+def _dense(bounds, values):
+    """Value of every count from 0 to one past the last bound, for direct indexing"""
+    if bounds and not 0 <= bounds[0] <= bounds[-1] <= MAX_COUNT_BOUND:
+        raise PolicyError(f'Count bounds must be between 0 and {MAX_COUNT_BOUND}: {bounds}')
+    size = bounds[-1] + 2 if bounds else 1
+    return [values[bisect.bisect_left(bounds, count)] for count in range(size)]
+
+
+def _table(table, values_key, bound_type, value_type):
+    bounds = [bound_type(bound) for bound in table['bounds']]
+    values = [value_type(value) for value in table[values_key]]
+    if any(low >= high for low, high in zip(bounds, bounds[1:])):
+        raise PolicyError(f'Bounds must be strictly increasing: {table["bounds"]}')
+    if len(values) != len(bounds) + 1:
+        raise PolicyError(f'Expected {len(bounds) + 1} {values_key} for {len(bounds)} bounds')
+    return bounds, values
+
+
+def compile_policy(rules, version=None):
+    """Validate and compile a policy document; raises PolicyError"""
+    if not isinstance(rules, dict):
+        raise PolicyError('A policy must be a JSON object')
+    return CompiledPolicy(version, rules)
+
+
+class _PolicyCache:
+    """The compiled active policy of this process"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._policy = None
+        self._checked_at = 0.0
+    
+    def get(self):
+        policy = self._policy
+        if policy is None or time.monotonic() - self._checked_at >= settings.CREDIT_POLICY['RELOAD_INTERVAL']:
+            with self._lock:
+                policy = self._policy = self._load(self._policy)
+                self._checked_at = time.monotonic()
+        return policy
+    
+    def _load(self, current):
+        from .models import CreditPolicy
+        
+        latest = CreditPolicy.objects.order_by('-version').values_list('version', flat=True).first()
+        if current is not None and current.version == (latest or 0):
+            return current
+        if latest is None:
+            return compile_policy(DEFAULT_RULES, 0)
+        rules = CreditPolicy.objects.values_list('rules', flat=True).get(version=latest)
+        return compile_policy(rules, latest)
+    
+    def clear(self):
+        with self._lock:
+            self._policy = None
+            self._checked_at = 0.0
+
+
+_cache = _PolicyCache()
+
+
+def active_policy():
+    """The highest published policy version, compiled"""
+    return _cache.get()
+
+
+def reload_policy():
+    """Drop this process's compiled policy so the next decision loads the latest version"""
+    _cache.clear()
+
+
+def publish_policy(rules, notes=''):
+    """Store ``rules`` as the next policy version and make it active in this process"""
+    from .models import CreditPolicy
+    
+    compile_policy(rules)
+    with transaction.atomic():
+        latest = CreditPolicy.objects.select_for_update().order_by('-version').first()
+        policy = CreditPolicy.objects.create(
+            version=(latest.version if latest else 0) + 1, rules=rules, notes=notes
+        )
+    transaction.on_commit(reload_policy)
+    return policy
\ No newline at end of file
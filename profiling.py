@@ -0,0 +1,227 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries a signed profiling header or is
+picked by the sampling rate. Its call-tree timings and the SQL it ran are
+stored under REQUEST_PROFILING['PROFILES_DIR'] as a ``.prof`` file (for
+pstats/snakeviz) next to a JSON summary.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_RE = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{12}$')
+_SIGNING_SALT = 'loans.profiling'
+_SIGNED_VALUE = 'profile'
+
+
+def profiling_token():
+    """Signed value for the profiling header, valid for SIGNATURE_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=_SIGNING_SALT).sign(_SIGNED_VALUE)
+
+
+def _valid_token(token):
+    try:
+        value = signing.TimestampSigner(salt=_SIGNING_SALT).unsign(
+            token, max_age=settings.REQUEST_PROFILING['SIGNATURE_MAX_AGE']
+        )
+    except signing.BadSignature:
+        return False
+    return value == _SIGNED_VALUE
+
+
+class _QueryRecorder:
+    """DB execute wrapper recording every statement and its duration"""
+    
+    def __init__(self):
+        self.queries = []
+    
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+class RequestProfilingMiddleware:
+    """
+    Runs selected requests under cProfile. Removed from the middleware
+    chain entirely when REQUEST_PROFILING['ENABLED'] is off.
+    """
+    
+    def __init__(self, get_response):
+        options = settings.REQUEST_PROFILING
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = 'HTTP_' + options['HEADER'].upper().replace('-', '_')
+        self.sample_rate = options['SAMPLE_RATE']
+    
+    def __call__(self, request):
+        token = request.META.get(self.header)
+        if token is not None:
+            profile = _valid_token(token)
+        else:
+            profile = self.sample_rate > 0 and random.random() < self.sample_rate
+        
+        if not profile:
+            return self.get_response(request)
+        return self._profile(request)
+    
+    def _profile(self, request):
+        profiler = cProfile.Profile()
+        recorder = _QueryRecorder()
+        
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            started = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this thread
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - started
+        
+        try:
+            profile_id = save_profile(request, response, profiler, recorder.queries, duration)
+        except OSError as e:
+            logger.error(f"Could not store profile for {request.path}: {str(e)}")
+        else:
+            response['X-Profile-Id'] = profile_id
+        return response
+
+
+def _function_name(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f'{os.path.basename(filename)}:{line}({name})'
+
+
+def _call_tree(profiler, limit):
+    """Top functions by cumulative time with the callers that account for it"""
+    stats = pstats.Stats(profiler).stats
+    functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    
+    tree = []
+    for func, (_, calls, own_time, cumulative_time, callers) in functions:
+        caller_times = sorted(
+            ((_function_name(caller), timing[3]) for caller, timing in callers.items()),
+            key=lambda item: item[1], reverse=True
+        )[:5]
+        tree.append({
+            'function': _function_name(func),
+            'calls': calls,
+            'own_ms': round(own_time * 1000, 3),
+            'cumulative_ms': round(cumulative_time * 1000, 3),
+            'callers': [
+                {'function': name, 'cumulative_ms': round(seconds * 1000, 3)}
+                for name, seconds in caller_times
+            ],
+        })
+    return tree
+
+
+def _profiles_dir():
+    return str(settings.REQUEST_PROFILING['PROFILES_DIR'])
+
+
+def save_profile(request, response, profiler, queries, duration):
+    """Write the .prof and JSON summary for one request and prune old profiles"""
+    options = settings.REQUEST_PROFILING
+    directory = _profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+    
+    now = datetime.now(timezone.utc)
+    profile_id = f"{now.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:12]}"
+    match = getattr(request, 'resolver_match', None)
+    
+    summary = {
+        'id': profile_id,
+        'created_at': now.isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'view': match.view_name if match else None,
+        'status_code': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'sql_count': len(queries),
+        'sql_ms': round(sum(query['duration_ms'] for query in queries), 3),
+        'functions': _call_tree(profiler, options['TOP_FUNCTIONS']),
+        'queries': queries,
+    }
+    
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f)
+    
+    _prune(directory, options['MAX_PROFILES'])
+    return profile_id
+
+
+def _prune(directory, keep):
+    """Delete all but the ``keep`` newest profiles; 0 or less keeps them all"""
+    if keep <= 0:
+        return
+    profile_ids = sorted(
+        name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')
+    )
+    for profile_id in profile_ids[:-keep]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit=50):
+    """Summaries of the most recent profiles, newest first, without functions and queries"""
+    directory = _profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    
+    names = sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary.pop('functions', None)
+        summary.pop('queries', None)
+        profiles.append(summary)
+    return profiles
+
+
+def profile_path(profile_id, extension):
+    """Path of a stored profile file, or None if the id is malformed or unknown"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(_profiles_dir(), f'{profile_id}.{extension}')
+    return path if os.path.exists(path) else None
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+Slow-query log.
+
+A DB execute wrapper installed on every connection times each statement.
+Statements slower than SLOW_QUERY_LOG['THRESHOLD_MS'] are written as JSON
+lines to a rotating log with the view or Celery task they ran under, the
+app function that issued them and their normalized SQL. The first
+occurrence of every query shape also gets its EXPLAIN plan, and running
+counts per shape are kept for the metrics endpoint.
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('loans.slow_queries')
+
+_origin = contextvars.ContextVar('slow_query_origin', default=None)
+_explaining = contextvars.ContextVar('slow_query_explaining', default=False)
+
+_lock = threading.Lock()
+_shapes = {}
+_handler = None
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_VALUES_RE = re.compile(r'\bVALUES\s*(\([^)]*\))(?:\s*,\s*\([^)]*\))*', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+_APP_PACKAGE = __name__.rpartition('.')[0] or __name__
+# Loaders whose queries are attributed to the app function that called them
+_LOADER_MODULES = {__name__, f'{_APP_PACKAGE}.identity'}
+
+
+def normalize_sql(sql):
+    """Collapse literals, IN lists and multi-row VALUES so equivalent queries share one shape"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    sql = _VALUES_RE.sub(r'VALUES \1, ...', sql)
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+def _calling_function():
+    """Innermost app function (outside this module and the loaders) on the current stack"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(_APP_PACKAGE + '.') and module not in _LOADER_MODULES:
+            code = frame.f_code
+            return f"{module.rpartition('.')[2]}.{getattr(code, 'co_qualname', code.co_name)}"
+        frame = frame.f_back
+    return None
+
+
+def _explain(connection, sql, params):
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        return None
+    
+    token = _explaining.set(True)
+    try:
+        # A savepoint keeps a failing EXPLAIN from breaking the caller's transaction
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(prefix + sql, params)
+                return [' | '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError as e:
+        return [f'EXPLAIN failed: {e}']
+    finally:
+        _explaining.reset(token)
+
+
+def _get_handler():
+    global _handler
+    options = settings.SLOW_QUERY_LOG
+    log_file = os.path.abspath(str(options['LOG_FILE']))
+    if _handler is not None and _handler.baseFilename != log_file:
+        logger.removeHandler(_handler)
+        _handler.close()
+        _handler = None
+    if _handler is None:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        _handler = RotatingFileHandler(
+            log_file, maxBytes=options['MAX_BYTES'], backupCount=options['BACKUP_COUNT'],
+            encoding='utf-8'
+        )
+        _handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(_handler)
+        logger.setLevel(logging.WARNING)
+    return _handler
+
+
+def slow_query_wrapper(execute, sql, params, many, context):
+    if _explaining.get():
+        return execute(sql, params, many, context)
+    
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - started) * 1000
+    
+    if duration_ms >= settings.SLOW_QUERY_LOG['THRESHOLD_MS']:
+        _record(context['connection'], sql, params, many, duration_ms)
+    return result
+
+
+def _record(connection, sql, params, many, duration_ms):
+    normalized = normalize_sql(sql)
+    shape = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    origin = _origin.get()
+    
+    with _lock:
+        stats = _shapes.get(shape)
+        first = stats is None
+        if first:
+            stats = _shapes[shape] = {
+                'sql': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'origins': {},
+            }
+        stats['count'] += 1
+        stats['total_ms'] += duration_ms
+        stats['max_ms'] = max(stats['max_ms'], duration_ms)
+        stats['origins'][origin] = stats['origins'].get(origin, 0) + 1
+        count = stats['count']
+    
+    entry = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'shape': shape,
+        'duration_ms': round(duration_ms, 3),
+        'count': count,
+        'alias': connection.alias,
+        'origin': origin,
+        'function': _calling_function(),
+        'sql': normalized,
+    }
+    if first and not many and settings.SLOW_QUERY_LOG['EXPLAIN'] and re.match(
+            r'\s*(SELECT|WITH)\b', sql, re.IGNORECASE):
+        entry['explain'] = _explain(connection, sql, params)
+    
+    _get_handler()
+    logger.warning(json.dumps(entry, default=str))
+
+
+def slow_query_stats():
+    """Slow statements aggregated per query shape, slowest total first"""
+    with _lock:
+        shapes = [
+            dict(stats, shape=shape, total_ms=round(stats['total_ms'], 3),
+                 max_ms=round(stats['max_ms'], 3), origins=dict(stats['origins']))
+            for shape, stats in _shapes.items()
+        ]
+    return sorted(shapes, key=lambda stats: stats['total_ms'], reverse=True)
+
+
+def reset_slow_query_stats():
+    with _lock:
+        _shapes.clear()
+
+
+class SlowQueryContextMiddleware:
+    """Tags the queries of a request with the view that handles it"""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        token = _origin.set(f'view:{request.path}')
+        try:
+            return self.get_response(request)
+        finally:
+            _origin.reset(token)
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        _origin.set(f'view:{match.view_name if match else view_func.__name__}')
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    if slow_query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(slow_query_wrapper)
+
+
+def _on_task_prerun(sender=None, task=None, **kwargs):
+    _origin.set(f'task:{task.name}')
+
+
+def _on_task_postrun(sender=None, task=None, **kwargs):
+    _origin.set(None)
+
+
+def install():
+    """Install the wrapper on new connections and tag Celery task queries"""
+    if not settings.SLOW_QUERY_LOG['ENABLED']:
+        return
+    connection_created.connect(_on_connection_created, dispatch_uid='loans.slow_query_log')
+    
+    from celery.signals import task_prerun, task_postrun
+    task_prerun.connect(_on_task_prerun, dispatch_uid='loans.slow_query_log')
+    task_postrun.connect(_on_task_postrun, dispatch_uid='loans.slow_query_log')
\ No newline at end of file
@@ -1,5 +1,8 @@
 from rest_framework import serializers
 from .models import Customer, Loan
+from .services import CustomerService
+
+DUPLICATE_PHONE_NUMBER = 'A customer with this phone number already exists.'
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -11,12 +14,77 @@ class CustomerSerializer(serializers.ModelSerializer):
                  'phone_number', 'monthly_salary', 'approved_limit']
 
 
+class CustomerRegistrationListSerializer(serializers.ListSerializer):
+    """
+    Validates a batch of registrations item by item. Invalid items are
+    reported in item_errors (aligned with the input) instead of failing the
+    whole batch, and valid ones are created with chunked bulk inserts.
+    """
+    max_batch_size = 50000
+    
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of registrations.']})
+        if not data:
+            raise serializers.ValidationError({'non_field_errors': ['This list may not be empty.']})
+        if len(data) > self.max_batch_size:
+            raise serializers.ValidationError({
+                'non_field_errors': [f'At most {self.max_batch_size} registrations are allowed per batch.']
+            })
+        
+        self.item_errors = []
+        validated = []
+        for item in data:
+            try:
+                validated.append(self.child.run_validation(item))
+                self.item_errors.append(None)
+            except serializers.ValidationError as exc:
+                validated.append(None)
+                self.item_errors.append(exc.detail)
+        
+        # One filtered lookup for the whole batch, which must not repeat a number either
+        registered = CustomerService.registered_phone_numbers(
+            item['phone_number'] for item in validated if item is not None
+        )
+        seen = set()
+        for index, item in enumerate(validated):
+            if item is None:
+                continue
+            if item['phone_number'] in registered or item['phone_number'] in seen:
+                validated[index] = None
+                self.item_errors[index] = serializers.ValidationError(
+                    {'phone_number': [DUPLICATE_PHONE_NUMBER]}
+                ).detail
+            seen.add(item['phone_number'])
+        return validated
+    
+    def save(self, **kwargs):
+        # ListSerializer.save merges kwargs into every item, which the None placeholders do not support
+        self.instance = self.create(self.validated_data)
+        return self.instance
+    
+    def create(self, validated_data):
+        """Create the valid registrations; returns customers aligned with the input, None for invalid items"""
+        created = iter(CustomerService.register_customers(
+            [item for item in validated_data if item is not None]
+        ))
+        return [next(created) if item is not None else None for item in validated_data]
+
+
 class CustomerRegistrationSerializer(serializers.ModelSerializer):
     monthly_income = serializers.DecimalField(max_digits=12, decimal_places=2, source='monthly_salary')
     
     class Meta:
         model = Customer
         fields = ['first_name', 'last_name', 'age', 'monthly_income', 'phone_number']
+        list_serializer_class = CustomerRegistrationListSerializer
+    
+    def validate_phone_number(self, value):
+        # Batches check all their numbers at once in CustomerRegistrationListSerializer
+        if not isinstance(self.parent, serializers.ListSerializer):
+            if CustomerService.registered_phone_numbers([value]):
+                raise serializers.ValidationError(DUPLICATE_PHONE_NUMBER)
+        return value
     
     def create(self, validated_data):
         return Customer.objects.create(**validated_data)
@@ -45,6 +113,109 @@ class LoanEligibilityResponseSerializer(serializers.Serializer):
     corrected_interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
     tenure = serializers.IntegerField()
     monthly_installment = serializers.DecimalField(max_digits=12, decimal_places=2)
+    policy_version = serializers.IntegerField(required=False)
+
+
+class LoanEligibilityGridSerializer(serializers.Serializer):
+    MAX_CELLS = 10000
+    
+    customer_id = serializers.IntegerField()
+    loan_amounts = serializers.ListField(
+        child=serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0),
+        min_length=1, max_length=200
+    )
+    tenures = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), min_length=1, max_length=200
+    )
+    interest_rates = serializers.ListField(
+        child=serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0),
+        min_length=1, max_length=200
+    )
+    
+    def validate(self, attrs):
+        cells = len(attrs['loan_amounts']) * len(attrs['tenures']) * len(attrs['interest_rates'])
+        if cells > self.MAX_CELLS:
+            raise serializers.ValidationError(
+                f'Grid has {cells} combinations; at most {self.MAX_CELLS} are allowed'
+            )
+        return attrs
+
+
+class LoanEligibilityGridCellSerializer(serializers.Serializer):
+    loan_amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    tenure = serializers.IntegerField()
+    interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
+    approval = serializers.BooleanField()
+    message = serializers.CharField()
+    corrected_interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
+    monthly_installment = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class LoanEligibilityGridResponseSerializer(serializers.Serializer):
+    customer_id = serializers.IntegerField()
+    policy_version = serializers.IntegerField()
+    cells = LoanEligibilityGridCellSerializer(many=True)
+
+
+class MaxLoanAmountSerializer(serializers.Serializer):
+    customer_id = serializers.IntegerField()
+    interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0)
+    tenure = serializers.IntegerField(min_value=1)
+
+
+class MaxLoanAmountResponseSerializer(serializers.Serializer):
+    customer_id = serializers.IntegerField()
+    approval = serializers.BooleanField()
+    message = serializers.CharField()
+    interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
+    corrected_interest_rate = serializers.DecimalField(max_digits=5, decimal_places=2)
+    tenure = serializers.IntegerField()
+    max_loan_amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    monthly_installment = serializers.DecimalField(max_digits=12, decimal_places=2)
+    policy_version = serializers.IntegerField()
+
+
+class CustomerSearchSerializer(serializers.Serializer):
+    MAX_PAGE_SIZE = 500
+    
+    min_credit_score = serializers.IntegerField(required=False, min_value=0, max_value=100)
+    max_credit_score = serializers.IntegerField(required=False, min_value=0, max_value=100)
+    min_emi_headroom = serializers.DecimalField(max_digits=14, decimal_places=2, required=False)
+    ordering = serializers.ChoiceField(
+        choices=[
+            prefix + field for field in CustomerService.SEARCH_ORDERINGS for prefix in ('', '-')
+        ],
+        default='-credit_score'
+    )
+    cursor = serializers.CharField(required=False)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=MAX_PAGE_SIZE, default=100)
+    
+    def validate_cursor(self, value):
+        try:
+            return CustomerService.decode_cursor(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class CustomerRankingSerializer(serializers.ModelSerializer):
+    name = serializers.ReadOnlyField()
+    monthly_income = serializers.DecimalField(max_digits=12, decimal_places=2, source='monthly_salary')
+    credit_score = serializers.IntegerField()
+    on_time_score = serializers.FloatField(allow_null=True)
+    loan_count_score = serializers.IntegerField(allow_null=True)
+    current_year_score = serializers.IntegerField(allow_null=True)
+    volume_score = serializers.IntegerField(allow_null=True)
+    total_loans = serializers.IntegerField()
+    current_emis = serializers.DecimalField(max_digits=14, decimal_places=2)
+    emi_headroom = serializers.DecimalField(max_digits=14, decimal_places=2)
+    
+    class Meta:
+        model = Customer
+        fields = [
+            'customer_id', 'name', 'phone_number', 'monthly_income', 'approved_limit',
+            'credit_score', 'on_time_score', 'loan_count_score', 'current_year_score',
+            'volume_score', 'total_loans', 'current_emis', 'emi_headroom', 'current_debt'
+        ]
 
 
 class LoanCreateSerializer(serializers.Serializer):
@@ -60,6 +231,37 @@ class LoanCreateResponseSerializer(serializers.Serializer):
     loan_approved = serializers.BooleanField()
     message = serializers.CharField()
     monthly_installment = serializers.DecimalField(max_digits=12, decimal_places=2)
+    # Credit policy version of the decision; absent when no policy was applied
+    policy_version = serializers.IntegerField(required=False, allow_null=True)
+
+
+class LoanApplicationSerializer(LoanCreateResponseSerializer):
+    """An async loan application: create_loan response fields, null until decided"""
+    application_id = serializers.UUIDField()
+    status = serializers.CharField()
+    loan_approved = serializers.BooleanField(allow_null=True)
+    message = serializers.SerializerMethodField()
+    monthly_installment = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    created_at = serializers.DateTimeField()
+    decided_at = serializers.DateTimeField(allow_null=True)
+    
+    def get_message(self, application):
+        return application.message or 'Loan application queued'
+
+
+class PaymentSerializer(serializers.Serializer):
+    payment_reference = serializers.CharField(max_length=64)
+    loan_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=0)
+    paid_on = serializers.DateField()
+    emis = serializers.IntegerField(min_value=1, max_value=1000, default=1)
+    on_time = serializers.BooleanField(default=True)
+
+
+class PaymentBatchResponseSerializer(serializers.Serializer):
+    posted = serializers.IntegerField()
+    duplicates = serializers.IntegerField()
+    unknown_loans = serializers.ListField(child=serializers.CharField())
 
 
 class LoanDetailSerializer(serializers.ModelSerializer):
@@ -1,7 +1,27 @@
-from decimal import Decimal
-from datetime import datetime, date
-from django.db.models import Sum, Count, Q, F
-from .models import Customer, Loan
+import base64
+import json
+import uuid
+from decimal import Decimal, ROUND_DOWN
+from datetime import datetime, date, timedelta
+from collections import defaultdict
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum, Q, F
+from django.db.models.functions import Least
+from django.utils import timezone
+import numpy as np
+from .models import (
+    Customer, Loan, CreditScore, Payment, AppliedPayment, ArchivedLoan, LoanArchiveSummary,
+    LoanApplication, loan_score_aggregates, customer_score_aggregates
+)
+from .vectorized import annuity_payment, outstanding_principal
+from .policy import REJECTED_LOW_SCORE, active_policy
+from .bloom import phone_filter, remember_phone_numbers
+from .identity import forget, get_customer, get_loans
+from .sharding import (
+    assign_ids, current_db, gather_sorted, group_by_shard, scatter, shard_aliases, use_shard
+)
 
 
 class CreditScoreService:
@@ -17,76 +37,170 @@ class CreditScoreService:
         iv. Loan approved volume
         v. If sum of current loans > approved limit, credit score = 0
         """
+        return CreditScoreService.calculate_credit_score_breakdown(customer_id)['credit_score']
+    
+    @staticmethod
+    def calculate_credit_score_breakdown(customer_id, policy=None):
+        """Calculate the credit score of one customer together with its components"""
         try:
-            customer = Customer.objects.get(customer_id=customer_id)
+            customer = get_customer(customer_id)
         except Customer.DoesNotExist:
-            return 0
+            return CreditScoreService.score_from_aggregates(
+                None, 0, 0, 0, None, fixed_score=0, policy=policy
+            )
         
-        loans = Loan.objects.filter(customer=customer)
+        # The loan set is shared with the EMI check of the same request
+        aggregates = CreditScoreService.loan_aggregates(get_loans(customer_id))
+        try:
+            summary = customer.archive_summary
+        except LoanArchiveSummary.DoesNotExist:
+            summary = None
+        if summary is not None:
+            # Archived loans ended before this year, so they only add to the lifetime aggregates
+            aggregates['total_loans'] += summary.loan_count
+            aggregates['loans_paid_on_time'] += summary.loans_paid_on_time
+            aggregates['total_volume'] = (aggregates['total_volume'] or Decimal('0')) + summary.total_volume
+        return CreditScoreService.score_from_aggregates(
+            customer.approved_limit, **aggregates, policy=policy
+        )
+    
+    @staticmethod
+    def loan_aggregates(loans, current_year=None):
+        """loan_score_aggregates computed over already loaded loans"""
+        current_year = current_year or date.today().year
+        return {
+            'total_loans': len(loans),
+            'loans_paid_on_time': sum(loan.emis_paid_on_time >= loan.tenure for loan in loans),
+            'current_year_loans': sum(loan.start_date.year == current_year for loan in loans),
+            'total_volume': sum(loan.loan_amount for loan in loans) if loans else None,
+        }
+    
+    @staticmethod
+    def score_customer_range(first_customer_id, last_customer_id):
+        """
+        Score every customer with an id in the given range using one
+        aggregate query, returning one breakdown per customer
+        """
+        return CreditScoreService._score_queryset(Customer.objects.filter(
+            customer_id__gte=first_customer_id,
+            customer_id__lte=last_customer_id
+        ))
+    
+    @staticmethod
+    def score_customers(customer_ids):
+        """Score the given customers using one aggregate query"""
+        return CreditScoreService._score_queryset(
+            Customer.objects.filter(customer_id__in=customer_ids)
+        )
+    
+    @staticmethod
+    def _score_queryset(customers):
+        rows = customers.annotate(**customer_score_aggregates()).values(
+            'customer_id', 'approved_limit', 'total_loans',
+            'loans_paid_on_time', 'current_year_loans', 'total_volume'
+        )
         
-        if not loans.exists():
-            return 50  # Default score for new customers
+        policy = active_policy()
+        breakdowns = []
+        for row in rows:
+            customer_id = row.pop('customer_id')
+            breakdown = CreditScoreService.score_from_aggregates(**row, policy=policy)
+            breakdown['customer_id'] = customer_id
+            breakdowns.append(breakdown)
+        return breakdowns
+    
+    @staticmethod
+    def get_credit_score(customer_id, policy=None):
+        """
+        Return the persisted score written by the re-scoring job when it is
+        still valid for the current year and credit policy, computing it on
+        demand otherwise
+        """
+        policy = policy or active_policy()
+        persisted = CreditScore.objects.filter(
+            customer_id=customer_id,
+            score_year=datetime.now().year,
+            policy_version=policy.version
+        ).values_list('credit_score', flat=True).first()
         
-        # Check if current loans exceed approved limit
-        current_loans_sum = loans.aggregate(
-            total=Sum('loan_amount')
-        )['total'] or Decimal('0')
+        if persisted is not None:
+            return persisted
+        return CreditScoreService.calculate_credit_score_breakdown(customer_id, policy)['credit_score']
+    
+    @staticmethod
+    def get_credit_scores(customer_ids, chunk_size=2000):
+        """Bulk counterpart of get_credit_score, returning {customer_id: score}"""
+        customer_ids = list(customer_ids)
+        current_year = datetime.now().year
+        policy_version = active_policy().version
+        scores = {}
         
-        if current_loans_sum > customer.approved_limit:
-            return 0
+        for i in range(0, len(customer_ids), chunk_size):
+            scores.update(CreditScore.objects.filter(
+                customer_id__in=customer_ids[i:i + chunk_size],
+                score_year=current_year,
+                policy_version=policy_version
+            ).values_list('customer_id', 'credit_score'))
         
-        # Component 1: Past Loans paid on time (40 points)
-        total_loans = loans.count()
-        loans_paid_on_time = loans.filter(
-            emis_paid_on_time__gte=F('tenure')
-        ).count()
+        missing = [customer_id for customer_id in customer_ids if customer_id not in scores]
+        for i in range(0, len(missing), chunk_size):
+            for breakdown in CreditScoreService.score_customers(missing[i:i + chunk_size]):
+                scores[breakdown['customer_id']] = breakdown['credit_score']
         
-        if total_loans > 0:
-            on_time_score = (loans_paid_on_time / total_loans) * 40
-        else:
-            on_time_score = 20  # Default for new customers
-        
-        # Component 2: Number of loans taken (20 points - fewer loans = better score)
-        if total_loans <= 2:
-            loan_count_score = 20
-        elif total_loans <= 5:
-            loan_count_score = 15
-        elif total_loans <= 10:
-            loan_count_score = 10
-        else:
-            loan_count_score = 5
+        return scores
+    
+    @staticmethod
+    def score_from_aggregates(approved_limit, total_loans, loans_paid_on_time,
+                              current_year_loans, total_volume, fixed_score=None, policy=None):
+        """
+        Turn per-customer loan aggregates into a score and its components,
+        using the bands of ``policy`` (the active credit policy by default)
+        """
+        policy = policy or active_policy()
+        breakdown = {
+            'credit_score': fixed_score,
+            'on_time_score': None,
+            'loan_count_score': None,
+            'current_year_score': None,
+            'volume_score': None,
+            'total_loans': total_loans,
+            'policy_version': policy.version,
+        }
         
-        # Component 3: Loan activity in current year (20 points)
-        current_year = datetime.now().year
-        current_year_loans = loans.filter(start_date__year=current_year).count()
-        
-        if current_year_loans == 0:
-            current_year_score = 20
-        elif current_year_loans <= 2:
-            current_year_score = 15
-        elif current_year_loans <= 4:
-            current_year_score = 10
-        else:
-            current_year_score = 5
+        if fixed_score is not None:
+            return breakdown
+        
+        if not total_loans:
+            breakdown['credit_score'] = policy.new_customer_score  # Default score for new customers
+            return breakdown
         
-        # Component 4: Loan approved volume (20 points)
-        total_approved_volume = loans.aggregate(
-            total=Sum('loan_amount')
-        )['total'] or Decimal('0')
+        # Check if current loans exceed approved limit
+        total_volume = total_volume or Decimal('0')
+        if total_volume > approved_limit:
+            breakdown['credit_score'] = 0
+            return breakdown
         
-        volume_ratio = float(total_approved_volume) / float(customer.approved_limit)
+        # Component 1: Past Loans paid on time (40 points by default)
+        on_time_score = (loans_paid_on_time / total_loans) * policy.on_time_points
         
-        if volume_ratio <= 0.3:
-            volume_score = 20
-        elif volume_ratio <= 0.6:
-            volume_score = 15
-        elif volume_ratio <= 0.8:
-            volume_score = 10
-        else:
-            volume_score = 5
+        # Component 2: Number of loans taken (fewer loans = better score)
+        loan_count_score = policy.loan_count_points(total_loans)
+        
+        # Component 3: Loan activity in current year
+        current_year_score = policy.current_year_points(current_year_loans)
+        
+        # Component 4: Loan approved volume
+        volume_score = policy.volume_points(float(total_volume) / float(approved_limit))
         
         total_score = on_time_score + loan_count_score + current_year_score + volume_score
-        return min(100, max(0, int(total_score)))
+        breakdown.update({
+            'credit_score': min(100, max(0, int(total_score))),
+            'on_time_score': on_time_score,
+            'loan_count_score': loan_count_score,
+            'current_year_score': current_year_score,
+            'volume_score': volume_score,
+        })
+        return breakdown
 
 
 class LoanEligibilityService:
@@ -97,7 +211,7 @@ class LoanEligibilityService:
         """Check loan eligibility based on credit score and other criteria"""
         
         try:
-            customer = Customer.objects.get(customer_id=customer_id)
+            customer = get_customer(customer_id)
         except Customer.DoesNotExist:
             return {
                 'approval': False,
@@ -107,17 +221,27 @@ class LoanEligibilityService:
             }
         
         # Calculate credit score
-        credit_score = CreditScoreService.calculate_credit_score(customer_id)
+        policy = active_policy()
+        credit_score = CreditScoreService.get_credit_score(customer_id, policy)
+        current_emis = LoanEligibilityService.get_current_emis(customer)
         
+        result = LoanEligibilityService.decide(
+            credit_score, current_emis, customer.monthly_salary, loan_amount, interest_rate, tenure,
+            policy
+        )
+        result['credit_score'] = credit_score  # For debugging
+        return result
+    
+    @staticmethod
+    def decide(credit_score, current_emis, monthly_salary, loan_amount, interest_rate, tenure,
+               policy=None):
+        """
+        Eligibility decision from a customer's already loaded score, EMIs and
+        salary, recording the credit policy version that made it
+        """
+        policy = policy or active_policy()
         # Check if sum of all current EMIs > 50% of monthly salary
-        current_emis = Loan.objects.filter(
-            customer=customer,
-            end_date__gte=date.today()
-        ).aggregate(
-            total_emi=Sum('monthly_repayment')
-        )['total_emi'] or Decimal('0')
-        
-        max_allowed_emi = customer.monthly_salary * Decimal('0.5')
+        max_allowed_emi = monthly_salary * Decimal('0.5')
         
         # Calculate proposed EMI
         monthly_installment = LoanEligibilityService.calculate_emi(
@@ -129,36 +253,11 @@ class LoanEligibilityService:
                 'approval': False,
                 'message': 'EMI exceeds 50% of monthly salary',
                 'corrected_interest_rate': interest_rate,
-                'monthly_installment': monthly_installment
+                'monthly_installment': monthly_installment,
+                'policy_version': policy.version
             }
         
-        # Determine approval and corrected interest rate based on credit score
-        if credit_score > 50:
-            approval = True
-            corrected_interest_rate = interest_rate
-            message = 'Loan approved'
-        elif 30 < credit_score <= 50:
-            if interest_rate >= 12:
-                approval = True
-                corrected_interest_rate = interest_rate
-                message = 'Loan approved'
-            else:
-                approval = True
-                corrected_interest_rate = Decimal('12.0')
-                message = 'Loan approved with corrected interest rate'
-        elif 10 < credit_score <= 30:
-            if interest_rate >= 16:
-                approval = True
-                corrected_interest_rate = interest_rate
-                message = 'Loan approved'
-            else:
-                approval = True
-                corrected_interest_rate = Decimal('16.0')
-                message = 'Loan approved with corrected interest rate'
-        else:  # credit_score <= 10
-            approval = False
-            corrected_interest_rate = interest_rate
-            message = 'Loan not approved due to low credit score'
+        approval, corrected_interest_rate, message = policy.apply(credit_score, interest_rate)
         
         # Recalculate EMI with corrected interest rate
         if approval and corrected_interest_rate != interest_rate:
@@ -171,7 +270,165 @@ class LoanEligibilityService:
             'message': message,
             'corrected_interest_rate': corrected_interest_rate,
             'monthly_installment': monthly_installment,
-            'credit_score': credit_score  # For debugging
+            'policy_version': policy.version
+        }
+    
+    @staticmethod
+    def get_current_emis(customer):
+        """Sum of the EMIs of a customer's loans that have not ended yet"""
+        today = date.today()
+        return sum(
+            (loan.monthly_repayment for loan in get_loans(customer.customer_id) if loan.end_date >= today),
+            Decimal('0')
+        )
+    
+    @staticmethod
+    def apply_credit_score(credit_score, interest_rate, policy=None):
+        """
+        Determine approval and corrected interest rate based on credit score
+        with the rate bands of the credit policy.
+        Returns (approval, corrected_interest_rate, message).
+        """
+        return (policy or active_policy()).apply(credit_score, interest_rate)
+    
+    @staticmethod
+    def evaluate_grid(customer_id, loan_amounts, tenures, interest_rates):
+        """
+        Evaluate check_eligibility for every combination of loan amount,
+        tenure and interest rate of one customer. The credit score and
+        current EMIs are loaded once and the EMIs of the whole grid are
+        computed in one vectorized pass.
+        
+        Raises Customer.DoesNotExist for unknown customers.
+        """
+        customer = get_customer(customer_id)
+        policy = active_policy()
+        credit_score = CreditScoreService.get_credit_score(customer_id, policy)
+        current_emis = LoanEligibilityService.get_current_emis(customer)
+        max_allowed_emi = customer.monthly_salary * Decimal('0.5')
+        
+        # The score-based correction only depends on the requested rate
+        decisions = [policy.apply(credit_score, rate) for rate in interest_rates]
+        
+        amount_axis = np.asarray([float(amount) for amount in loan_amounts])[:, None, None]
+        tenure_axis = np.asarray(tenures)[None, :, None]
+        requested_emis = annuity_payment(
+            amount_axis, [float(rate) for rate in interest_rates], tenure_axis
+        )
+        corrected_emis = annuity_payment(
+            amount_axis, [float(decision[1]) for decision in decisions], tenure_axis
+        )
+        
+        cells = []
+        for i, loan_amount in enumerate(loan_amounts):
+            for j, tenure in enumerate(tenures):
+                for k, interest_rate in enumerate(interest_rates):
+                    approval, corrected_interest_rate, message = decisions[k]
+                    monthly_installment = _emi_to_decimal(requested_emis[i, j, k], interest_rate)
+                    
+                    if current_emis + monthly_installment > max_allowed_emi:
+                        approval = False
+                        corrected_interest_rate = interest_rate
+                        message = 'EMI exceeds 50% of monthly salary'
+                    elif approval and corrected_interest_rate != interest_rate:
+                        monthly_installment = _emi_to_decimal(
+                            corrected_emis[i, j, k], corrected_interest_rate
+                        )
+                    
+                    cells.append({
+                        'loan_amount': loan_amount,
+                        'tenure': tenure,
+                        'interest_rate': interest_rate,
+                        'approval': approval,
+                        'message': message,
+                        'corrected_interest_rate': corrected_interest_rate,
+                        'monthly_installment': monthly_installment,
+                    })
+        
+        return {'credit_score': credit_score, 'policy_version': policy.version, 'cells': cells}
+    
+    @staticmethod
+    def max_loan_amount(customer_id, interest_rate, tenure):
+        """
+        Largest loan amount check_eligibility approves for the given rate and
+        tenure, capped by the customer's approved limit.
+        
+        The salary headroom left by the current EMIs is turned into a
+        principal by inverting the annuity formula of calculate_emi. As in
+        check_eligibility the 50% rule is applied at the requested rate, and
+        the installment is reported at the rate the score band forces. The
+        closed-form amount is then snapped to the cent so that it is exactly
+        the boundary of check_eligibility despite EMI rounding.
+        
+        Raises Customer.DoesNotExist for unknown customers.
+        """
+        customer = get_customer(customer_id)
+        policy = active_policy()
+        credit_score = CreditScoreService.get_credit_score(customer_id, policy)
+        current_emis = LoanEligibilityService.get_current_emis(customer)
+        max_allowed_emi = customer.monthly_salary * Decimal('0.5')
+        
+        approval, corrected_interest_rate, message = policy.apply(credit_score, interest_rate)
+        
+        def fits(amount):
+            emi = LoanEligibilityService.calculate_emi(amount, interest_rate, tenure)
+            return current_emis + emi <= max_allowed_emi
+        
+        cap = customer.approved_limit
+        headroom = max_allowed_emi - current_emis
+        max_amount = Decimal('0.00')
+        
+        if approval and headroom > 0 and cap > 0:
+            monthly_rate = float(interest_rate) / (12 * 100)
+            if monthly_rate == 0:
+                estimate = float(headroom) * tenure
+            else:
+                growth = (1 + monthly_rate) ** tenure
+                estimate = float(headroom) * (growth - 1) / (monthly_rate * growth)
+            
+            cent = Decimal('0.01')
+            estimate = min(Decimal(str(estimate)).quantize(cent, rounding=ROUND_DOWN), cap)
+            
+            if fits(cap):
+                max_amount = cap
+            else:
+                # Bracket the boundary around the estimate, then bisect on cents
+                step = cent
+                low = high = estimate
+                while low > 0 and not fits(low):
+                    low = max(low - step, Decimal('0.00'))
+                    step *= 2
+                step = cent
+                while high < cap and fits(high):
+                    high = min(high + step, cap)
+                    step *= 2
+                
+                while high - low > cent:
+                    middle = ((low + high) / 2).quantize(cent, rounding=ROUND_DOWN)
+                    if fits(middle):
+                        low = middle
+                    else:
+                        high = middle
+                max_amount = low
+        
+        if max_amount > 0:
+            monthly_installment = LoanEligibilityService.calculate_emi(
+                max_amount, corrected_interest_rate, tenure
+            )
+        else:
+            approval = False
+            monthly_installment = Decimal('0')
+            if message != REJECTED_LOW_SCORE:
+                message = 'EMI exceeds 50% of monthly salary'
+        
+        return {
+            'approval': approval,
+            'message': message,
+            'max_loan_amount': max_amount,
+            'corrected_interest_rate': corrected_interest_rate,
+            'monthly_installment': monthly_installment,
+            'credit_score': credit_score,
+            'policy_version': policy.version
         }
     
     @staticmethod
@@ -182,7 +439,603 @@ class LoanEligibilityService:
         n = int(tenure_months)
         
         if monthly_rate == 0:
-            return Decimal(str(principal / n))
+            return _emi_to_decimal(principal / n, annual_rate)
         
         emi = principal * monthly_rate * (1 + monthly_rate)**n / ((1 + monthly_rate)**n - 1)
-        return Decimal(str(round(emi, 2)))
\ No newline at end of file
+        return _emi_to_decimal(emi, annual_rate)
+
+
+class CustomerService:
+    """Service to register and search customers"""
+    
+    SEARCH_ORDERINGS = ('credit_score', 'emi_headroom', 'approved_limit', 'customer_id')
+    PHONE_LOOKUP_CHUNK_SIZE = 1000
+    
+    @staticmethod
+    def register_customers(registrations, batch_size=None):
+        """
+        Create customers from validated registration data with chunked
+        bulk inserts. bulk_create skips Customer.save, so approved_limit is
+        set here with the same Customer.calculate_approved_limit rule.
+        """
+        if not registrations:
+            return []
+        
+        customers = assign_ids([
+            Customer(approved_limit=Customer.calculate_approved_limit(item['monthly_salary']), **item)
+            for item in registrations
+        ])
+        for alias, shard_customers in group_by_shard(customers, lambda c: c.customer_id or 0).items():
+            with use_shard(alias), transaction.atomic(using=alias):
+                Customer.objects.bulk_create(
+                    shard_customers, batch_size=batch_size or settings.REGISTRATION_BATCH_SIZE
+                )
+        remember_phone_numbers(customer.phone_number for customer in customers)
+        return customers
+    
+    @staticmethod
+    def probably_registered(phone_numbers):
+        """The phone numbers the phone filter cannot rule out; all others are definitely new"""
+        phone_numbers = list(phone_numbers)
+        if not phone_numbers:
+            return []
+        hits = phone_filter().contains_many(phone_numbers)
+        return [phone_number for phone_number, hit in zip(phone_numbers, hits) if hit]
+    
+    @staticmethod
+    def registered_phone_numbers(phone_numbers):
+        """
+        The given phone numbers that belong to a customer. Only the filter's
+        hits are looked up, on every shard
+        """
+        likely = CustomerService.probably_registered(phone_numbers)
+        registered = set()
+        for i in range(0, len(likely), CustomerService.PHONE_LOOKUP_CHUNK_SIZE):
+            chunk = likely[i:i + CustomerService.PHONE_LOOKUP_CHUNK_SIZE]
+            for _, found in scatter(lambda: list(
+                    Customer.objects.filter(phone_number__in=chunk).values_list('phone_number', flat=True))):
+                registered.update(found)
+        return registered
+    
+    @staticmethod
+    def search_customers(min_credit_score=None, max_credit_score=None, min_emi_headroom=None,
+                         ordering='-credit_score', cursor=None, page_size=100):
+        """
+        One page of customers with their SQL-computed score and EMI headroom,
+        using keyset pagination on (ordering field, customer_id). With
+        sharding every shard returns its own page and the pages are merged.
+        Returns (customers, next_cursor).
+        """
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        
+        customers = Customer.objects.with_credit_score()
+        if min_credit_score is not None:
+            customers = customers.filter(credit_score__gte=min_credit_score)
+        if max_credit_score is not None:
+            customers = customers.filter(credit_score__lte=max_credit_score)
+        if min_emi_headroom is not None:
+            customers = customers.filter(emi_headroom__gte=min_emi_headroom)
+        
+        if cursor is not None:
+            value, customer_id = cursor
+            after = 'lt' if descending else 'gt'
+            if field == 'customer_id':
+                customers = customers.filter(**{f'customer_id__{after}': customer_id})
+            else:
+                customers = customers.filter(
+                    Q(**{f'{field}__{after}': value})
+                    | Q(**{field: value, f'customer_id__{after}': customer_id})
+                )
+        
+        order = [ordering] if field == 'customer_id' else [ordering, f'{ordering[:-len(field)]}customer_id']
+        shard_pages = scatter(lambda: list(customers.order_by(*order)[:page_size + 1]))
+        page = list(islice(gather_sorted(
+            (shard_page for _, shard_page in shard_pages),
+            key=lambda customer: (getattr(customer, field), customer.customer_id),
+            reverse=descending
+        ), page_size + 1))
+        
+        next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            next_cursor = CustomerService.encode_cursor(getattr(last, field), last.customer_id)
+        return page, next_cursor
+    
+    @staticmethod
+    def encode_cursor(value, customer_id):
+        payload = json.dumps([str(value), customer_id]).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            value, customer_id = json.loads(base64.urlsafe_b64decode(padded))
+            return Decimal(value), int(customer_id)
+        except Exception as e:
+            raise ValueError(f'Invalid cursor: {cursor}') from e
+
+
+class LoanArchiveService:
+    """Service to move closed loans out of the hot loans table"""
+    
+    @staticmethod
+    def closed_loans(today=None):
+        """
+        Loans that ended before the current year and were paid on time.
+        Such loans can no longer change the current-year component of the
+        score, so archiving them into a summary leaves scores unchanged.
+        """
+        today = today or date.today()
+        return Loan.objects.filter(
+            end_date__lt=date(today.year, 1, 1),
+            emis_paid_on_time__gte=F('tenure')
+        )
+    
+    @staticmethod
+    def archive_closed_loans(batch_size=None, today=None):
+        """
+        Move closed loans to loans_archive in batches, each one atomic:
+        copy, refresh the customers' archive summaries, delete from loans.
+        Works on the current shard.
+        """
+        batch_size = batch_size or settings.LOAN_ARCHIVE_BATCH_SIZE
+        closed = LoanArchiveService.closed_loans(today).order_by('loan_id')
+        archived = 0
+        customers = set()
+        
+        while True:
+            with transaction.atomic(using=current_db()):
+                batch = list(closed.select_for_update()[:batch_size])
+                if not batch:
+                    break
+                
+                ArchivedLoan.objects.bulk_create(
+                    [ArchivedLoan.from_loan(loan) for loan in batch], ignore_conflicts=True
+                )
+                Loan.objects.filter(loan_id__in=[loan.loan_id for loan in batch]).delete()
+                
+                customer_ids = {loan.customer_id for loan in batch}
+                LoanArchiveService.refresh_summaries(customer_ids)
+            
+            archived += len(batch)
+            customers |= customer_ids
+        
+        return {'archived': archived, 'customers': len(customers)}
+    
+    @staticmethod
+    def refresh_summaries(customer_ids):
+        """Recompute the archive summaries of the given customers from loans_archive"""
+        rows = ArchivedLoan.objects.filter(customer_id__in=customer_ids).values('customer_id').annotate(
+            **loan_score_aggregates()
+        ).order_by()
+        
+        LoanArchiveSummary.objects.bulk_create(
+            [
+                LoanArchiveSummary(
+                    customer_id=row['customer_id'],
+                    loan_count=row['total_loans'],
+                    loans_paid_on_time=row['loans_paid_on_time'],
+                    total_volume=row['total_volume'] or Decimal('0'),
+                )
+                for row in rows
+            ],
+            update_conflicts=True,
+            unique_fields=['customer'],
+            update_fields=['loan_count', 'loans_paid_on_time', 'total_volume', 'updated_at']
+        )
+
+
+class PaymentService:
+    """Service to post EMI repayment events to loans"""
+    
+    LOOKUP_CHUNK_SIZE = 1000
+    
+    @staticmethod
+    def post_payments(payments):
+        """
+        Record a batch of repayment events in the ledger and apply them to
+        their loans once the ledger has committed.
+        
+        Events are idempotent by payment_reference: references already in
+        the ledger (or repeated within the batch) are skipped. Applying
+        happens after the ledger commit (see apply_payments), so a failed
+        ledger commit leaves the loans untouched; referenced payments left
+        unapplied by an earlier attempt are applied again here.
+        """
+        events = {}
+        for payment in payments:
+            events.setdefault(payment['payment_reference'], payment)
+        references = list(events)
+        
+        with transaction.atomic():
+            posted_references = set()
+            for i in range(0, len(references), PaymentService.LOOKUP_CHUNK_SIZE):
+                posted_references.update(Payment.objects.filter(
+                    payment_reference__in=references[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+                ).values_list('payment_reference', flat=True))
+            
+            new_events = [event for ref, event in events.items() if ref not in posted_references]
+            loan_customers, _ = PaymentService._locate_loans({event['loan_id'] for event in new_events})
+            
+            accepted = [event for event in new_events if event['loan_id'] in loan_customers]
+            unknown_loans = [
+                event['payment_reference'] for event in new_events
+                if event['loan_id'] not in loan_customers
+            ]
+            
+            Payment.objects.bulk_create([
+                Payment(
+                    payment_reference=event['payment_reference'],
+                    loan_id=event['loan_id'],
+                    emis=event['emis'],
+                    on_time=event['on_time'],
+                    amount=event['amount'],
+                    paid_on=event['paid_on'],
+                )
+                for event in accepted
+            ], batch_size=PaymentService.LOOKUP_CHUNK_SIZE)
+            
+            transaction.on_commit(lambda: PaymentService.apply_payments(references))
+        
+        return {
+            'posted': len(accepted),
+            'duplicates': len(payments) - len(new_events),
+            'unknown_loans': unknown_loans,
+        }
+    
+    @staticmethod
+    def apply_payments(references=None):
+        """
+        Apply committed ledger payments that are not applied yet, limited to
+        ``references`` when given. Returns the number of payments applied.
+        
+        Per shard, an AppliedPayment marker is written in the transaction
+        that updates the loans: on-time EMIs are added to emis_paid_on_time
+        with one set-based F() update per distinct increment, capped at the
+        loan's tenure, current_debt is refreshed and the persisted scores of
+        the affected customers are dropped. Payments that already have a
+        marker are skipped, so the ledger's applied flag is only bookkeeping
+        and a failure before it is set never applies a payment twice.
+        """
+        pending = Payment.objects.filter(applied=False)
+        if references is None:
+            pending = list(pending.order_by('posted_at').values_list(
+                'payment_reference', 'loan_id', 'emis', 'on_time'
+            ))
+        else:
+            references = list(references)
+            pending = [
+                row
+                for i in range(0, len(references), PaymentService.LOOKUP_CHUNK_SIZE)
+                for row in pending.filter(
+                    payment_reference__in=references[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+                ).values_list('payment_reference', 'loan_id', 'emis', 'on_time')
+            ]
+        if not pending:
+            return 0
+        
+        loan_customers, loan_shards = PaymentService._locate_loans({row[1] for row in pending})
+        
+        applied_count = 0
+        now = timezone.now()
+        for alias in shard_aliases():
+            shard_payments = [row for row in pending if loan_shards.get(row[1]) == alias]
+            if not shard_payments:
+                continue
+            
+            with use_shard(alias), transaction.atomic(using=alias):
+                shard_references = [row[0] for row in shard_payments]
+                marked = set()
+                for i in range(0, len(shard_references), PaymentService.LOOKUP_CHUNK_SIZE):
+                    marked.update(AppliedPayment.objects.filter(
+                        payment_reference__in=shard_references[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+                    ).values_list('payment_reference', flat=True))
+                unapplied = [row for row in shard_payments if row[0] not in marked]
+                if not unapplied:
+                    continue
+                
+                AppliedPayment.objects.bulk_create([
+                    AppliedPayment(payment_reference=reference, customer_id=loan_customers[loan_id])
+                    for reference, loan_id, _, _ in unapplied
+                ], batch_size=PaymentService.LOOKUP_CHUNK_SIZE)
+                
+                increments = defaultdict(int)
+                for _, loan_id, emis, on_time in unapplied:
+                    if on_time:
+                        increments[loan_id] += emis
+                PaymentService._apply_increments(increments, now)
+                
+                customer_ids = list({loan_customers[loan_id] for _, loan_id, _, _ in unapplied})
+                for i in range(0, len(customer_ids), PaymentService.LOOKUP_CHUNK_SIZE):
+                    CreditScore.objects.filter(
+                        customer_id__in=customer_ids[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+                    ).delete()
+                # Only on-time EMIs are counted on the loan, so only they reduce the debt
+                DebtService.refresh_current_debt({loan_customers[loan_id] for loan_id in increments})
+                for customer_id in customer_ids:
+                    forget(customer_id)
+                applied_count += len(unapplied)
+        
+        # Payments of loans no longer in the hot table (archived) have nothing to apply
+        done = [row[0] for row in pending]
+        for i in range(0, len(done), PaymentService.LOOKUP_CHUNK_SIZE):
+            Payment.objects.filter(
+                payment_reference__in=done[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+            ).update(applied=True)
+        return applied_count
+    
+    @staticmethod
+    def _locate_loans(loan_ids):
+        """({loan_id: customer_id}, {loan_id: shard alias}) for the loans found in the hot table"""
+        loan_ids = list(loan_ids)
+        
+        def find_loans():
+            found = {}
+            for i in range(0, len(loan_ids), PaymentService.LOOKUP_CHUNK_SIZE):
+                found.update(Loan.objects.filter(
+                    loan_id__in=loan_ids[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+                ).values_list('loan_id', 'customer_id'))
+            return found
+        
+        # With sharding the loans are looked up on every shard
+        loan_customers = {}
+        loan_shards = {}
+        for alias, found in scatter(find_loans):
+            loan_customers.update(found)
+            loan_shards.update(dict.fromkeys(found, alias))
+        return loan_customers, loan_shards
+    
+    @staticmethod
+    def _apply_increments(increments, now):
+        """One set-based update per distinct increment, capped at the loan's tenure"""
+        loans_by_increment = defaultdict(list)
+        for loan_id, increment in increments.items():
+            loans_by_increment[increment].append(loan_id)
+        
+        for increment, increment_loan_ids in loans_by_increment.items():
+            for i in range(0, len(increment_loan_ids), PaymentService.LOOKUP_CHUNK_SIZE):
+                Loan.objects.filter(
+                    loan_id__in=increment_loan_ids[i:i + PaymentService.LOOKUP_CHUNK_SIZE]
+                ).update(
+                    emis_paid_on_time=Least(F('emis_paid_on_time') + increment, F('tenure')),
+                    updated_at=now
+                )
+
+
+class DebtService:
+    """
+    Service to keep Customer.current_debt equal to the outstanding principal
+    of the customer's loans. Archived loans are fully paid and owe nothing.
+    """
+    
+    @staticmethod
+    def outstanding_principal(loan):
+        """Principal left on a loan after its emis_paid_on_time EMIs, in closed form"""
+        balance = outstanding_principal(
+            float(loan.loan_amount), float(loan.interest_rate), loan.tenure, loan.emis_paid_on_time
+        )
+        return Decimal(str(round(float(balance), 2)))
+    
+    @staticmethod
+    def customer_debts(customer_ids):
+        """current_debt of the given customers on the current shard, computed in one pass"""
+        rows = list(Loan.objects.filter(customer_id__in=customer_ids).values_list(
+            'customer_id', 'loan_amount', 'interest_rate', 'tenure', 'emis_paid_on_time'
+        ).order_by())
+        debts = dict.fromkeys(customer_ids, Decimal('0.00'))
+        if not rows:
+            return debts
+        
+        columns = list(zip(*rows))
+        balances = np.round(outstanding_principal(
+            [float(amount) for amount in columns[1]], [float(rate) for rate in columns[2]],
+            columns[3], columns[4]
+        ), 2)
+        owners, index = np.unique(np.asarray(columns[0], dtype=np.int64), return_inverse=True)
+        for customer_id, debt in zip(owners.tolist(), np.bincount(index, weights=balances).tolist()):
+            debts[customer_id] = Decimal(str(round(debt, 2)))
+        return debts
+    
+    @staticmethod
+    def refresh_current_debt(customer_ids):
+        """Recompute current_debt of the given customers on the current shard"""
+        customer_ids = list(customer_ids)
+        for i in range(0, len(customer_ids), settings.CURRENT_DEBT_CHUNK_SIZE):
+            debts = DebtService.customer_debts(customer_ids[i:i + settings.CURRENT_DEBT_CHUNK_SIZE])
+            Customer.objects.bulk_update(
+                [Customer(customer_id=customer_id, current_debt=debt) for customer_id, debt in debts.items()],
+                ['current_debt']
+            )
+            for customer_id in debts:
+                forget(customer_id)
+        return len(customer_ids)
+    
+    @staticmethod
+    def refresh_all(chunk_size=None):
+        """Recompute current_debt of every customer on the current shard, chunk by chunk"""
+        chunk_size = chunk_size or settings.CURRENT_DEBT_CHUNK_SIZE
+        refreshed = 0
+        last_id = 0
+        while True:
+            customer_ids = list(Customer.objects.filter(customer_id__gt=last_id).order_by(
+                'customer_id'
+            ).values_list('customer_id', flat=True)[:chunk_size])
+            if not customer_ids:
+                return refreshed
+            with transaction.atomic(using=current_db()):
+                refreshed += DebtService.refresh_current_debt(customer_ids)
+            last_id = customer_ids[-1]
+
+
+class LoanOriginationService:
+    """Books loans and decides queued loan applications in micro-batches"""
+    
+    @staticmethod
+    def book_loan(customer, loan_amount, interest_rate, tenure, today=None, policy_version=None):
+        """Create an approved loan starting today and add it to the customer's current_debt"""
+        today = today or date.today()
+        loan = Loan.objects.create(
+            customer=customer,
+            loan_amount=loan_amount,
+            tenure=tenure,
+            interest_rate=interest_rate,
+            start_date=today,
+            end_date=today + timedelta(days=tenure * 30),  # Approximate
+            policy_version=policy_version
+        )
+        Customer.objects.using(loan._state.db).filter(customer_id=customer.customer_id).update(
+            current_debt=F('current_debt') + DebtService.outstanding_principal(loan)
+        )
+        forget(customer.customer_id)
+        return loan
+    
+    @staticmethod
+    def claim_applications(batch_size, claim_timeout):
+        """
+        Claim up to batch_size pending applications on the current shard,
+        oldest first. Claims older than claim_timeout seconds belong to a
+        worker that died mid-batch and are taken over.
+        Returns (claim token, number of applications claimed).
+        """
+        now = timezone.now()
+        token = uuid.uuid4()
+        with transaction.atomic(using=current_db()):
+            claimable = LoanApplication.objects.filter(
+                Q(status=LoanApplication.STATUS_PENDING) |
+                Q(status=LoanApplication.STATUS_PROCESSING,
+                  claimed_at__lt=now - timedelta(seconds=claim_timeout))
+            )
+            application_ids = list(
+                claimable.select_for_update(skip_locked=True).order_by('created_at').values_list(
+                    'application_id', flat=True
+                )[:batch_size]
+            )
+            claimed = LoanApplication.objects.filter(application_id__in=application_ids).update(
+                status=LoanApplication.STATUS_PROCESSING, claim_token=token, claimed_at=now
+            )
+        return token, claimed
+    
+    @staticmethod
+    def process_applications(token, today=None):
+        """
+        Decide the applications claimed with ``token`` on the current shard.
+        
+        Scores and current EMIs are loaded once for all customers of the
+        batch. A customer's applications are then decided in arrival order,
+        with the score inputs and EMIs updated in memory after every booked
+        loan, so the outcomes match sequential create_loan calls. The loans
+        and decisions of one customer commit together.
+        """
+        today = today or date.today()
+        applications = defaultdict(list)
+        for application in LoanApplication.objects.filter(
+                claim_token=token, status=LoanApplication.STATUS_PROCESSING).order_by('created_at'):
+            applications[application.customer_id].append(application)
+        customer_ids = list(applications)
+        # One policy version decides the whole batch
+        policy = active_policy()
+        
+        customers = Customer.objects.in_bulk(customer_ids)
+        persisted_scores = dict(CreditScore.objects.filter(
+            customer_id__in=customer_ids, score_year=today.year,
+            policy_version=policy.version
+        ).values_list('customer_id', 'credit_score'))
+        aggregates = {
+            row.pop('customer_id'): row
+            for row in Customer.objects.filter(customer_id__in=customer_ids).annotate(
+                **customer_score_aggregates(today.year)
+            ).values('customer_id', 'total_loans', 'loans_paid_on_time',
+                     'current_year_loans', 'total_volume')
+        }
+        current_emis = dict(Loan.objects.filter(
+            customer_id__in=customer_ids, end_date__gte=today
+        ).values('customer_id').annotate(total=Sum('monthly_repayment')).values_list(
+            'customer_id', 'total'
+        ).order_by())
+        
+        counts = {'approved': 0, 'rejected': 0}
+        for customer_id, customer_applications in applications.items():
+            customer = customers.get(customer_id)
+            if customer is not None:
+                inputs = aggregates[customer_id]
+                credit_score = persisted_scores.get(customer_id)
+                if credit_score is None:
+                    credit_score = CreditScoreService.score_from_aggregates(
+                        customer.approved_limit, **inputs, policy=policy
+                    )['credit_score']
+                emis = current_emis.get(customer_id) or Decimal('0')
+            
+            with transaction.atomic(using=current_db()):
+                # A claim that timed out may have been taken over by another worker
+                owned = set(LoanApplication.objects.select_for_update().filter(
+                    application_id__in=[application.pk for application in customer_applications],
+                    claim_token=token,
+                    status=LoanApplication.STATUS_PROCESSING
+                ).values_list('application_id', flat=True))
+                
+                decided = []
+                for application in customer_applications:
+                    if application.pk not in owned:
+                        continue
+                    decided.append(application)
+                    application.loan_approved = False
+                    
+                    if customer is None:
+                        application.message = 'Customer not found'
+                        application.monthly_installment = Decimal('0')
+                        continue
+                    
+                    eligibility = LoanEligibilityService.decide(
+                        credit_score, emis, customer.monthly_salary,
+                        application.loan_amount, application.interest_rate, application.tenure,
+                        policy
+                    )
+                    application.message = eligibility['message']
+                    application.monthly_installment = eligibility['monthly_installment']
+                    application.policy_version = eligibility['policy_version']
+                    if not eligibility['approval']:
+                        continue
+                    
+                    loan = LoanOriginationService.book_loan(
+                        customer, application.loan_amount,
+                        eligibility['corrected_interest_rate'], application.tenure, today,
+                        eligibility['policy_version']
+                    )
+                    monthly_repayment = Decimal(str(loan.monthly_repayment))
+                    application.loan_approved = True
+                    application.loan_id = loan.loan_id
+                    application.message = 'Loan approved and created successfully'
+                    application.monthly_installment = monthly_repayment
+                    
+                    # What the next create_loan call of this customer would see
+                    emis += monthly_repayment
+                    inputs['total_loans'] += 1
+                    inputs['loans_paid_on_time'] += int(loan.emis_paid_on_time >= loan.tenure)
+                    inputs['current_year_loans'] += int(loan.start_date.year == today.year)
+                    inputs['total_volume'] = (inputs['total_volume'] or Decimal('0')) + loan.loan_amount
+                    credit_score = CreditScoreService.score_from_aggregates(
+                        customer.approved_limit, **inputs, policy=policy
+                    )['credit_score']
+                
+                now = timezone.now()
+                for application in decided:
+                    application.status = LoanApplication.STATUS_COMPLETED
+                    application.decided_at = now
+                    counts['approved' if application.loan_approved else 'rejected'] += 1
+                LoanApplication.objects.bulk_update(decided, [
+                    'status', 'loan_approved', 'loan_id', 'message',
+                    'monthly_installment', 'policy_version', 'decided_at'
+                ])
+        
+        return counts
+
+
+def _emi_to_decimal(emi, annual_rate):
+    """Convert a float EMI the way calculate_emi always has: rounded unless interest free"""
+    if float(annual_rate) / (12 * 100) == 0:
+        return Decimal(str(float(emi)))
+    return Decimal(str(round(float(emi), 2)))
\ No newline at end of file
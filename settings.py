@@ -1,5 +1,6 @@
 import os
-from decouple import config
+from decouple import config, Csv
+from celery.schedules import crontab
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,6 +29,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'loans.traffic.TrafficCaptureMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -35,6 +37,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'loans.identity.IdentityMapMiddleware',
+    'loans.querylog.SlowQueryContextMiddleware',
+    'loans.profiling.RequestProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'credit_system.urls'
@@ -87,6 +92,42 @@ else:
         }
     }
 
+# Customer-keyed sharding (see loans/sharding.py): customers and their loans
+# are spread over one database per entry of SHARD_DATABASE_URLS, e.g.
+# "sqlite:///shard_0.sqlite3,sqlite:///shard_1.sqlite3"; default keeps the
+# global tables. Empty means no sharding.
+def _shard_database(url):
+    if url.startswith('sqlite'):
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / url.split(':///')[1],
+        }
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': url.split('/')[-1],
+        'USER': url.split('//')[1].split(':')[0],
+        'PASSWORD': url.split('//')[1].split(':')[1].split('@')[0],
+        'HOST': url.split('@')[1].split(':')[0],
+        'PORT': url.split('@')[1].split(':')[1].split('/')[0],
+    }
+
+
+SHARD_DATABASE_URLS = config('SHARD_DATABASE_URLS', default='', cast=Csv())
+for _index, _url in enumerate(SHARD_DATABASE_URLS):
+    DATABASES[f'shard_{_index}'] = _shard_database(_url)
+
+SHARDING = {
+    'SHARDS': [f'shard_{index}' for index in range(len(SHARD_DATABASE_URLS))],
+    # 'hash' (jump consistent hash of customer_id) or 'range'
+    'STRATEGY': config('SHARDING_STRATEGY', default='hash'),
+    # For 'range': [(exclusive upper customer_id, alias), ..., (None, alias)]
+    'RANGES': [],
+    # Primary keys reserved per round trip by the global ID allocator
+    'ID_BLOCK_SIZE': config('SHARDING_ID_BLOCK_SIZE', default=1000, cast=int),
+}
+
+DATABASE_ROUTERS = ['loans.sharding.ShardRouter']
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -117,15 +158,57 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework configuration
+# JSON stays the default; service-to-service callers can negotiate
+# MessagePack with Accept/Content-Type: application/msgpack
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'loans.messagepack.MessagePackRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
+        'loans.messagepack.MessagePackParser',
     ],
 }
 
+# Cache: local memory by default, Redis when CACHE_URL is set
+CACHE_URL = config('CACHE_URL', default='')
+
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Coalescing of concurrent identical eligibility and loan listing calls.
+# 'local' shares in-flight computations within a process, 'cache' also
+# across processes through the default cache.
+REQUEST_COALESCING = {
+    'BACKEND': config('REQUEST_COALESCING_BACKEND', default='local'),
+    'LOCK_TIMEOUT': config('REQUEST_COALESCING_LOCK_TIMEOUT', default=10, cast=int),
+    'RESULT_TTL': config('REQUEST_COALESCING_RESULT_TTL', default=5, cast=int),
+}
+
+# Idempotency keys on create_loan and register: responses are replayed to
+# retries carrying the same HEADER for TTL seconds. A request waits up to
+# WAIT_TIMEOUT seconds for one with the same key in progress, whose claim
+# lapses after LOCK_TIMEOUT seconds if its process died.
+IDEMPOTENCY = {
+    'HEADER': 'Idempotency-Key',
+    'TTL': config('IDEMPOTENCY_TTL', default=24 * 60 * 60, cast=int),
+    'WAIT_TIMEOUT': config('IDEMPOTENCY_WAIT_TIMEOUT', default=30, cast=float),
+    'LOCK_TIMEOUT': config('IDEMPOTENCY_LOCK_TIMEOUT', default=60, cast=int),
+    'POLL_INTERVAL': 0.05,
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -135,4 +218,137 @@ CELERY_RESULT_BACKEND = config('REDIS_URL', default='redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = TIME_ZONE
\ No newline at end of file
+CELERY_TIMEZONE = TIME_ZONE
+
+CELERY_BEAT_SCHEDULE = {
+    'rescore-all-customers': {
+        'task': 'loans.tasks.rescore_all_customers',
+        'schedule': crontab(hour=1, minute=0),
+    },
+    'archive-closed-loans': {
+        'task': 'loans.tasks.archive_closed_loans',
+        'schedule': crontab(hour=0, minute=30, day_of_week='sunday'),
+    },
+    'rebuild-phone-filter': {
+        'task': 'loans.tasks.rebuild_phone_filter',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # Reconciles current_debt after writes that bypass the services (admin, bulk fixes)
+    'refresh-current-debt': {
+        'task': 'loans.tasks.refresh_current_debt',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    # Applies payments left unapplied when their request failed after the ledger committed
+    'apply-pending-payments': {
+        'task': 'loans.tasks.apply_pending_payments',
+        'schedule': crontab(minute='*/5'),
+    },
+    'purge-idempotency-records': {
+        'task': 'loans.tasks.purge_idempotency_records',
+        'schedule': crontab(minute=15),
+    },
+    # Picks up applications whose scheduled run was lost or whose worker died
+    'originate-loans': {
+        'task': 'loans.tasks.originate_loans',
+        'schedule': crontab(minute='*'),
+    },
+}
+
+# Loan origination gets its own workers: celery -A credit_system worker -Q origination
+CELERY_TASK_ROUTES = {
+    'loans.tasks.originate_loans': {'queue': 'origination'},
+}
+
+# Customers scored per chunk by the scheduled re-scoring job
+CREDIT_SCORE_CHUNK_SIZE = config('CREDIT_SCORE_CHUNK_SIZE', default=2000, cast=int)
+
+# Closed loans moved to loans_archive per transaction by the archival job
+LOAN_ARCHIVE_BATCH_SIZE = config('LOAN_ARCHIVE_BATCH_SIZE', default=1000, cast=int)
+
+# Customers whose current_debt is recomputed per query and transaction
+CURRENT_DEBT_CHUNK_SIZE = config('CURRENT_DEBT_CHUNK_SIZE', default=2000, cast=int)
+
+# Monte Carlo portfolio loss simulation
+PORTFOLIO_SIMULATION = {
+    'BASE_ANNUAL_PD': config('SIMULATION_BASE_ANNUAL_PD', default=0.25, cast=float),
+    'SCORE_DECAY': config('SIMULATION_SCORE_DECAY', default=0.04, cast=float),
+    'FACTOR_LOADING': config('SIMULATION_FACTOR_LOADING', default=0.5, cast=float),
+    'LOSS_GIVEN_DEFAULT': config('SIMULATION_LOSS_GIVEN_DEFAULT', default=0.45, cast=float),
+    'MAX_SCENARIOS': config('SIMULATION_MAX_SCENARIOS', default=50000, cast=int),
+    'CACHE_SECONDS': config('SIMULATION_CACHE_SECONDS', default=24 * 60 * 60, cast=int),
+}
+
+# Spreadsheet rows committed per transaction (and per checkpoint) during ingestion
+INGESTION_CHUNK_SIZE = config('INGESTION_CHUNK_SIZE', default=1000, cast=int)
+
+# Rows fetched per server-side cursor round trip by the streaming exports
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Asynchronous loan origination: queued applications are decided in
+# micro-batches of up to BATCH_SIZE, starting BATCH_DELAY seconds after the
+# first one arrives. Claims older than CLAIM_TIMEOUT seconds are taken over.
+LOAN_ORIGINATION = {
+    'BATCH_SIZE': config('ORIGINATION_BATCH_SIZE', default=200, cast=int),
+    'BATCH_DELAY': config('ORIGINATION_BATCH_DELAY', default=0.2, cast=float),
+    'CLAIM_TIMEOUT': config('ORIGINATION_CLAIM_TIMEOUT', default=300, cast=int),
+}
+
+# Credit policy (loans.policy): every process checks for a newly published
+# version at most every RELOAD_INTERVAL seconds
+CREDIT_POLICY = {
+    'RELOAD_INTERVAL': config('CREDIT_POLICY_RELOAD_INTERVAL', default=30, cast=float),
+}
+
+# Bloom filter of phone numbers (loans.bloom) checked before duplicate lookups:
+# sized for GROWTH times the customers at rebuild (at least MIN_CAPACITY) at
+# ERROR_RATE false positives; processes add newly created customers every
+# SYNC_INTERVAL seconds, looking SYNC_OVERLAP seconds further back
+PHONE_FILTER = {
+    'MIN_CAPACITY': config('PHONE_FILTER_MIN_CAPACITY', default=1000000, cast=int),
+    'GROWTH': 2,
+    'ERROR_RATE': config('PHONE_FILTER_ERROR_RATE', default=0.01, cast=float),
+    'SYNC_INTERVAL': config('PHONE_FILTER_SYNC_INTERVAL', default=10, cast=float),
+    'SYNC_OVERLAP': 60,
+}
+
+# Customers inserted per statement by the batch registration endpoint
+REGISTRATION_BATCH_SIZE = config('REGISTRATION_BATCH_SIZE', default=1000, cast=int)
+
+# Opt-in request profiling: requests carrying a signed HEADER (see
+# `manage.py profiling_token`) or picked with SAMPLE_RATE are run under
+# cProfile and stored in PROFILES_DIR
+REQUEST_PROFILING = {
+    'ENABLED': config('REQUEST_PROFILING_ENABLED', default=True, cast=bool),
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': config('REQUEST_PROFILING_SAMPLE_RATE', default=0.0, cast=float),
+    'SIGNATURE_MAX_AGE': config('REQUEST_PROFILING_SIGNATURE_MAX_AGE', default=3600, cast=int),
+    'PROFILES_DIR': config('REQUEST_PROFILING_DIR', default=str(BASE_DIR / 'profiles')),
+    'MAX_PROFILES': config('REQUEST_PROFILING_MAX_PROFILES', default=200, cast=int),  # 0 keeps all
+    'TOP_FUNCTIONS': 40,
+}
+
+# Slow-query log: statements slower than THRESHOLD_MS are written as JSON
+# lines to LOG_FILE (rotated), with EXPLAIN for the first of each shape
+SLOW_QUERY_LOG = {
+    'ENABLED': config('SLOW_QUERY_LOG_ENABLED', default=True, cast=bool),
+    'THRESHOLD_MS': config('SLOW_QUERY_THRESHOLD_MS', default=200, cast=float),
+    'EXPLAIN': config('SLOW_QUERY_EXPLAIN', default=True, cast=bool),
+    'LOG_FILE': config('SLOW_QUERY_LOG_FILE', default=str(BASE_DIR / 'logs' / 'slow_queries.log')),
+    'MAX_BYTES': config('SLOW_QUERY_LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int),
+    'BACKUP_COUNT': config('SLOW_QUERY_LOG_BACKUP_COUNT', default=5, cast=int),
+}
+
+# Production traffic capture for `manage.py replay_traffic`: SAMPLE_RATE of
+# the requests to VIEWS are written with pseudonymized customer data to
+# gzip NDJSON files in DIR. SECRET keys the pseudonyms
+TRAFFIC_CAPTURE = {
+    'ENABLED': config('TRAFFIC_CAPTURE_ENABLED', default=False, cast=bool),
+    'SAMPLE_RATE': config('TRAFFIC_CAPTURE_SAMPLE_RATE', default=0.01, cast=float),
+    'DIR': config('TRAFFIC_CAPTURE_DIR', default=str(BASE_DIR / 'captures')),
+    'SECRET': config('TRAFFIC_CAPTURE_SECRET', default=SECRET_KEY),
+    # Larger bodies are not captured; keep below DATA_UPLOAD_MAX_MEMORY_SIZE
+    'MAX_BODY_SIZE': config('TRAFFIC_CAPTURE_MAX_BODY_SIZE', default=1024 * 1024, cast=int),
+    'VIEWS': [
+        'register_customer', 'check_eligibility', 'create_loan', 'view_loan', 'view_customer_loans',
+    ],
+}
\ No newline at end of file
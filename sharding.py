@@ -0,0 +1,327 @@
+"""
+Customer-keyed horizontal sharding.
+
+Customers and everything hanging off a customer (loans, archived loans,
+archive summaries, persisted scores, loan applications, applied payment
+markers) live on the shard that the shard map assigns to their customer_id.
+Global tables (auth, ID blocks, the payment ledger, scoring runs, ingestion
+checkpoints) stay on ``default``.
+
+Sharding is off unless SHARDING['SHARDS'] lists database aliases; every
+helper then degrades to the single ``default`` database.
+
+Routing: model instances go to the shard of their customer_id; queries
+without an instance go to the shard selected with ``use_shard`` /
+``customer_shard`` and fail loudly when none is selected. Book-wide work
+runs once per shard (``shard_aliases``, ``scatter``).
+"""
+import bisect
+import contextvars
+import heapq
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+SHARDED_MODELS = {
+    'customer', 'loan', 'archivedloan', 'loanarchivesummary', 'creditscore', 'loanapplication',
+    'appliedpayment',
+}
+
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+class ShardRoutingError(RuntimeError):
+    """A sharded model was queried without a shard being selected"""
+
+
+class ShardMap:
+    """
+    Maps a customer_id to a shard alias.
+    
+    ``hash`` uses jump consistent hashing, so adding a shard only moves
+    about 1/n of the customers; ``range`` uses sorted exclusive upper
+    bounds, e.g. [(1000000, 'shard_0'), (None, 'shard_1')].
+    """
+    
+    def __init__(self, shards, strategy='hash', ranges=None):
+        self.shards = list(shards)
+        self.strategy = strategy
+        if strategy == 'range':
+            ranges = list(ranges or [])
+            self.bounds = [bound for bound, _ in ranges if bound is not None]
+            self.range_shards = [alias for _, alias in ranges]
+            if len(self.range_shards) != len(self.bounds) + 1:
+                raise ValueError('Range shard maps need exactly one open-ended last range')
+        elif strategy != 'hash':
+            raise ValueError(f'Unknown sharding strategy: {strategy}')
+    
+    def shard_for(self, customer_id):
+        if self.strategy == 'range':
+            return self.range_shards[bisect.bisect_right(self.bounds, customer_id)]
+        return self.shards[jump_hash(customer_id, len(self.shards))]
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping and Veach) of an integer key"""
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def sharding_enabled():
+    return bool(settings.SHARDING['SHARDS'])
+
+
+def shard_map():
+    options = settings.SHARDING
+    return ShardMap(options['SHARDS'], options['STRATEGY'], options.get('RANGES'))
+
+
+def shard_aliases():
+    """Databases holding customer data: the shards, or just default"""
+    return list(settings.SHARDING['SHARDS']) or [DEFAULT_DB_ALIAS]
+
+
+def shard_for(customer_id):
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    return shard_map().shard_for(int(customer_id))
+
+
+def current_db():
+    """Alias for customer data in the current context; pass to transaction.atomic(using=...)"""
+    return _current_shard.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_shard(alias):
+    """Route queries on sharded models without an instance to ``alias``"""
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+def customer_shard(customer_id):
+    return use_shard(shard_for(customer_id))
+
+
+def routed_by_customer(view):
+    """
+    Run a view on the shard of the customer_id found in its URL kwargs or
+    request data. Place it below @api_view so request.data is parsed.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not sharding_enabled():
+            return view(request, *args, **kwargs)
+        
+        customer_id = kwargs.get('customer_id')
+        if customer_id is None and isinstance(request.data, dict):
+            customer_id = request.data.get('customer_id')
+        try:
+            alias = shard_for(customer_id)
+        except (TypeError, ValueError):
+            # Validation rejects the request before any shard is queried
+            return view(request, *args, **kwargs)
+        with use_shard(alias):
+            return view(request, *args, **kwargs)
+    return wrapped
+
+
+def group_by_shard(items, customer_id):
+    """{alias: [items]} using ``customer_id(item)`` to place each item"""
+    groups = defaultdict(list)
+    for item in items:
+        groups[shard_for(customer_id(item))].append(item)
+    return groups
+
+
+def scatter(fn, *args, **kwargs):
+    """Run fn once per shard with that shard selected; returns [(alias, result)]"""
+    results = []
+    for alias in shard_aliases():
+        with use_shard(alias):
+            results.append((alias, fn(*args, **kwargs)))
+    return results
+
+
+def gather_sorted(iterables, key=None, reverse=False):
+    """Merge per-shard iterables that are each sorted by ``key``"""
+    return heapq.merge(*iterables, key=key, reverse=reverse)
+
+
+class _IdAllocator:
+    """
+    Hi/lo allocator of globally unique primary keys. Blocks of
+    SHARDING['ID_BLOCK_SIZE'] ids are reserved in the id_blocks table on
+    default and handed out from memory.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}
+    
+    def allocate(self, model, count):
+        name = model._meta.db_table
+        ids = []
+        with self._lock:
+            next_id, end = self._blocks.get(name, (0, 0))
+            while len(ids) < count:
+                if next_id >= end:
+                    next_id, end = self._reserve(model, max(count - len(ids), settings.SHARDING['ID_BLOCK_SIZE']))
+                take = min(count - len(ids), end - next_id)
+                ids.extend(range(next_id, next_id + take))
+                next_id += take
+            self._blocks[name] = (next_id, end)
+        return ids
+    
+    def _reserve(self, model, size):
+        from .models import IdBlock
+        
+        name = model._meta.db_table
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            block = IdBlock.objects.using(DEFAULT_DB_ALIAS).select_for_update().filter(name=name).first()
+            if block is None:
+                block = IdBlock.objects.using(DEFAULT_DB_ALIAS).create(
+                    name=name, next_id=_max_id(model) + 1
+                )
+            start = block.next_id
+            block.next_id = start + size
+            block.save(using=DEFAULT_DB_ALIAS, update_fields=['next_id'])
+        return start, start + size
+    
+    def reset(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+def _max_id(model):
+    pk = model._meta.pk.name
+    highest = 0
+    for alias in shard_aliases():
+        value = model.objects.using(alias).order_by(f'-{pk}').values_list(pk, flat=True).first()
+        highest = max(highest, value or 0)
+    return highest
+
+
+_allocator = _IdAllocator()
+
+
+def allocate_ids(model, count):
+    return _allocator.allocate(model, count)
+
+
+def assign_ids(objs):
+    """Give unsaved objects globally unique primary keys when sharding is on"""
+    if not sharding_enabled():
+        return objs
+    pending = [obj for obj in objs if obj.pk is None]
+    if pending:
+        for obj, pk in zip(pending, allocate_ids(type(pending[0]), len(pending))):
+            obj.pk = pk
+    return objs
+
+
+def move_customers(customer_ids, source, target):
+    """
+    Move customers and all their customer-keyed rows from ``source`` to
+    ``target``. The copy commits on the target before the source rows are
+    deleted; leftovers of an interrupted move are replaced on retry.
+    """
+    from .models import (
+        Customer, Loan, ArchivedLoan, LoanArchiveSummary, CreditScore, LoanApplication, AppliedPayment
+    )
+    
+    # Parents first so foreign keys resolve on databases that check them
+    moved_models = [
+        Customer, Loan, ArchivedLoan, LoanArchiveSummary, CreditScore, LoanApplication, AppliedPayment
+    ]
+    rows = {
+        model: list(model.objects.using(source).filter(customer_id__in=customer_ids))
+        for model in moved_models
+    }
+    
+    with transaction.atomic(using=target):
+        Customer.objects.using(target).filter(customer_id__in=customer_ids).delete()
+        LoanApplication.objects.using(target).filter(customer_id__in=customer_ids).delete()
+        for model in moved_models:
+            _copy_rows(model, rows[model], target)
+    
+    with transaction.atomic(using=source):
+        Customer.objects.using(source).filter(customer_id__in=customer_ids).delete()
+        LoanApplication.objects.using(source).filter(customer_id__in=customer_ids).delete()
+    
+    return {model._meta.db_table: len(rows[model]) for model in moved_models}
+
+
+def _copy_rows(model, objs, target):
+    """bulk_create on ``target`` keeping auto_now/auto_now_add timestamps"""
+    if not objs:
+        return
+    timestamp_fields = [
+        field.attname for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    originals = [[getattr(obj, name) for name in timestamp_fields] for obj in objs]
+    
+    model.objects.using(target).bulk_create(objs)
+    
+    if timestamp_fields:
+        for obj, values in zip(objs, originals):
+            for name, value in zip(timestamp_fields, values):
+                setattr(obj, name, value)
+        # bulk_update leaves auto_now fields alone, unlike save() and bulk_create()
+        model.objects.using(target).bulk_update(objs, timestamp_fields)
+
+
+class ShardRouter:
+    """Database router for customer-keyed sharding"""
+    
+    def _db(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if model._meta.model_name not in SHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        
+        instance = hints.get('instance')
+        if instance is not None:
+            if instance._state.db:
+                return instance._state.db
+            customer_id = getattr(instance, 'customer_id', None)
+            if customer_id is not None:
+                return shard_for(customer_id)
+        
+        alias = _current_shard.get()
+        if alias is None:
+            raise ShardRoutingError(
+                f'No shard selected for {model.__name__}: use customer_shard() or scatter()'
+            )
+        return alias
+    
+    db_for_read = _db
+    db_for_write = _db
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        if not sharding_enabled():
+            return None
+        sharded = {obj._meta.model_name in SHARDED_MODELS for obj in (obj1, obj2)}
+        if sharded == {True}:
+            return obj1._state.db == obj2._state.db or None in (obj1._state.db, obj2._state.db)
+        return None
+    
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding_enabled():
+            return None
+        if model_name in SHARDED_MODELS:
+            return db in settings.SHARDING['SHARDS']
+        return db == DEFAULT_DB_ALIAS
\ No newline at end of file
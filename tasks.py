@@ -1,138 +1,363 @@
-from celery import shared_task
-import pandas as pd
+from celery import shared_task, chord
+import hashlib
+import time
 from decimal import Decimal
 from datetime import datetime
-from .models import Customer, Loan
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from .models import (
+    Customer, Loan, ArchivedLoan, CreditScore, ScoringRun, ScoringChunk, IngestionCheckpoint,
+    IdempotencyRecord
+)
+from .services import (
+    CreditScoreService, CustomerService, DebtService, LoanEligibilityService, LoanArchiveService,
+    LoanOriginationService, PaymentService
+)
+from .sharding import assign_ids, gather_sorted, group_by_shard, scatter, shard_aliases, use_shard
+from .bloom import rebuild_snapshot, remember_phone_numbers
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def ingest_customer_data(file_path):
+# Spreadsheet headers mapped to the column names used below
+COLUMN_ALIASES = {
+    'Customer ID': 'customer_id',
+    'First Name': 'first_name',
+    'Last Name': 'last_name',
+    'Age': 'age',
+    'Phone Number': 'phone_number',
+    'Monthly Salary': 'monthly_salary',
+    'Approved Limit': 'approved_limit',
+    'Current Debt': 'current_debt',
+    'Loan ID': 'loan_id',
+    'Loan Amount': 'loan_amount',
+    'Tenure': 'tenure',
+    'Interest Rate': 'interest_rate',
+    'Monthly payment': 'monthly_repayment',
+    'EMIs paid on Time': 'emis_paid_on_time',
+    'Date of Approval': 'start_date',
+    'End Date': 'end_date',
+}
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def ingest_customer_data(self, file_path, chunk_size=None):
     """
     Background task to ingest customer data from Excel file
     """
     try:
         # Read Excel file
-        df = pd.read_excel(file_path)
+        df = _read_spreadsheet(file_path)
         
-        customers_created = 0
-        customers_updated = 0
+        result = _ingest_in_chunks(
+            self, IngestionCheckpoint.KIND_CUSTOMERS, file_path, df,
+            _ingest_customer_chunk, chunk_size or settings.INGESTION_CHUNK_SIZE
+        )
         
-        for _, row in df.iterrows():
-            try:
-                customer_data = {
-                    'first_name': row.get('first_name', ''),
-                    'last_name': row.get('last_name', ''),
-                    'phone_number': int(row.get('phone_number', 0)),
-                    'monthly_salary': Decimal(str(row.get('monthly_salary', 0))),
-                    'approved_limit': Decimal(str(row.get('approved_limit', 0))),
-                    'current_debt': Decimal(str(row.get('current_debt', 0))),
-                }
-                
-                # Try to get existing customer by phone number
-                customer, created = Customer.objects.get_or_create(
-                    phone_number=customer_data['phone_number'],
-                    defaults=customer_data
-                )
-                
-                if created:
-                    customers_created += 1
-                    logger.info(f"Created customer: {customer.name}")
-                else:
-                    # Update existing customer
-                    for key, value in customer_data.items():
-                        setattr(customer, key, value)
-                    customer.save()
-                    customers_updated += 1
-                    logger.info(f"Updated customer: {customer.name}")
-                    
-            except Exception as e:
-                logger.error(f"Error processing customer row: {e}")
-                continue
-        
-        logger.info(f"Customer data ingestion completed. Created: {customers_created}, Updated: {customers_updated}")
+        logger.info(
+            f"Customer data ingestion completed. Created: {result['created']}, "
+            f"Updated: {result['updated']}, Errors: {result['errors']}"
+        )
         return {
             'status': 'success',
-            'customers_created': customers_created,
-            'customers_updated': customers_updated
+            'customers_created': result['created'],
+            'customers_updated': result['updated'],
+            'errors': result['errors'],
+            'resumed_from_row': result['resumed_from_row']
         }
         
     except Exception as e:
         logger.error(f"Error in customer data ingestion: {e}")
-        return {'status': 'error', 'message': str(e)}
+        # The retry resumes after the last committed chunk; once retries run out the task fails
+        raise self.retry(exc=e)
 
 
-@shared_task
-def ingest_loan_data(file_path):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def ingest_loan_data(self, file_path, chunk_size=None):
     """
     Background task to ingest loan data from Excel file
     """
     try:
         # Read Excel file
-        df = pd.read_excel(file_path)
-        
-        loans_created = 0
-        loans_updated = 0
+        df = _read_spreadsheet(file_path)
         
-        for _, row in df.iterrows():
-            try:
-                customer_id = int(row.get('customer_id', 0))
-                
-                # Get customer
-                try:
-                    customer = Customer.objects.get(customer_id=customer_id)
-                except Customer.DoesNotExist:
-                    logger.warning(f"Customer {customer_id} not found for loan")
-                    continue
-                
-                loan_data = {
-                    'customer': customer,
-                    'loan_amount': Decimal(str(row.get('loan_amount', 0))),
-                    'tenure': int(row.get('tenure', 0)),
-                    'interest_rate': Decimal(str(row.get('interest_rate', 0))),
-                    'monthly_repayment': Decimal(str(row.get('monthly_repayment', 0))),
-                    'emis_paid_on_time': int(row.get('emis_paid_on_time', 0)),
-                    'start_date': pd.to_datetime(row.get('start_date')).date(),
-                    'end_date': pd.to_datetime(row.get('end_date')).date(),
-                }
-                
-                # Check if loan already exists (by customer and loan amount and start date)
-                existing_loan = Loan.objects.filter(
-                    customer=customer,
-                    loan_amount=loan_data['loan_amount'],
-                    start_date=loan_data['start_date']
-                ).first()
-                
-                if existing_loan:
-                    # Update existing loan
-                    for key, value in loan_data.items():
-                        if key != 'customer':  # Don't update customer reference
-                            setattr(existing_loan, key, value)
-                    existing_loan.save()
-                    loans_updated += 1
-                    logger.info(f"Updated loan for customer {customer.name}")
-                else:
-                    # Create new loan
-                    loan = Loan.objects.create(**loan_data)
-                    loans_created += 1
-                    logger.info(f"Created loan {loan.loan_id} for customer {customer.name}")
-                    
-            except Exception as e:
-                logger.error(f"Error processing loan row: {e}")
-                continue
+        result = _ingest_in_chunks(
+            self, IngestionCheckpoint.KIND_LOANS, file_path, df,
+            _ingest_loan_chunk, chunk_size or settings.INGESTION_CHUNK_SIZE
+        )
         
-        logger.info(f"Loan data ingestion completed. Created: {loans_created}, Updated: {loans_updated}")
+        logger.info(
+            f"Loan data ingestion completed. Created: {result['created']}, "
+            f"Updated: {result['updated']}, Errors: {result['errors']}"
+        )
         return {
             'status': 'success',
-            'loans_created': loans_created,
-            'loans_updated': loans_updated
+            'loans_created': result['created'],
+            'loans_updated': result['updated'],
+            'errors': result['errors'],
+            'resumed_from_row': result['resumed_from_row']
         }
         
     except Exception as e:
         logger.error(f"Error in loan data ingestion: {e}")
-        return {'status': 'error', 'message': str(e)}
+        # The retry resumes after the last committed chunk; once retries run out the task fails
+        raise self.retry(exc=e)
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_spreadsheet(file_path):
+    """
+    Read an ingestion spreadsheet with canonical column names. pandas and
+    its Excel engine are imported here so that web and worker processes
+    that never ingest do not pay for them at startup.
+    """
+    import pandas as pd
+    
+    return pd.read_excel(file_path).rename(columns=COLUMN_ALIASES)
+
+
+def _ingest_in_chunks(task, kind, file_path, df, ingest_chunk, chunk_size):
+    """
+    Apply ingest_chunk to the rows of df one chunk at a time. Each chunk is
+    committed in one transaction together with the checkpoint, so a retried
+    task resumes after the last committed chunk without duplicating rows.
+    With sharding each shard commits its part of the chunk on its own; the
+    upserts are keyed, so replaying a chunk after a crash is harmless.
+    """
+    total_rows = len(df)
+    checkpoint, _ = IngestionCheckpoint.objects.get_or_create(
+        kind=kind,
+        file_hash=_file_hash(file_path),
+        defaults={'total_rows': total_rows}
+    )
+    if checkpoint.completed_at is not None:
+        # Only failed runs are resumed; ingesting a finished file again re-applies it
+        checkpoint.rows_committed = 0
+        checkpoint.total_rows = total_rows
+        checkpoint.completed_at = None
+        checkpoint.save(update_fields=['rows_committed', 'total_rows', 'completed_at', 'updated_at'])
+    
+    start_row = checkpoint.rows_committed
+    if start_row:
+        logger.info(f"Resuming {kind} ingestion of {file_path} at row {start_row}")
+    
+    progress = _ProgressReporter(task, kind, total_rows, start_row)
+    totals = {'created': 0, 'updated': 0, 'errors': 0, 'resumed_from_row': start_row}
+    
+    for chunk_start in range(start_row, total_rows, chunk_size):
+        chunk = df.iloc[chunk_start:chunk_start + chunk_size]
+        
+        with transaction.atomic():
+            counts = ingest_chunk(chunk)
+            IngestionCheckpoint.objects.filter(pk=checkpoint.pk).update(
+                rows_committed=chunk_start + len(chunk),
+                updated_at=timezone.now()
+            )
+        
+        for key, value in counts.items():
+            totals[key] += value
+        progress.report(chunk_start + len(chunk))
+    
+    IngestionCheckpoint.objects.filter(pk=checkpoint.pk).update(completed_at=timezone.now())
+    return totals
+
+
+class _ProgressReporter:
+    """Publish rows processed, rows per second and ETA as Celery task state"""
+    
+    def __init__(self, task, kind, total_rows, start_row):
+        self.task = task
+        self.kind = kind
+        self.total_rows = total_rows
+        self.start_row = start_row
+        self.started = time.monotonic()
+    
+    def report(self, rows_processed):
+        elapsed = time.monotonic() - self.started
+        rows_per_second = (rows_processed - self.start_row) / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_rows - rows_processed
+        eta_seconds = remaining / rows_per_second if rows_per_second else None
+        
+        meta = {
+            'kind': self.kind,
+            'rows_processed': rows_processed,
+            'total_rows': self.total_rows,
+            'rows_per_second': round(rows_per_second, 1),
+            'eta_seconds': round(eta_seconds, 1) if eta_seconds is not None else None,
+        }
+        # Only tasks running in a worker have a state to update
+        if self.task.request.id:
+            self.task.update_state(state='PROGRESS', meta=meta)
+        logger.info(
+            f"Ingested {rows_processed}/{self.total_rows} {self.kind} rows "
+            f"({meta['rows_per_second']} rows/s, ETA {meta['eta_seconds']}s)"
+        )
+
+
+def _ingest_customer_chunk(chunk):
+    """Upsert one chunk of customer rows keyed by phone number"""
+    errors = 0
+    rows = []
+    for _, row in chunk.iterrows():
+        try:
+            rows.append({
+                'first_name': row.get('first_name', ''),
+                'last_name': row.get('last_name', ''),
+                'age': int(row.get('age', 25)),
+                'phone_number': int(row.get('phone_number', 0)),
+                'monthly_salary': Decimal(str(row.get('monthly_salary', 0))),
+                'approved_limit': Decimal(str(row.get('approved_limit', 0))),
+                'current_debt': Decimal(str(row.get('current_debt', 0))),
+            })
+        except Exception as e:
+            logger.error(f"Error processing customer row: {e}")
+            errors += 1
+    
+    # Only numbers the phone filter cannot rule out are looked up
+    phone_numbers = CustomerService.probably_registered(r['phone_number'] for r in rows)
+    existing = {
+        customer.phone_number: customer
+        for _, customers in scatter(lambda: list(Customer.objects.filter(phone_number__in=phone_numbers)))
+        for customer in customers
+    } if phone_numbers else {}
+    
+    new_customers = {}
+    limit_changed = set()
+    for customer_data in rows:
+        phone_number = customer_data['phone_number']
+        customer = existing.get(phone_number) or new_customers.get(phone_number)
+        
+        if customer is None:
+            customer = Customer(**customer_data)
+            if not customer.approved_limit:
+                customer.approved_limit = Customer.calculate_approved_limit(customer.monthly_salary)
+            new_customers[phone_number] = customer
+        else:
+            approved_limit = customer.approved_limit
+            for key, value in customer_data.items():
+                setattr(customer, key, value)
+            if not customer.approved_limit:
+                customer.approved_limit = Customer.calculate_approved_limit(customer.monthly_salary)
+            if customer.approved_limit != approved_limit and phone_number in existing:
+                limit_changed.add(customer.customer_id)
+    
+    assign_ids(list(new_customers.values()))
+    new_by_shard = group_by_shard(new_customers.values(), lambda customer: customer.customer_id)
+    existing_by_shard = group_by_shard(existing.values(), lambda customer: customer.customer_id)
+    for alias in sorted(set(new_by_shard) | set(existing_by_shard)):
+        with use_shard(alias), transaction.atomic(using=alias):
+            Customer.objects.bulk_create(new_by_shard.get(alias, []))
+            # The spreadsheet's current_debt only seeds new customers; after that it
+            # is maintained from their loans
+            Customer.objects.bulk_update(
+                existing_by_shard.get(alias, []),
+                ['first_name', 'last_name', 'age', 'monthly_salary', 'approved_limit']
+            )
+            # The score depends on approved_limit, and bulk writes bypass Customer.save
+            CreditScore.objects.filter(customer_id__in=[
+                customer.customer_id for customer in existing_by_shard.get(alias, [])
+                if customer.customer_id in limit_changed
+            ]).delete()
+    remember_phone_numbers(new_customers)
+    return {'created': len(new_customers), 'updated': len(existing), 'errors': errors}
+
+
+def _ingest_loan_chunk(chunk):
+    """Upsert one chunk of loan rows keyed by customer, amount and start date"""
+    import pandas as pd
+    
+    errors = 0
+    rows = []
+    for _, row in chunk.iterrows():
+        try:
+            rows.append({
+                'customer_id': int(row.get('customer_id', 0)),
+                'loan_amount': Decimal(str(row.get('loan_amount', 0))),
+                'tenure': int(row.get('tenure', 0)),
+                'interest_rate': Decimal(str(row.get('interest_rate', 0))),
+                'monthly_repayment': Decimal(str(row.get('monthly_repayment', 0))),
+                'emis_paid_on_time': int(row.get('emis_paid_on_time', 0)),
+                'start_date': pd.to_datetime(row.get('start_date')).date(),
+                'end_date': pd.to_datetime(row.get('end_date')).date(),
+            })
+        except Exception as e:
+            logger.error(f"Error processing loan row: {e}")
+            errors += 1
+    
+    counts = {'created': 0, 'updated': 0, 'errors': errors}
+    for alias, shard_rows in sorted(group_by_shard(rows, lambda r: r['customer_id']).items()):
+        with use_shard(alias), transaction.atomic(using=alias):
+            created, updated = _upsert_loan_rows(shard_rows)
+        counts['created'] += created
+        counts['updated'] += updated
+    return counts
+
+
+def _upsert_loan_rows(rows):
+    """Upsert parsed loan rows of customers on the current shard; returns (created, updated)"""
+    customer_ids = set(Customer.objects.filter(
+        customer_id__in={r['customer_id'] for r in rows}
+    ).values_list('customer_id', flat=True))
+    
+    # Check if loans already exist (by customer and loan amount and start date)
+    existing = {}
+    for loan in Loan.objects.filter(
+        customer_id__in=customer_ids,
+        start_date__in={r['start_date'] for r in rows}
+    ).order_by('loan_id'):
+        existing.setdefault((loan.customer_id, loan.loan_amount, loan.start_date), loan)
+    
+    # Archived loans are closed for good: re-ingesting them must not bring them back
+    archived = set(ArchivedLoan.objects.filter(
+        customer_id__in=customer_ids,
+        start_date__in={r['start_date'] for r in rows}
+    ).values_list('customer_id', 'loan_amount', 'start_date'))
+    
+    new_loans = {}
+    updated = {}
+    for loan_data in rows:
+        if loan_data['customer_id'] not in customer_ids:
+            logger.warning(f"Customer {loan_data['customer_id']} not found for loan")
+            continue
+        
+        key = (loan_data['customer_id'], loan_data['loan_amount'], loan_data['start_date'])
+        if key in archived:
+            continue
+        loan = existing.get(key) or new_loans.get(key)
+        
+        if loan is None:
+            loan = Loan(**loan_data)
+            if not loan.monthly_repayment:
+                loan.monthly_repayment = LoanEligibilityService.calculate_emi(
+                    loan.loan_amount, loan.interest_rate, loan.tenure
+                )
+            new_loans[key] = loan
+        else:
+            for field, value in loan_data.items():
+                setattr(loan, field, value)
+            if key in existing:
+                updated[key] = loan
+    
+    Loan.objects.bulk_create(assign_ids(list(new_loans.values())))
+    Loan.objects.bulk_update(
+        updated.values(),
+        ['tenure', 'interest_rate', 'monthly_repayment', 'emis_paid_on_time', 'end_date']
+    )
+    # Bulk writes bypass Loan.save, so drop the persisted scores here
+    touched_customers = {key[0] for key in new_loans} | {key[0] for key in updated}
+    CreditScore.objects.filter(customer_id__in=touched_customers).delete()
+    DebtService.refresh_current_debt(touched_customers)
+    return len(new_loans), len(updated)
 
 
 @shared_task
@@ -155,4 +380,280 @@ def ingest_all_data():
         
     except Exception as e:
         logger.error(f"Error in data ingestion: {e}")
-        return {'status': 'error', 'message': str(e)}
\ No newline at end of file
+        return {'status': 'error', 'message': str(e)}
+
+
+@shared_task
+def rescore_all_customers(chunk_size=None):
+    """
+    Scheduled task to re-score every customer in customer_id chunks.
+    An unfinished run is resumed: only chunks that have not completed yet
+    are dispatched again.
+    """
+    run = ScoringRun.objects.filter(
+        status=ScoringRun.STATUS_RUNNING
+    ).order_by('-started_at').first()
+    
+    if run is None:
+        run = _plan_scoring_run(chunk_size or settings.CREDIT_SCORE_CHUNK_SIZE)
+    else:
+        logger.info(f"Resuming scoring run {run.pk}")
+    
+    pending_chunks = list(
+        run.chunks.filter(completed_at__isnull=True).values_list('pk', flat=True)
+    )
+    
+    if not pending_chunks:
+        return finalize_scoring_run(run.pk)
+    
+    chord(
+        rescore_customer_chunk.s(chunk_pk) for chunk_pk in pending_chunks
+    )(finalize_scoring_run.si(run.pk))
+    
+    return {
+        'status': 'dispatched',
+        'run_id': run.pk,
+        'chunks_dispatched': len(pending_chunks),
+        'total_chunks': run.total_chunks
+    }
+
+
+def _plan_scoring_run(chunk_size):
+    """Create a scoring run with contiguous customer_id chunks of chunk_size customers"""
+    run = ScoringRun.objects.create(
+        score_year=datetime.now().year,
+        chunk_size=chunk_size
+    )
+    
+    chunks = []
+    first_id = last_id = None
+    count = 0
+    # With sharding the ids of every shard are merged into one sorted stream
+    customer_ids = gather_sorted(
+        Customer.objects.using(alias).order_by('customer_id').values_list(
+            'customer_id', flat=True
+        ).iterator(chunk_size=chunk_size)
+        for alias in shard_aliases()
+    )
+    
+    for customer_id in customer_ids:
+        if first_id is None:
+            first_id = customer_id
+        last_id = customer_id
+        count += 1
+        if count == chunk_size:
+            chunks.append(ScoringChunk(run=run, first_customer_id=first_id, last_customer_id=last_id))
+            first_id, count = None, 0
+    
+    if first_id is not None:
+        chunks.append(ScoringChunk(run=run, first_customer_id=first_id, last_customer_id=last_id))
+    
+    ScoringChunk.objects.bulk_create(chunks)
+    run.total_chunks = len(chunks)
+    run.save(update_fields=['total_chunks'])
+    
+    logger.info(f"Planned scoring run {run.pk} with {len(chunks)} chunks of {chunk_size} customers")
+    return run
+
+
+@shared_task(autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=3)
+def rescore_customer_chunk(chunk_pk):
+    """
+    Score one chunk of customers with a single aggregate query and upsert
+    the scores with their components
+    """
+    chunk = ScoringChunk.objects.select_related('run').get(pk=chunk_pk)
+    if chunk.completed_at is not None:
+        return chunk.customers_scored
+    
+    started = time.monotonic()
+    # A customer_id range spans every shard
+    shard_breakdowns = scatter(
+        CreditScoreService.score_customer_range, chunk.first_customer_id, chunk.last_customer_id
+    )
+    
+    scored = 0
+    for alias, breakdowns in shard_breakdowns:
+        records = [
+            CreditScore(
+                customer_id=breakdown['customer_id'],
+                credit_score=breakdown['credit_score'],
+                on_time_score=breakdown['on_time_score'],
+                loan_count_score=breakdown['loan_count_score'],
+                current_year_score=breakdown['current_year_score'],
+                volume_score=breakdown['volume_score'],
+                total_loans=breakdown['total_loans'],
+                score_year=chunk.run.score_year,
+                policy_version=breakdown['policy_version'],
+            )
+            for breakdown in breakdowns
+        ]
+        with use_shard(alias), transaction.atomic(using=alias):
+            CreditScore.objects.bulk_create(
+                records,
+                update_conflicts=True,
+                unique_fields=['customer'],
+                update_fields=[
+                    'credit_score', 'on_time_score', 'loan_count_score', 'current_year_score',
+                    'volume_score', 'total_loans', 'score_year', 'policy_version', 'scored_at'
+                ]
+            )
+        scored += len(records)
+    
+    with transaction.atomic():
+        duration = time.monotonic() - started
+        chunk.customers_scored = scored
+        chunk.duration_seconds = duration
+        chunk.completed_at = timezone.now()
+        chunk.save(update_fields=['customers_scored', 'duration_seconds', 'completed_at'])
+    
+    rate = scored / duration if duration > 0 else float(scored)
+    logger.info(
+        f"Scored customers {chunk.first_customer_id}-{chunk.last_customer_id}: "
+        f"{scored} customers at {rate:.0f} customers/s"
+    )
+    return scored
+
+
+@shared_task
+def finalize_scoring_run(run_pk):
+    """Close a scoring run once all of its chunks have completed"""
+    run = ScoringRun.objects.get(pk=run_pk)
+    
+    if run.chunks.filter(completed_at__isnull=True).exists():
+        logger.warning(f"Scoring run {run.pk} still has pending chunks; it will resume on the next run")
+        return {'status': 'incomplete', 'run_id': run.pk}
+    
+    customers_scored = sum(run.chunks.values_list('customers_scored', flat=True))
+    finished_at = timezone.now()
+    elapsed = (finished_at - run.started_at).total_seconds()
+    
+    run.customers_scored = customers_scored
+    run.customers_per_second = customers_scored / elapsed if elapsed > 0 else None
+    run.finished_at = finished_at
+    run.status = ScoringRun.STATUS_COMPLETED
+    run.save(update_fields=['customers_scored', 'customers_per_second', 'finished_at', 'status'])
+    
+    logger.info(
+        f"Scoring run {run.pk} completed. Scored: {customers_scored} customers "
+        f"in {elapsed:.1f}s ({run.customers_per_second or 0:.0f} customers/s)"
+    )
+    return {
+        'status': 'success',
+        'run_id': run.pk,
+        'customers_scored': customers_scored,
+        'customers_per_second': run.customers_per_second
+    }
+
+
+@shared_task
+def archive_closed_loans(batch_size=None):
+    """
+    Scheduled task to move loans that ended before the current year and
+    were paid on time into loans_archive
+    """
+    started = time.monotonic()
+    result = {'archived': 0, 'customers': 0}
+    for _, shard_result in scatter(LoanArchiveService.archive_closed_loans, batch_size=batch_size):
+        result['archived'] += shard_result['archived']
+        result['customers'] += shard_result['customers']
+    logger.info(
+        f"Archived {result['archived']} closed loans of {result['customers']} customers "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return result
+
+
+@shared_task
+def refresh_current_debt(chunk_size=None):
+    """
+    Scheduled task to recompute every customer's current_debt from the
+    outstanding principal of their loans
+    """
+    started = time.monotonic()
+    refreshed = sum(count for _, count in scatter(DebtService.refresh_all, chunk_size))
+    logger.info(f"Refreshed current_debt of {refreshed} customers in {time.monotonic() - started:.1f}s")
+    return refreshed
+
+
+@shared_task
+def apply_pending_payments():
+    """
+    Scheduled task to apply ledger payments whose loan update did not run
+    or failed after the ledger committed
+    """
+    applied = PaymentService.apply_payments()
+    if applied:
+        logger.info(f"Applied {applied} pending payments")
+    return applied
+
+
+@shared_task
+def rebuild_phone_filter():
+    """Scheduled task to rebuild the phone number filter from the customers table and persist it"""
+    started = time.monotonic()
+    snapshot = rebuild_snapshot()
+    logger.info(
+        f"Rebuilt phone filter ({snapshot.bit_count} bits, {snapshot.hash_count} hashes) "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return snapshot.pk
+
+
+@shared_task
+def purge_idempotency_records():
+    """Scheduled task to delete stored idempotent responses past their TTL"""
+    deleted, _ = IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()
+    logger.info(f"Purged {deleted} expired idempotency records")
+    return deleted
+
+
+ORIGINATION_SCHEDULED_KEY = 'loans:origination:scheduled'
+
+
+def schedule_origination():
+    """
+    Enqueue originate_loans BATCH_DELAY seconds after the first queued
+    application, so applications arriving meanwhile join its micro-batch
+    """
+    # The key expires on its own if the enqueued run is lost; beat sweeps every minute
+    if cache.add(ORIGINATION_SCHEDULED_KEY, True, 60):
+        originate_loans.apply_async(countdown=settings.LOAN_ORIGINATION['BATCH_DELAY'])
+
+
+@shared_task
+def originate_loans(batch_size=None):
+    """
+    Decide queued loan applications in micro-batches on every shard until
+    none are left. Routed to the 'origination' queue.
+    """
+    # Applications queued from now on schedule another run
+    cache.delete(ORIGINATION_SCHEDULED_KEY)
+    
+    options = settings.LOAN_ORIGINATION
+    batch_size = batch_size or options['BATCH_SIZE']
+    
+    def drain_shard():
+        counts = {'approved': 0, 'rejected': 0}
+        while True:
+            token, claimed = LoanOriginationService.claim_applications(
+                batch_size, options['CLAIM_TIMEOUT']
+            )
+            if not claimed:
+                return counts
+            for outcome, count in LoanOriginationService.process_applications(token).items():
+                counts[outcome] += count
+    
+    started = time.monotonic()
+    result = {'approved': 0, 'rejected': 0}
+    for _, counts in scatter(drain_shard):
+        result['approved'] += counts['approved']
+        result['rejected'] += counts['rejected']
+    
+    decided = result['approved'] + result['rejected']
+    if decided:
+        logger.info(
+            f"Decided {decided} loan applications ({result['approved']} approved) "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+    return result
\ No newline at end of file
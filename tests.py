@@ -1,7 +1,10 @@
+from unittest import skipUnless
+from django.conf import settings
 from django.test import TestCase
 from rest_framework.test import APITestCase
 from rest_framework import status
 from decimal import Decimal
+import json
 from .models import Customer, Loan
 from .services import CreditScoreService, LoanEligibilityService
 
@@ -168,4 +171,2161 @@ class LoanEligibilityServiceTest(TestCase):
         """Test eligibility for customer with high credit score"""
         # This would require mocking the credit score service
         # or creating a customer with good loan history
-        pass
\ No newline at end of file
+        pass
+
+class CreditScoreRescoringTest(TestCase):
+    def setUp(self):
+        self.customers = [
+            Customer.objects.create(
+                first_name=f"Batch{i}",
+                last_name="Score",
+                age=30 + i,
+                phone_number=9876500000 + i,
+                monthly_salary=Decimal('50000')
+            )
+            for i in range(3)
+        ]
+        Loan.objects.create(
+            customer=self.customers[0],
+            loan_amount=Decimal('100000'),
+            tenure=12,
+            interest_rate=Decimal('10.0'),
+            emis_paid_on_time=12,
+            start_date='2023-01-01',
+            end_date='2023-12-31'
+        )
+    
+    def test_range_scoring_matches_on_demand_score(self):
+        """Set-based chunk scoring produces the same scores as the per-customer path"""
+        breakdowns = CreditScoreService.score_customer_range(
+            self.customers[0].customer_id, self.customers[-1].customer_id
+        )
+        self.assertEqual(len(breakdowns), 3)
+        for breakdown in breakdowns:
+            self.assertEqual(
+                breakdown['credit_score'],
+                CreditScoreService.calculate_credit_score(breakdown['customer_id'])
+            )
+    
+    def test_rescoring_chunks_persist_scores_and_resume(self):
+        """Completed chunks are persisted and skipped when the run resumes"""
+        from .tasks import _plan_scoring_run, rescore_customer_chunk, finalize_scoring_run
+        from .models import CreditScore
+        
+        run = _plan_scoring_run(chunk_size=2)
+        self.assertEqual(run.total_chunks, 2)
+        
+        first_chunk, second_chunk = run.chunks.order_by('first_customer_id')
+        rescore_customer_chunk(first_chunk.pk)
+        self.assertEqual(finalize_scoring_run(run.pk)['status'], 'incomplete')
+        
+        rescore_customer_chunk(second_chunk.pk)
+        result = finalize_scoring_run(run.pk)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['customers_scored'], 3)
+        
+        record = CreditScore.objects.get(customer=self.customers[0])
+        self.assertEqual(record.on_time_score, 40)
+        self.assertEqual(
+            CreditScoreService.get_credit_score(self.customers[0].customer_id),
+            record.credit_score
+        )
+    
+    def test_loan_write_invalidates_persisted_score(self):
+        """Writing a loan drops the customer's persisted score"""
+        from .models import CreditScore
+        
+        CreditScore.objects.create(customer=self.customers[1], credit_score=99, score_year=2000)
+        Loan.objects.create(
+            customer=self.customers[1],
+            loan_amount=Decimal('10000'),
+            tenure=6,
+            interest_rate=Decimal('10.0'),
+            start_date='2023-01-01',
+            end_date='2023-06-30'
+        )
+        self.assertFalse(CreditScore.objects.filter(customer=self.customers[1]).exists())
+
+
+class PortfolioSimulationTest(APITestCase):
+    def setUp(self):
+        from datetime import date, timedelta
+        
+        today = date.today()
+        for i in range(4):
+            customer = Customer.objects.create(
+                first_name=f"Sim{i}",
+                last_name="Customer",
+                age=40,
+                phone_number=9876510000 + i,
+                monthly_salary=Decimal('60000')
+            )
+            Loan.objects.create(
+                customer=customer,
+                loan_amount=Decimal('200000'),
+                tenure=24,
+                interest_rate=Decimal('14.0'),
+                emis_paid_on_time=i * 2,
+                start_date=today - timedelta(days=240),
+                end_date=today + timedelta(days=480)
+            )
+    
+    def test_simulation_is_reproducible_and_bucketed(self):
+        """The same seed gives the same report, and losses are split by score band"""
+        from .simulation import LoanBook, PortfolioLossSimulator
+        
+        book = LoanBook.load_active()
+        self.assertEqual(len(book), 4)
+        
+        first = PortfolioLossSimulator(book, seed=7, batch_size=250).run(1000)
+        second = PortfolioLossSimulator(book, seed=7, batch_size=250).run(1000)
+        
+        self.assertEqual(first['expected_loss'], second['expected_loss'])
+        self.assertEqual(first['value_at_risk'], second['value_at_risk'])
+        self.assertEqual(first['scenarios'], 1000)
+        self.assertGreaterEqual(first['value_at_risk']['0.99'], first['value_at_risk']['0.95'])
+        self.assertEqual(sum(bucket['loans'] for bucket in first['buckets'].values()), 4)
+    
+    def test_simulation_endpoint(self):
+        """Simulation endpoint validates input and serves the report"""
+        from django.core.cache import cache
+        from django.core.management import CommandError, call_command
+        from .simulation import run_portfolio_simulation, simulation_cache_key
+        
+        response = self.client.get('/portfolio/loss-simulation/', {'scenarios': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/portfolio/loss-simulation/', {'scenarios': 10, 'seed': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertRaisesMessage(CommandError, '--seed must be a non-negative integer'):
+            call_command('simulate_portfolio', '--scenarios=10', '--seed=-1')
+        
+        # Uncached runs (the simulate_portfolio command) leave the API's cache alone
+        cache.delete(simulation_cache_key(200, 1))
+        run_portfolio_simulation(200, seed=1, batch_size=50, use_cache=False)
+        self.assertIsNone(cache.get(simulation_cache_key(200, 1)))
+        
+        response = self.client.get('/portfolio/loss-simulation/', {'scenarios': 200, 'seed': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['loans'], 4)
+        self.assertIn('expected_loss', response.data)
+        self.assertIsNotNone(cache.get(simulation_cache_key(200, 1)))
+
+
+class EligibilityGridTest(APITestCase):
+    def setUp(self):
+        from datetime import date, timedelta
+        
+        self.customer = Customer.objects.create(
+            first_name="Grid",
+            last_name="Pricing",
+            age=33,
+            phone_number=9876520000,
+            monthly_salary=Decimal('200000')
+        )
+        # Several loans this year push the score into the corrected-rate bands
+        for _ in range(4):
+            Loan.objects.create(
+                customer=self.customer,
+                loan_amount=Decimal('100000'),
+                tenure=12,
+                interest_rate=Decimal('10.0'),
+                emis_paid_on_time=0,
+                start_date=date.today(),
+                end_date=date.today() + timedelta(days=360)
+            )
+    
+    def test_grid_matches_check_eligibility(self):
+        """Every grid cell agrees with a single check_eligibility call"""
+        amounts = [Decimal('10000'), Decimal('150000'), Decimal('1500000')]
+        tenures = [6, 12, 36]
+        rates = [Decimal('0'), Decimal('8.5'), Decimal('14.0'), Decimal('18.0')]
+        
+        grid = LoanEligibilityService.evaluate_grid(
+            self.customer.customer_id, amounts, tenures, rates
+        )
+        self.assertEqual(len(grid['cells']), 36)
+        self.assertTrue(any(
+            cell['approval'] and cell['corrected_interest_rate'] != cell['interest_rate']
+            for cell in grid['cells']
+        ))
+        self.assertTrue(any(not cell['approval'] for cell in grid['cells']))
+        
+        for cell in grid['cells']:
+            expected = LoanEligibilityService.check_eligibility(
+                self.customer.customer_id, cell['loan_amount'], cell['interest_rate'], cell['tenure']
+            )
+            self.assertEqual(cell['approval'], expected['approval'])
+            self.assertEqual(cell['corrected_interest_rate'], expected['corrected_interest_rate'])
+            self.assertEqual(cell['monthly_installment'], expected['monthly_installment'])
+    
+    def test_grid_endpoint(self):
+        """Grid endpoint returns one cell per combination"""
+        data = {
+            'customer_id': self.customer.customer_id,
+            'loan_amounts': [20000, 40000],
+            'tenures': [12, 24],
+            'interest_rates': [10.0, 16.0]
+        }
+        response = self.client.post('/check-eligibility/grid/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['cells']), 8)
+        
+        data['customer_id'] = 999999
+        response = self.client.post('/check-eligibility/grid/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MaxLoanAmountTest(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Max",
+            last_name="Amount",
+            age=38,
+            phone_number=9876530000,
+            monthly_salary=Decimal('45000')
+        )
+    
+    def test_max_amount_is_check_eligibility_boundary(self):
+        """The solved amount is approved and one cent more is not"""
+        for rate, tenure in [(Decimal('10.5'), 36), (Decimal('0'), 24), (Decimal('18.0'), 360)]:
+            result = LoanEligibilityService.max_loan_amount(self.customer.customer_id, rate, tenure)
+            amount = result['max_loan_amount']
+            self.assertGreater(amount, 0)
+            
+            at_boundary = LoanEligibilityService.check_eligibility(
+                self.customer.customer_id, amount, rate, tenure
+            )
+            self.assertTrue(at_boundary['approval'])
+            
+            if amount < self.customer.approved_limit:
+                beyond = LoanEligibilityService.check_eligibility(
+                    self.customer.customer_id, amount + Decimal('0.01'), rate, tenure
+                )
+                self.assertFalse(beyond['approval'])
+    
+    def test_max_amount_capped_by_approved_limit(self):
+        """Long, cheap loans are capped by the approved limit"""
+        result = LoanEligibilityService.max_loan_amount(
+            self.customer.customer_id, Decimal('1.0'), 600
+        )
+        self.assertEqual(result['max_loan_amount'], self.customer.approved_limit)
+    
+    def test_max_amount_endpoint(self):
+        """Endpoint returns the maximum amount and installment"""
+        data = {'customer_id': self.customer.customer_id, 'interest_rate': 12.0, 'tenure': 24}
+        response = self.client.post('/check-eligibility/max-amount/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['approval'])
+        self.assertIn('max_loan_amount', response.data)
+
+
+class RequestCoalescingTest(TestCase):
+    def test_concurrent_identical_calls_share_one_computation(self):
+        """Callers arriving while a key is in flight get the leader's result"""
+        import threading
+        from .coalescing import SingleFlight
+        
+        flight = SingleFlight('test')
+        started = threading.Event()
+        release = threading.Event()
+        computations = []
+        
+        def compute():
+            computations.append(1)
+            started.set()
+            release.wait(5)
+            return {'approval': True}
+        
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+        leader.start()
+        started.wait(5)
+        
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+            for _ in range(3)
+        ]
+        for follower in followers:
+            follower.start()
+        while flight.stats()['coalesced'] < 3:
+            pass
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        
+        self.assertEqual(len(computations), 1)
+        self.assertEqual(results, [{'approval': True}] * 4)
+        self.assertEqual(flight.stats(), {'calls': 4, 'coalesced': 3, 'in_flight': 0})
+    
+    def test_errors_are_shared_and_not_cached(self):
+        """A failing computation raises for its callers and is retried afterwards"""
+        from .coalescing import SingleFlight
+        
+        flight = SingleFlight('test-errors')
+        
+        def fail():
+            raise Customer.DoesNotExist()
+        
+        with self.assertRaises(Customer.DoesNotExist):
+            flight.do('key', fail)
+        self.assertEqual(flight.do('key', lambda: 42), 42)
+    
+    def test_cache_single_flight_coalesces_across_instances(self):
+        """A second process-level coalescer waits for the leader's published result"""
+        import threading
+        import time
+        from .coalescing import CacheSingleFlight
+        
+        first, second = CacheSingleFlight('test-cache'), CacheSingleFlight('test-cache')
+        started = threading.Event()
+        release = threading.Event()
+        
+        def compute():
+            started.set()
+            release.wait(5)
+            return 'leader'
+        
+        results = []
+        leader = threading.Thread(target=lambda: results.append(first.do(('customer', 1), compute)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(
+            target=lambda: results.append(second.do(('customer', 1), lambda: 'follower'))
+        )
+        follower.start()
+        while second.stats()['calls'] < 1:
+            pass
+        time.sleep(0.05)  # let the follower reach its polling loop
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        
+        self.assertEqual(results, ['leader', 'leader'])
+        self.assertEqual(second.stats()['coalesced_remote'], 1)
+        # The lock is released, so a later call computes again
+        self.assertEqual(second.do(('customer', 1), lambda: 'fresh'), 'fresh')
+
+
+class ResumableIngestionTest(TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        import pandas as pd
+        
+        handle, self.file_path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        self.addCleanup(os.remove, self.file_path)
+        
+        pd.DataFrame([
+            {
+                'Customer ID': i + 1,
+                'First Name': f'Ingest{i}',
+                'Last Name': 'Row',
+                'Age': 30,
+                'Phone Number': 9876540000 + i,
+                'Monthly Salary': 40000,
+                'Approved Limit': 0,
+            }
+            for i in range(5)
+        ]).to_excel(self.file_path, index=False)
+    
+    def test_failed_ingestion_resumes_after_last_committed_chunk(self):
+        """A retry skips committed chunks and creates no duplicates"""
+        from unittest import mock
+        from . import tasks
+        from .models import IngestionCheckpoint
+        
+        real_chunk = tasks._ingest_customer_chunk
+        calls = []
+        
+        def failing_chunk(chunk):
+            calls.append(len(chunk))
+            if len(calls) == 2:
+                raise RuntimeError('worker lost')
+            return real_chunk(chunk)
+        
+        with mock.patch.object(tasks, '_ingest_customer_chunk', failing_chunk):
+            with self.assertRaisesMessage(RuntimeError, 'worker lost'):
+                tasks.ingest_customer_data(self.file_path, chunk_size=2)
+        self.assertEqual(Customer.objects.count(), 2)
+        
+        checkpoint = IngestionCheckpoint.objects.get()
+        self.assertEqual(checkpoint.rows_committed, 2)
+        self.assertIsNone(checkpoint.completed_at)
+        
+        result = tasks.ingest_customer_data(self.file_path, chunk_size=2)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['resumed_from_row'], 2)
+        self.assertEqual(result['customers_created'], 3)
+        self.assertEqual(Customer.objects.count(), 5)
+        self.assertEqual(
+            Customer.objects.get(phone_number=9876540000).approved_limit,
+            Customer.calculate_approved_limit(Decimal('40000'))
+        )
+        
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.rows_committed, 5)
+        self.assertIsNotNone(checkpoint.completed_at)
+    
+    def test_completed_file_is_ingested_again(self):
+        """Running a finished file again re-applies every row instead of resuming at the end"""
+        from . import tasks
+        from .models import IngestionCheckpoint
+        
+        result = tasks.ingest_customer_data(self.file_path, chunk_size=2)
+        self.assertEqual(result['customers_created'], 5)
+        Customer.objects.filter(phone_number=9876540000).delete()
+        Customer.objects.filter(phone_number=9876540001).update(first_name='Edited')
+        
+        result = tasks.ingest_customer_data(self.file_path, chunk_size=2)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['resumed_from_row'], 0)
+        self.assertEqual(result['customers_created'], 1)
+        self.assertEqual(result['customers_updated'], 4)
+        self.assertEqual(Customer.objects.count(), 5)
+        self.assertEqual(Customer.objects.get(phone_number=9876540001).first_name, 'Ingest1')
+        
+        checkpoint = IngestionCheckpoint.objects.get()
+        self.assertEqual(checkpoint.rows_committed, 5)
+        self.assertIsNotNone(checkpoint.completed_at)
+    
+    def test_approved_limit_change_drops_persisted_score(self):
+        """Re-ingesting or saving a customer with a new approved_limit invalidates the persisted score"""
+        from datetime import date
+        from . import tasks
+        from .models import CreditScore
+        
+        customer = Customer.objects.create(
+            first_name='Ingest0', last_name='Row', age=30, phone_number=9876540000,
+            monthly_salary=Decimal('10000')
+        )
+        kept = Customer.objects.create(
+            first_name='Kept', last_name='Row', age=30, phone_number=9876549999,
+            monthly_salary=Decimal('10000')
+        )
+        for scored in (customer, kept):
+            CreditScore.objects.create(customer=scored, credit_score=90, score_year=date.today().year)
+        
+        tasks.ingest_customer_data(self.file_path, chunk_size=2)
+        customer.refresh_from_db()
+        self.assertEqual(customer.approved_limit, Customer.calculate_approved_limit(Decimal('40000')))
+        self.assertFalse(CreditScore.objects.filter(customer=customer).exists())
+        
+        kept = Customer.objects.get(pk=kept.pk)
+        kept.age = 31
+        kept.save()
+        self.assertTrue(CreditScore.objects.filter(customer=kept).exists())
+        kept.approved_limit = Decimal('500000')
+        kept.save()
+        self.assertFalse(CreditScore.objects.filter(customer=kept).exists())
+
+
+class StreamingExportTest(APITestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        
+        self.user = User.objects.create_user('exporter', password='secret')
+        self.customer = Customer.objects.create(
+            first_name="Export",
+            last_name="Me",
+            age=45,
+            phone_number=9876550000,
+            monthly_salary=Decimal('90000')
+        )
+        for year in (2021, 2023):
+            Loan.objects.create(
+                customer=self.customer,
+                loan_amount=Decimal('120000'),
+                tenure=12,
+                interest_rate=Decimal('11.0'),
+                start_date=f'{year}-01-01',
+                end_date=f'{year}-12-31'
+            )
+    
+    def test_export_requires_authentication(self):
+        """Anonymous clients cannot export the book"""
+        response = self.client.get('/export/loans.csv')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+    
+    def test_loans_csv_export_with_date_filter(self):
+        """CSV export streams a header plus the loans inside the date range"""
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/export/loans.csv', {'start_date': '2022-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'loan_id')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('2023-01-01', lines[1])
+    
+    def test_customers_ndjson_export(self):
+        """NDJSON export has one JSON object per customer"""
+        import json
+        
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/export/customers.ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['customer_id'], self.customer.customer_id)
+        self.assertEqual(records[0]['monthly_salary'], '90000.00')
+
+
+class AdminScalabilityTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.customers = [
+            Customer.objects.create(
+                first_name=f"Admin{i}",
+                last_name=f"Listing{i}",
+                age=30,
+                phone_number=9876560000 + i,
+                monthly_salary=Decimal('50000')
+            )
+            for i in range(3)
+        ]
+    
+    def _create_loans(self, count):
+        for i in range(count):
+            Loan.objects.create(
+                customer=self.customers[i % 3],
+                loan_amount=Decimal('10000'),
+                tenure=12,
+                interest_rate=Decimal('10.0'),
+                start_date='2023-01-01',
+                end_date='2023-12-31'
+            )
+    
+    def test_loan_changelist_queries_do_not_grow_with_rows(self):
+        """Customers are joined into the changelist query instead of fetched per row"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        self.client.force_login(self.admin_user)
+        self._create_loans(2)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get('/admin/loans/loan/').status_code, 200)
+        
+        self._create_loans(6)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.client.get('/admin/loans/loan/').status_code, 200)
+        
+        self.assertEqual(len(few), len(many))
+    
+    def test_search_uses_exact_phone_and_id_lookups(self):
+        """Numeric terms match phone numbers and ids exactly, text matches name prefixes"""
+        from django.contrib.admin.sites import site
+        
+        customer_admin = site._registry[Customer]
+        queryset, _ = customer_admin.get_search_results(None, Customer.objects.all(), '9876560001')
+        self.assertEqual(list(queryset), [self.customers[1]])
+        
+        queryset, _ = customer_admin.get_search_results(None, Customer.objects.all(), 'Listing2')
+        self.assertEqual(list(queryset), [self.customers[2]])
+        
+        queryset, _ = customer_admin.get_search_results(None, Customer.objects.all(), '98765600')
+        self.assertEqual(list(queryset), [])
+        
+        queryset, _ = customer_admin.get_search_results(None, Customer.objects.all(), '9' * 30)
+        self.assertEqual(list(queryset), [])
+        
+        queryset, _ = customer_admin.get_search_results(None, Customer.objects.all(), '²')
+        self.assertEqual(list(queryset), [])
+    
+    def test_paginator_uses_estimate_for_large_unfiltered_tables(self):
+        """Unfiltered changelists above the threshold skip COUNT(*)"""
+        from .admin import EstimatedCountPaginator, estimated_row_count
+        
+        estimate = estimated_row_count(Customer)
+        self.assertGreaterEqual(estimate, 3)
+        
+        paginator = EstimatedCountPaginator(Customer.objects.order_by('pk'), 100)
+        paginator.exact_count_threshold = 0
+        self.assertEqual(paginator.count, estimate)
+        
+        filtered = EstimatedCountPaginator(Customer.objects.filter(age=30).order_by('pk'), 100)
+        filtered.exact_count_threshold = 0
+        self.assertEqual(filtered.count, 3)
+
+
+class PaymentPostingTest(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Pay",
+            last_name="Posting",
+            age=31,
+            phone_number=9876570000,
+            monthly_salary=Decimal('50000')
+        )
+        self.loans = [
+            Loan.objects.create(
+                customer=self.customer,
+                loan_amount=Decimal('60000'),
+                tenure=3,
+                interest_rate=Decimal('10.0'),
+                start_date='2023-01-01',
+                end_date='2023-03-31'
+            )
+            for _ in range(2)
+        ]
+    
+    def _payment(self, reference, loan, **extra):
+        payment = {
+            'payment_reference': reference,
+            'loan_id': loan.loan_id,
+            'amount': '20000.00',
+            'paid_on': '2023-02-01',
+        }
+        payment.update(extra)
+        return payment
+    
+    def test_batch_posting_is_idempotent_and_capped_at_tenure(self):
+        """Repeated references are skipped and on-time EMIs never exceed the tenure"""
+        batch = [
+            self._payment('PAY-1', self.loans[0]),
+            self._payment('PAY-2', self.loans[0], emis=5),
+            self._payment('PAY-2', self.loans[0], emis=5),
+            self._payment('PAY-3', self.loans[1], on_time=False),
+            self._payment('PAY-4', self.loans[1]),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/payments/', batch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['posted'], 4)
+        self.assertEqual(response.data['duplicates'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/payments/', batch[:2], format='json')
+        self.assertEqual(response.data['posted'], 0)
+        self.assertEqual(response.data['duplicates'], 2)
+        
+        for loan in self.loans:
+            loan.refresh_from_db()
+        self.assertEqual(self.loans[0].emis_paid_on_time, 3)
+        self.assertEqual(self.loans[1].emis_paid_on_time, 1)
+    
+    def test_single_payment_and_unknown_loan(self):
+        """A single event is accepted and events for unknown loans are reported"""
+        from .models import Payment
+        
+        response = self.client.post('/payments/', self._payment('PAY-10', self.loans[0]), format='json')
+        self.assertEqual(response.data['posted'], 1)
+        
+        unknown = self._payment('PAY-11', self.loans[0])
+        unknown['loan_id'] = 999999
+        response = self.client.post('/payments/', [unknown], format='json')
+        self.assertEqual(response.data['unknown_loans'], ['PAY-11'])
+        self.assertEqual(Payment.objects.count(), 1)
+    
+    def test_failed_ledger_commit_leaves_loans_untouched(self):
+        """Loans are only updated after the ledger commits, so retrying a failed batch applies it once"""
+        from unittest import mock
+        from django.db import DatabaseError
+        from .models import Payment
+        
+        batch = [self._payment('PAY-20', self.loans[0]), self._payment('PAY-21', self.loans[1])]
+        real_bulk_create = Payment.objects.bulk_create
+        
+        def failing_commit(*args, **kwargs):
+            real_bulk_create(*args, **kwargs)
+            raise DatabaseError('commit failed')
+        
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with mock.patch.object(Payment.objects, 'bulk_create', failing_commit):
+                with self.assertRaises(DatabaseError):
+                    self.client.post('/payments/', batch, format='json')
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Payment.objects.exists())
+        for loan in self.loans:
+            loan.refresh_from_db()
+            self.assertEqual(loan.emis_paid_on_time, 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/payments/', batch, format='json')
+        self.assertEqual(response.data['posted'], 2)
+        for loan in self.loans:
+            loan.refresh_from_db()
+            self.assertEqual(loan.emis_paid_on_time, 1)
+    
+    def test_unapplied_payments_are_applied_once(self):
+        """Payments left unapplied after the ledger commit are applied by a retry or the scheduled task, once"""
+        from unittest import mock
+        from .models import Payment
+        from .services import PaymentService
+        from .tasks import apply_pending_payments
+        
+        batch = [self._payment('PAY-30', self.loans[0]), self._payment('PAY-31', self.loans[1])]
+        with mock.patch.object(PaymentService, '_apply_increments', side_effect=RuntimeError('shard down')):
+            with self.assertRaises(RuntimeError):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post('/payments/', batch, format='json')
+        self.assertEqual(Payment.objects.filter(applied=False).count(), 2)
+        self.loans[0].refresh_from_db()
+        self.assertEqual(self.loans[0].emis_paid_on_time, 0)
+        
+        # The client's retry sees duplicates but still applies them
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/payments/', batch[:1], format='json')
+        self.assertEqual(response.data['duplicates'], 1)
+        self.assertEqual(apply_pending_payments(), 1)
+        self.assertFalse(Payment.objects.filter(applied=False).exists())
+        
+        # Losing the ledger's applied flag does not apply the payments again
+        Payment.objects.update(applied=False)
+        self.assertEqual(apply_pending_payments(), 0)
+        for loan in self.loans:
+            loan.refresh_from_db()
+            self.assertEqual(loan.emis_paid_on_time, 1)
+
+
+class CurrentDebtTest(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Debt",
+            last_name="Tracked",
+            age=40,
+            phone_number=9876580000,
+            monthly_salary=Decimal('100000')
+        )
+    
+    def test_closed_form_matches_amortization_schedule(self):
+        """The outstanding principal equals the balance of the EMI schedule after k payments"""
+        from .vectorized import annuity_payment, outstanding_principal
+        
+        for principal, rate, tenure in ((250000, 14.0, 24), (90000, 0.0, 9)):
+            emi = float(annuity_payment(principal, rate, tenure))
+            balance = principal
+            for paid in range(tenure + 1):
+                self.assertAlmostEqual(float(outstanding_principal(principal, rate, tenure, paid)), balance, places=6)
+                balance = balance * (1 + rate / 1200) - emi
+        self.assertEqual(float(outstanding_principal(250000, 14.0, 24, 30)), 0.0)
+    
+    def test_booking_and_payments_maintain_current_debt(self):
+        """create_loan adds the principal, on-time EMIs reduce it and the batch job agrees"""
+        from .services import DebtService
+        from .tasks import refresh_current_debt
+        
+        response = self.client.post('/create-loan/', {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': 250000,
+            'interest_rate': 14,
+            'tenure': 24
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        loan = Loan.objects.get(loan_id=response.data['loan_id'])
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, Decimal('250000.00'))
+        
+        payment = {'loan_id': loan.loan_id, 'amount': '12003.00', 'paid_on': '2024-01-01'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/payments/', [
+                dict(payment, payment_reference='DEBT-1', emis=3),
+                dict(payment, payment_reference='DEBT-2', on_time=False),
+            ], format='json')
+        loan.refresh_from_db()
+        self.customer.refresh_from_db()
+        self.assertEqual(loan.emis_paid_on_time, 3)
+        self.assertEqual(self.customer.current_debt, DebtService.outstanding_principal(loan))
+        self.assertLess(self.customer.current_debt, Decimal('250000'))
+        
+        # Loans written around the services are picked up by the scheduled job
+        Loan.objects.create(
+            customer=self.customer, loan_amount=Decimal('90000'), tenure=9, interest_rate=Decimal('0'),
+            emis_paid_on_time=3, start_date='2024-01-01', end_date='2024-09-30'
+        )
+        other = Customer.objects.create(
+            first_name="Debt", last_name="Free", age=30, phone_number=9876580001,
+            monthly_salary=Decimal('50000'), current_debt=Decimal('1234')
+        )
+        self.assertEqual(refresh_current_debt(chunk_size=1), 2)
+        self.customer.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, DebtService.outstanding_principal(loan) + Decimal('60000.00'))
+        self.assertEqual(other.current_debt, Decimal('0'))
+
+
+class BatchRegistrationTest(APITestCase):
+    def _registration(self, phone, income):
+        return {
+            'first_name': 'Batch',
+            'last_name': f'Customer{phone}',
+            'age': 30,
+            'monthly_income': income,
+            'phone_number': phone
+        }
+    
+    def test_batch_matches_single_registration(self):
+        """Batch-registered customers get the approved_limit of single registration, in input order"""
+        incomes = [50000, 41666.67, 125000, 1388, 97222.22]
+        batch = [self._registration(9100000000 + i, income) for i, income in enumerate(incomes)]
+        
+        response = self.client.post('/register/batch/', batch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], len(incomes))
+        
+        for item, result in zip(batch, response.data['results']):
+            customer = Customer(monthly_salary=Decimal(str(item['monthly_income'])))
+            self.assertEqual(
+                Decimal(result['approved_limit']),
+                Customer.calculate_approved_limit(customer.monthly_salary)
+            )
+            self.assertEqual(
+                Customer.objects.get(pk=result['customer_id']).phone_number, item['phone_number']
+            )
+    
+    def test_per_item_errors_keep_input_order(self):
+        """Invalid items are reported by index and do not block valid ones"""
+        batch = [
+            self._registration(9200000001, 50000),
+            {'first_name': 'Missing'},
+            self._registration(9200000002, 60000),
+        ]
+        response = self.client.post('/register/batch/', batch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2])
+        self.assertIn('phone_number', results[1]['errors'])
+        self.assertLess(results[0]['customer_id'], results[2]['customer_id'])
+        self.assertEqual(Customer.objects.count(), 2)
+    
+    def test_rejects_non_list_payload(self):
+        response = self.client.post('/register/batch/', {'first_name': 'Solo'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PhoneFilterTest(APITestCase):
+    def setUp(self):
+        from .bloom import reset_phone_filter
+        
+        reset_phone_filter()
+        self.addCleanup(reset_phone_filter)
+        self.customer = Customer.objects.create(
+            first_name="Phone",
+            last_name="Taken",
+            age=33,
+            phone_number=9300000001,
+            monthly_salary=Decimal('50000')
+        )
+    
+    def _registration(self, phone):
+        return {
+            'first_name': 'Phone',
+            'last_name': f'Customer{phone}',
+            'age': 30,
+            'monthly_income': 50000,
+            'phone_number': phone
+        }
+    
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Every added key is found, few others are, and the bits round-trip through bytes"""
+        import numpy as np
+        from .bloom import BloomFilter
+        
+        bloom = BloomFilter.for_capacity(10000, 0.01)
+        added = np.arange(9000000000, 9000010000)
+        bloom.add_many(added)
+        self.assertTrue(bloom.contains_many(added).all())
+        self.assertLess(bloom.contains_many(added + 10000).mean(), 0.02)
+        
+        copy = BloomFilter(bloom.bit_count, bloom.hash_count, bloom.to_bytes())
+        self.assertTrue(copy.contains_many(added).all())
+        self.assertIn(9000000000, copy)
+    
+    def test_registration_rejects_existing_numbers(self):
+        """Single and batch registration reject taken numbers and repeats within a batch"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .services import CustomerService
+        
+        response = self.client.post('/register/', self._registration(9300000001), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('phone_number', response.data)
+        
+        # A definitely new number is answered from memory
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(CustomerService.registered_phone_numbers([9300000002]), set())
+        self.assertEqual(len(queries), 0)
+        
+        batch = [self._registration(phone) for phone in (9300000002, 9300000001, 9300000002, 9300000003)]
+        response = self.client.post('/register/batch/', batch, format='json')
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [sorted(result.get('errors', {})) for result in response.data['results']],
+            [[], ['phone_number'], ['phone_number'], []]
+        )
+        response = self.client.post('/register/', self._registration(9300000003), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Customer.objects.filter(phone_number=9300000003).count(), 1)
+    
+    def test_snapshot_is_synced_with_new_customers(self):
+        """Processes load the persisted snapshot and add customers created after it"""
+        from .bloom import phone_filter, rebuild_snapshot
+        from .models import PhoneFilterSnapshot
+        
+        rebuild_snapshot()
+        self.assertEqual(PhoneFilterSnapshot.objects.count(), 1)
+        # Written by another process: bulk inserts do not touch this process's filter
+        Customer.objects.bulk_create([Customer(
+            first_name="Phone", last_name="Elsewhere", age=40, phone_number=9300000009,
+            monthly_salary=Decimal('50000'), approved_limit=Decimal('1800000')
+        )])
+        
+        bloom = phone_filter()
+        self.assertIn(9300000001, bloom)
+        self.assertIn(9300000009, bloom)
+        response = self.client.post('/register/', self._registration(9300000009), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        rebuild_snapshot()
+        self.assertEqual(PhoneFilterSnapshot.objects.count(), 1)
+
+
+class RequestProfilingTest(APITestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.conf import settings
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+        
+        profiles_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiles_dir, ignore_errors=True)
+        profiling = override_settings(
+            REQUEST_PROFILING=dict(settings.REQUEST_PROFILING, PROFILES_DIR=profiles_dir)
+        )
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+        
+        self.admin_user = User.objects.create_superuser('profiler', 'profiler@example.com', 'secret')
+        self.customer = Customer.objects.create(
+            first_name="Profiled",
+            last_name="Customer",
+            age=30,
+            phone_number=9876512345,
+            monthly_salary=Decimal('50000')
+        )
+        self.eligibility_request = {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': 100000,
+            'interest_rate': 10,
+            'tenure': 12
+        }
+    
+    def test_signed_header_stores_profile_with_sql(self):
+        """A signed header profiles the request and the profile can be listed and downloaded"""
+        from .profiling import profiling_token
+        
+        response = self.client.post(
+            '/check-eligibility/', self.eligibility_request, format='json',
+            HTTP_X_PROFILE=profiling_token()
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+        
+        self.client.force_authenticate(self.admin_user)
+        listing = self.client.get('/profiles/')
+        self.assertEqual([profile['id'] for profile in listing.data], [profile_id])
+        self.assertEqual(listing.data[0]['view'], 'check_eligibility')
+        self.assertGreater(listing.data[0]['sql_count'], 0)
+        
+        detail = self.client.get(f'/profiles/{profile_id}.json')
+        summary = json.loads(b''.join(detail.streaming_content))
+        self.assertTrue(summary['functions'])
+        self.assertIn('duration_ms', summary['queries'][0])
+        
+        raw = self.client.get(f'/profiles/{profile_id}.prof')
+        self.assertEqual(raw.status_code, status.HTTP_200_OK)
+    
+    def test_unsigned_requests_are_not_profiled(self):
+        for headers in ({}, {'HTTP_X_PROFILE': 'profile:forged'}):
+            response = self.client.post(
+                '/check-eligibility/', self.eligibility_request, format='json', **headers
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('X-Profile-Id', response)
+        
+        self.assertEqual(self.client.get('/profiles/').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.admin_user)
+        self.assertEqual(self.client.get('/profiles/').data, [])
+    
+    def test_max_profiles_zero_keeps_every_profile(self):
+        from django.conf import settings
+        from django.test import override_settings
+        from .profiling import profiling_token
+        
+        with override_settings(REQUEST_PROFILING=dict(settings.REQUEST_PROFILING, MAX_PROFILES=0)):
+            for _ in range(2):
+                response = self.client.post(
+                    '/check-eligibility/', self.eligibility_request, format='json',
+                    HTTP_X_PROFILE=profiling_token()
+                )
+                self.assertIn('X-Profile-Id', response)
+        
+        self.client.force_authenticate(self.admin_user)
+        self.assertEqual(len(self.client.get('/profiles/').data), 2)
+
+
+class SlowQueryLogTest(APITestCase):
+    def setUp(self):
+        import os
+        import shutil
+        import tempfile
+        from django.conf import settings
+        from django.test import override_settings
+        from .querylog import reset_slow_query_stats
+        
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir, ignore_errors=True)
+        self.log_file = os.path.join(log_dir, 'slow_queries.log')
+        slow_query_log = override_settings(
+            SLOW_QUERY_LOG=dict(settings.SLOW_QUERY_LOG, THRESHOLD_MS=0, LOG_FILE=self.log_file)
+        )
+        slow_query_log.enable()
+        self.addCleanup(slow_query_log.disable)
+        reset_slow_query_stats()
+        self.addCleanup(reset_slow_query_stats)
+        
+        self.customer = Customer.objects.create(
+            first_name="Slow",
+            last_name="Query",
+            age=30,
+            phone_number=9876598765,
+            monthly_salary=Decimal('50000')
+        )
+    
+    def _entries(self):
+        with open(self.log_file, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+    
+    def test_entries_carry_origin_function_and_first_explain(self):
+        """Every slow query is logged with its view and service function; EXPLAIN only once per shape"""
+        for _ in range(2):
+            response = self.client.post('/check-eligibility/', {
+                'customer_id': self.customer.customer_id,
+                'loan_amount': 100000,
+                'interest_rate': 10,
+                'tenure': 12
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        entries = [entry for entry in self._entries() if entry['origin'] == 'view:check_eligibility']
+        scoring = [
+            entry for entry in entries
+            if entry['function'] == 'services.CreditScoreService.calculate_credit_score_breakdown'
+        ]
+        self.assertTrue(scoring)
+        for entry in self._entries():
+            self.assertEqual('explain' in entry, entry['count'] == 1 and entry['sql'].startswith('SELECT'))
+        
+        shapes = {entry['shape'] for entry in scoring}
+        for shape in shapes:
+            counts = [entry['count'] for entry in entries if entry['shape'] == shape]
+            self.assertEqual(counts, list(range(counts[0], counts[0] + len(counts))))
+    
+    def test_sql_normalization_and_aggregation(self):
+        from .querylog import normalize_sql, slow_query_stats
+        
+        self.assertEqual(
+            normalize_sql("SELECT * FROM loans WHERE id IN (%s, %s, %s) AND name = 'x'"),
+            normalize_sql('SELECT * FROM loans WHERE id IN (%s) AND name = %s')
+        )
+        
+        list(Customer.objects.filter(customer_id__in=[1, 2, 3]))
+        list(Customer.objects.filter(customer_id__in=[4, 5]))
+        shapes = [stats for stats in slow_query_stats() if 'IN (...)' in stats['sql']]
+        self.assertEqual(len(shapes), 1)
+        self.assertEqual(shapes[0]['count'], 2)
+
+
+class StartupImportTest(TestCase):
+    def test_web_and_worker_startup_skip_ingestion_modules(self):
+        """Fresh web and worker processes must not import pandas or Excel engines"""
+        from .management.commands.startup_benchmark import run_probe
+        
+        web = run_probe('web')
+        self.assertEqual(web['status'], '200 OK')
+        self.assertEqual(web['heavy_modules'], [])
+        self.assertEqual(run_probe('worker')['heavy_modules'], [])
+
+
+class CustomerSearchTest(APITestCase):
+    def setUp(self):
+        from datetime import date, timedelta
+        
+        today = date.today()
+        self.customers = []
+        for i in range(6):
+            customer = Customer.objects.create(
+                first_name=f"Search{i}",
+                last_name="Rank",
+                age=30,
+                phone_number=9876400000 + i,
+                monthly_salary=Decimal('40000') + i * Decimal('10000')
+            )
+            self.customers.append(customer)
+            for j in range(i):
+                Loan.objects.create(
+                    customer=customer,
+                    loan_amount=Decimal('50000') * (j + 1),
+                    tenure=12,
+                    interest_rate=Decimal('12.0'),
+                    emis_paid_on_time=12 if j % 2 == 0 else 5,
+                    start_date=today - timedelta(days=30 * j),
+                    end_date=today + timedelta(days=365 - 30 * j)
+                )
+    
+    def test_sql_annotations_match_service(self):
+        """with_credit_score matches the Python breakdown and EMI headroom for every customer"""
+        for customer in Customer.objects.with_credit_score():
+            breakdown = CreditScoreService.calculate_credit_score_breakdown(customer.customer_id)
+            for component in ('credit_score', 'loan_count_score', 'current_year_score', 'volume_score'):
+                self.assertEqual(getattr(customer, component), breakdown[component])
+            if breakdown['on_time_score'] is None:
+                self.assertIsNone(customer.on_time_score)
+            else:
+                self.assertAlmostEqual(customer.on_time_score, breakdown['on_time_score'])
+            # SQLite computes decimals as REAL, so compare to the cent
+            self.assertAlmostEqual(
+                customer.emi_headroom,
+                customer.monthly_salary * Decimal('0.5') - LoanEligibilityService.get_current_emis(customer),
+                delta=Decimal('0.01')
+            )
+    
+    def test_filters_and_keyset_pagination(self):
+        """Pages cover every matching customer once, in order"""
+        seen = []
+        cursor = None
+        while True:
+            params = {'ordering': '-credit_score', 'page_size': 2, 'min_credit_score': 1}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/customers/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend((row['credit_score'], row['customer_id']) for row in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        
+        expected = sorted(
+            ((customer.credit_score, customer.customer_id)
+             for customer in Customer.objects.with_credit_score() if customer.credit_score >= 1),
+            reverse=True
+        )
+        self.assertEqual(seen, expected)
+        
+        response = self.client.get('/customers/', {'min_emi_headroom': 1000000})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/customers/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LoanArchivalTest(APITestCase):
+    def setUp(self):
+        from datetime import date, timedelta
+        
+        today = date.today()
+        self.customer = Customer.objects.create(
+            first_name="Archive",
+            last_name="History",
+            age=40,
+            phone_number=9876300000,
+            monthly_salary=Decimal('80000')
+        )
+        self.closed = [
+            Loan.objects.create(
+                customer=self.customer,
+                loan_amount=Decimal('100000') * (i + 1),
+                tenure=12,
+                interest_rate=Decimal('10.0'),
+                emis_paid_on_time=12,
+                start_date=date(today.year - 3 + i, 1, 15),
+                end_date=date(today.year - 2 + i, 1, 14)
+            )
+            for i in range(2)
+        ]
+        # Ended before this year but not paid in full: stays in the hot table
+        self.defaulted = Loan.objects.create(
+            customer=self.customer,
+            loan_amount=Decimal('50000'),
+            tenure=12,
+            interest_rate=Decimal('12.0'),
+            emis_paid_on_time=7,
+            start_date=date(today.year - 3, 6, 1),
+            end_date=date(today.year - 2, 5, 31)
+        )
+        self.active = Loan.objects.create(
+            customer=self.customer,
+            loan_amount=Decimal('200000'),
+            tenure=24,
+            interest_rate=Decimal('11.0'),
+            emis_paid_on_time=2,
+            start_date=today - timedelta(days=60),
+            end_date=today + timedelta(days=660)
+        )
+    
+    def test_archival_keeps_scores_and_shrinks_hot_table(self):
+        """Closed loans move to loans_archive and every scoring path returns the same result"""
+        from .models import ArchivedLoan
+        from .services import LoanArchiveService
+        
+        customer_id = self.customer.customer_id
+        breakdown = CreditScoreService.calculate_credit_score_breakdown(customer_id)
+        sql_score = Customer.objects.with_credit_score().get(pk=customer_id).credit_score
+        
+        result = LoanArchiveService.archive_closed_loans(batch_size=1)
+        self.assertEqual(result, {'archived': 2, 'customers': 1})
+        self.assertEqual(
+            set(Loan.objects.values_list('loan_id', flat=True)),
+            {self.defaulted.loan_id, self.active.loan_id}
+        )
+        self.assertEqual(ArchivedLoan.objects.count(), 2)
+        
+        self.assertEqual(CreditScoreService.calculate_credit_score_breakdown(customer_id), breakdown)
+        [range_breakdown] = CreditScoreService.score_customers([customer_id])
+        self.assertEqual(range_breakdown['credit_score'], breakdown['credit_score'])
+        self.assertEqual(range_breakdown['total_loans'], 4)
+        self.assertEqual(
+            Customer.objects.with_credit_score().get(pk=customer_id).credit_score, sql_score
+        )
+        
+        self.assertEqual(LoanArchiveService.archive_closed_loans(), {'archived': 0, 'customers': 0})
+    
+    def test_full_history_includes_archived_loans(self):
+        from .exports import export_rows
+        from .services import LoanArchiveService
+        
+        LoanArchiveService.archive_closed_loans()
+        
+        fields, rows = export_rows('loans')
+        self.assertEqual(
+            [row[0] for row in rows],
+            sorted(loan.loan_id for loan in self.closed + [self.defaulted, self.active])
+        )
+        
+        response = self.client.get(f'/view-loan/{self.closed[0].loan_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Decimal(str(response.data['loan_amount'])), self.closed[0].loan_amount)
+
+
+class AsyncOriginationTest(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .tasks import ORIGINATION_SCHEDULED_KEY
+        
+        cache.delete(ORIGINATION_SCHEDULED_KEY)
+        self.customer = Customer.objects.create(
+            first_name="Async",
+            last_name="Applicant",
+            age=35,
+            phone_number=9876580000,
+            monthly_salary=Decimal('50000')
+        )
+    
+    def _apply(self, **overrides):
+        from unittest import mock
+        
+        payload = {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': 200000,
+            'interest_rate': 10,
+            'tenure': 12,
+        }
+        payload.update(overrides)
+        with mock.patch('loans.tasks.originate_loans.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/create-loan/async/', payload, format='json')
+        return response, apply_async
+    
+    def test_application_is_accepted_then_decided(self):
+        """202 with a pending application, decided by the worker like create_loan"""
+        from .tasks import originate_loans
+        
+        response, apply_async = self._apply()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertIsNone(response.data['loan_approved'])
+        apply_async.assert_called_once()
+        
+        status_url = response['Location']
+        self.assertEqual(status_url, f"/loan-applications/{response.data['application_id']}/")
+        
+        result = originate_loans()
+        self.assertEqual(result, {'approved': 1, 'rejected': 0})
+        
+        response = self.client.get(status_url)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertTrue(response.data['loan_approved'])
+        loan = Loan.objects.get(loan_id=response.data['loan_id'])
+        self.assertEqual(Decimal(response.data['monthly_installment']), loan.monthly_repayment)
+        self.assertEqual(response.data['message'], 'Loan approved and created successfully')
+    
+    def test_micro_batch_matches_sequential_create_loan(self):
+        """A customer's applications in one batch see the loans booked before them"""
+        from .tasks import originate_loans
+        
+        twin = Customer.objects.create(
+            first_name="Sync",
+            last_name="Applicant",
+            age=35,
+            phone_number=9876580001,
+            monthly_salary=Decimal('50000')
+        )
+        requests = [
+            {'loan_amount': 200000, 'interest_rate': 10, 'tenure': 12},
+            {'loan_amount': 150000, 'interest_rate': 8, 'tenure': 24},
+            {'loan_amount': 100000, 'interest_rate': 9, 'tenure': 12},
+        ]
+        
+        application_urls = [self._apply(**request)[0]['Location'] for request in requests]
+        self._apply(customer_id=999999)
+        self.assertEqual(originate_loans(), {'approved': 2, 'rejected': 2})
+        
+        for request, url in zip(requests, application_urls):
+            expected = self.client.post(
+                '/create-loan/', dict(request, customer_id=twin.customer_id), format='json'
+            ).data
+            decided = self.client.get(url).data
+            for field in ('loan_approved', 'message', 'monthly_installment'):
+                self.assertEqual(decided[field], expected[field])
+    
+    def test_invalid_payload_and_unknown_application(self):
+        response, apply_async = self._apply(tenure='twelve')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        apply_async.assert_not_called()
+        
+        response = self.client.get('/loan-applications/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class IdempotencyKeyTest(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Retry",
+            last_name="Client",
+            age=29,
+            phone_number=9876590000,
+            monthly_salary=Decimal('80000')
+        )
+        self.loan_request = {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': 100000,
+            'interest_rate': 12,
+            'tenure': 12,
+        }
+    
+    def _create_loan(self, key, payload=None):
+        return self.client.post(
+            '/create-loan/', payload or self.loan_request, format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+    
+    def test_retry_replays_stored_response(self):
+        """A retry with the same key gets the first response and creates nothing"""
+        from unittest import mock
+        
+        first = self._create_loan('retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        
+        with mock.patch('loans.views.LoanEligibilityService.check_eligibility') as check:
+            retry = self._create_loan('retry-1')
+        check.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Loan.objects.filter(customer=self.customer).count(), 1)
+        
+        self._create_loan('retry-2')
+        self.assertEqual(Loan.objects.filter(customer=self.customer).count(), 2)
+    
+    def test_replay_keeps_location_header(self):
+        """A replayed 202 from create_loan_async still points at the application"""
+        responses = [
+            self.client.post(
+                '/create-loan/async/', self.loan_request, format='json', HTTP_IDEMPOTENCY_KEY='async-1'
+            )
+            for _ in range(2)
+        ]
+        self.assertEqual(responses[1].status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(responses[1]['Location'], responses[0]['Location'])
+    
+    def test_key_reused_with_other_payload(self):
+        self._create_loan('reused')
+        response = self._create_loan('reused', dict(self.loan_request, loan_amount=5000))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    def test_register_is_idempotent(self):
+        payload = {
+            'first_name': 'Once', 'last_name': 'Only', 'age': 40,
+            'monthly_income': 50000, 'phone_number': 9876590001
+        }
+        responses = [
+            self.client.post('/register/', payload, format='json', HTTP_IDEMPOTENCY_KEY='register-1')
+            for _ in range(2)
+        ]
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(Customer.objects.filter(phone_number=9876590001).count(), 1)
+    
+    def test_concurrent_request_waits_for_first(self):
+        """A request whose key is in progress waits and then gets the stored response"""
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from .models import IdempotencyRecord
+        
+        first = self._create_loan('concurrent')
+        stored = IdempotencyRecord.objects.get(key='concurrent')
+        body, status_code = stored.body, stored.status_code
+        # Put the key back in progress, as if the first request were still running
+        stored.status_code = stored.body = None
+        stored.expires_at = timezone.now() + timedelta(minutes=1)
+        stored.save()
+        
+        def first_request_finishes(seconds):
+            IdempotencyRecord.objects.filter(pk=stored.pk).update(status_code=status_code, body=body)
+        
+        with mock.patch('loans.idempotency.time.sleep', side_effect=first_request_finishes) as sleep:
+            retry = self._create_loan('concurrent')
+        sleep.assert_called_once()
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Loan.objects.filter(customer=self.customer).count(), 1)
+        
+        # A request that never finishes makes the waiter give up with 409
+        IdempotencyRecord.objects.filter(pk=stored.pk).update(status_code=None, body=None)
+        with self.settings(IDEMPOTENCY=dict(settings.IDEMPOTENCY, WAIT_TIMEOUT=0)):
+            response = self._create_loan('concurrent')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+class MessagePackTest(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Binary",
+            last_name="Client",
+            age=45,
+            phone_number=9876600000,
+            monthly_salary=Decimal('150000')
+        )
+        for amount in ('100000.50', '250000.00'):
+            Loan.objects.create(
+                customer=self.customer,
+                loan_amount=Decimal(amount),
+                tenure=24,
+                interest_rate=Decimal('11.25'),
+                start_date='2024-01-01',
+                end_date='2099-12-31'
+            )
+    
+    def test_codec_round_trips_exactly(self):
+        import uuid
+        from datetime import date, datetime, timezone
+        from .messagepack import packb, unpackb
+        
+        values = [
+            Decimal('1234.50'), Decimal('-0.01'), Decimal('0'), Decimal('99999999999.99'),
+            date(2024, 2, 29), uuid.uuid4(), datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc),
+        ]
+        decoded = unpackb(packb(values))
+        self.assertEqual(decoded, values)
+        self.assertEqual([str(value) for value in decoded], [str(value) for value in values])
+        self.assertEqual(len(packb(Decimal('1234.50'))), 6)
+    
+    def test_response_negotiated_by_accept(self):
+        """view_customer_loans answers in MessagePack with typed, exact money"""
+        from .messagepack import unpackb
+        
+        url = f'/view-loans/{self.customer.customer_id}/'
+        as_json = self.client.get(url)
+        as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertLess(len(as_msgpack.content), len(as_json.content))
+        
+        loans = unpackb(as_msgpack.content)
+        self.assertEqual(
+            sorted(loan['loan_amount'] for loan in loans),
+            [Decimal('100000.50'), Decimal('250000.00')]
+        )
+        for loan, json_loan in zip(loans, as_json.json()):
+            self.assertEqual(str(loan['monthly_installment']), json_loan['monthly_installment'])
+            self.assertEqual(loan['loan_id'], json_loan['loan_id'])
+    
+    def test_request_body_in_msgpack(self):
+        """A grid request sent as MessagePack is decided like the JSON one; malformed bodies are rejected"""
+        import msgpack
+        from .messagepack import packb, unpackb
+        
+        grid = {
+            'customer_id': self.customer.customer_id,
+            'loan_amounts': [Decimal('50000.00'), Decimal('400000.00')],
+            'tenures': [12, 36],
+            'interest_rates': [Decimal('9.50'), Decimal('14.00')],
+        }
+        response = self.client.post(
+            '/check-eligibility/grid/', packb(grid), content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = self.client.post('/check-eligibility/grid/', grid, format='json').json()
+        cells = unpackb(response.content)['cells']
+        self.assertEqual(len(cells), 8)
+        for cell, json_cell in zip(cells, expected['cells']):
+            self.assertEqual(cell['approval'], json_cell['approval'])
+            self.assertEqual(str(cell['monthly_installment']), json_cell['monthly_installment'])
+        
+        for body in (b'\xc1', msgpack.packb(msgpack.ExtType(2, b'ab')), msgpack.packb(msgpack.ExtType(1, b''))):
+            response = self.client.post(
+                '/check-eligibility/grid/', body, content_type='application/msgpack'
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TrafficCaptureTest(APITestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test import override_settings
+        from . import traffic
+        
+        self.capture_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.capture_dir, ignore_errors=True)
+        capture = override_settings(TRAFFIC_CAPTURE=dict(
+            settings.TRAFFIC_CAPTURE, ENABLED=True, SAMPLE_RATE=1.0, DIR=self.capture_dir
+        ))
+        capture.enable()
+        self.addCleanup(capture.disable)
+        self.addCleanup(traffic._writer.close)
+    
+    def _capture(self):
+        from . import traffic
+        
+        traffic._writer.close()
+        return traffic.load_capture([self.capture_dir])
+    
+    def test_captures_sampled_endpoints_with_pseudonymized_customers(self):
+        """Core endpoints are captured in arrival order without customer identities"""
+        response = self.client.post('/register/', {
+            'first_name': 'Captured',
+            'last_name': 'Customer',
+            'age': 30,
+            'monthly_income': 60000,
+            'phone_number': 9876700001,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        customer_id = response.data['customer_id']
+        self.client.post('/check-eligibility/', {
+            'customer_id': customer_id, 'loan_amount': 100000, 'interest_rate': 12, 'tenure': 12
+        }, format='json')
+        self.client.get(f'/view-loans/{customer_id}/')
+        self.client.get('/metrics/coalescing/')
+        
+        records = self._capture()
+        self.assertEqual(
+            [record['view'] for record in records],
+            ['register_customer', 'check_eligibility', 'view_customer_loans']
+        )
+        register, eligibility, view_loans = records
+        self.assertEqual(register['status'], status.HTTP_201_CREATED)
+        self.assertTrue(register['body']['first_name'].startswith('anon-'))
+        self.assertNotEqual(register['body']['phone_number'], 9876700001)
+        self.assertEqual(register['body']['monthly_income'], 60000)
+        
+        # One customer keeps one pseudonym across endpoints
+        pseudonym = eligibility['body']['customer_id']
+        self.assertNotEqual(pseudonym, customer_id)
+        self.assertEqual(view_loans['path'], f'/view-loans/{pseudonym}/')
+        self.assertGreaterEqual(eligibility['duration_ms'], 0)
+    
+    def test_large_bodies_do_not_fail_requests(self):
+        """Uncaptured endpoints never read the body and captured ones skip bodies over MAX_BODY_SIZE"""
+        from django.test import override_settings
+        
+        registrations = [
+            {'first_name': f'Bulk{i}', 'last_name': 'Upload', 'age': 30,
+             'monthly_income': 50000, 'phone_number': 9876710000 + i}
+            for i in range(20)
+        ]
+        with override_settings(
+                DATA_UPLOAD_MAX_MEMORY_SIZE=1000,
+                TRAFFIC_CAPTURE=dict(settings.TRAFFIC_CAPTURE, MAX_BODY_SIZE=100)):
+            response = self.client.post('/register/batch/', registrations, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            
+            response = self.client.post('/register/', dict(registrations[0], phone_number=9876719999), format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        records = self._capture()
+        self.assertEqual([record['view'] for record in records], ['register_customer'])
+        self.assertIsNone(records[0]['body'])
+        self.assertEqual(records[0]['body_omitted'], 'too large')
+    
+    def test_replay_reports_and_compares_endpoints(self):
+        """A capture replays against the in-process app onto existing customers"""
+        from django.core.handlers.wsgi import WSGIHandler
+        from django.core.signals import request_finished, request_started
+        from django.db import close_old_connections
+        from . import traffic
+        
+        # Like the test client, keep the test transaction's connection open
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        
+        customer = Customer.objects.create(
+            first_name="Replay",
+            last_name="Target",
+            age=40,
+            phone_number=9876700002,
+            monthly_salary=Decimal('80000')
+        )
+        for _ in range(3):
+            self.client.post('/check-eligibility/', {
+                'customer_id': customer.customer_id, 'loan_amount': 50000,
+                'interest_rate': 10, 'tenure': 6
+            }, format='json')
+        self.client.get(f'/view-loans/{customer.customer_id}/')
+        records = self._capture()
+        self.assertEqual(len(records), 4)
+        
+        remap = traffic.customer_remapper([customer.customer_id])
+        self.assertEqual(remap(records[0]['body']['customer_id']), customer.customer_id)
+        replayed = [traffic._remap_record(record, remap) for record in records]
+        self.assertEqual(replayed[-1]['path'], f'/view-loans/{customer.customer_id}/')
+        
+        # Replayed in this thread: the test transaction is not visible to others
+        application = WSGIHandler()
+        results = [traffic._issue(application, record) for record in replayed]
+        self.assertEqual([status_code for status_code, _ in results], [200, 200, 200, 200])
+        
+        report = traffic.replay(
+            [dict(record, path='/metrics/coalescing/', view='coalescing_metrics', body=None, method='GET')
+             for record in records],
+            application=application, speedup=0, concurrency=2
+        )
+        self.assertEqual(report['requests'], 4)
+        endpoint = report['endpoints']['coalescing_metrics']
+        self.assertEqual(endpoint['statuses'], {'200': 4})
+        self.assertEqual(endpoint['errors'], 0)
+        self.assertIsNotNone(endpoint['p95_ms'])
+        
+        slower = json.loads(json.dumps(report))
+        slower['endpoints']['coalescing_metrics']['p50_ms'] = endpoint['p50_ms'] * 2
+        comparison = traffic.compare_reports(report, slower)
+        self.assertEqual(comparison['coalescing_metrics']['p50_ms']['change_pct'], 100.0)
+
+
+class CreditPolicyTest(APITestCase):
+    def setUp(self):
+        from datetime import date, timedelta
+        from .policy import DEFAULT_RULES, reload_policy
+        
+        reload_policy()
+        self.addCleanup(reload_policy)
+        self.rules = json.loads(json.dumps(DEFAULT_RULES))
+        
+        today = date.today()
+        self.customer = Customer.objects.create(
+            first_name="Policy",
+            last_name="Banded",
+            age=35,
+            phone_number=9876800001,
+            monthly_salary=Decimal('100000')
+        )
+        # Five late, already ended loans of this year at 83% of the limit: score 25
+        for _ in range(5):
+            Loan.objects.create(
+                customer=self.customer,
+                loan_amount=Decimal('600000'),
+                tenure=12,
+                interest_rate=Decimal('10.0'),
+                emis_paid_on_time=2,
+                start_date=date(today.year, 1, 1),
+                end_date=today - timedelta(days=1)
+            )
+        self.eligibility_request = {
+            'customer_id': self.customer.customer_id,
+            'loan_amount': 100000,
+            'interest_rate': 10,
+            'tenure': 12
+        }
+    
+    def _publish(self, **changes):
+        from .policy import publish_policy
+        
+        self.rules.update(changes)
+        with self.captureOnCommitCallbacks(execute=True):
+            return publish_policy(self.rules, 'test')
+    
+    def test_default_policy_matches_legacy_bands(self):
+        """Version 0 reproduces the hard-coded score bands and rate floors"""
+        from .policy import DEFAULT_RULES, compile_policy
+        
+        policy = compile_policy(DEFAULT_RULES, 0)
+        expected = {
+            0: (False, Decimal('10'), 'Loan not approved due to low credit score'),
+            10: (False, Decimal('10'), 'Loan not approved due to low credit score'),
+            11: (True, Decimal('16.0'), 'Loan approved with corrected interest rate'),
+            30: (True, Decimal('16.0'), 'Loan approved with corrected interest rate'),
+            31: (True, Decimal('12.0'), 'Loan approved with corrected interest rate'),
+            50: (True, Decimal('12.0'), 'Loan approved with corrected interest rate'),
+            51: (True, Decimal('10'), 'Loan approved'),
+        }
+        for credit_score, decision in expected.items():
+            self.assertEqual(policy.apply(credit_score, Decimal('10')), decision)
+        self.assertEqual(policy.apply(40, Decimal('13')), (True, Decimal('13'), 'Loan approved'))
+        
+        self.assertEqual([policy.loan_count_points(n) for n in (0, 2, 3, 5, 6, 10, 11)], [20, 20, 15, 15, 10, 10, 5])
+        self.assertEqual([policy.current_year_points(n) for n in (0, 1, 2, 3, 4, 5)], [20, 15, 15, 10, 10, 5])
+        self.assertEqual([policy.volume_points(r) for r in (0.3, 0.31, 0.6, 0.8, 0.81)], [20, 15, 15, 10, 5])
+    
+    def test_invalid_policies_are_rejected(self):
+        """Policies with unsorted bounds, wrong lengths or missing rules do not compile"""
+        from .policy import PolicyError, compile_policy
+        
+        invalid = [
+            dict(self.rules, loan_count={'bounds': [5, 2], 'points': [1, 2, 3]}),
+            dict(self.rules, current_year_loans={'bounds': [0, 2], 'points': [20]}),
+            dict(self.rules, rate_bands=dict(self.rules['rate_bands'], approve=[True])),
+            {key: value for key, value in self.rules.items() if key != 'volume_ratio'},
+            [],
+        ]
+        for rules in invalid:
+            with self.assertRaises(PolicyError):
+                compile_policy(rules)
+    
+    def test_published_policy_decides_and_is_recorded(self):
+        """A new version changes decisions at once and is recorded on loans and responses"""
+        from datetime import date
+        from .models import CreditScore
+        
+        breakdown = CreditScoreService.calculate_credit_score_breakdown(self.customer.customer_id)
+        self.assertEqual(breakdown['policy_version'], 0)
+        CreditScore.objects.create(
+            customer=self.customer, credit_score=breakdown['credit_score'],
+            score_year=date.today().year, policy_version=0
+        )
+        
+        response = self.client.post('/check-eligibility/', self.eligibility_request, format='json')
+        self.assertEqual(response.data['policy_version'], 0)
+        self.assertEqual(response.data['corrected_interest_rate'], '16.00')
+        
+        # Raise the floor of the customer's band and reward fewer on-time loans
+        rate_bands = dict(self.rules['rate_bands'], min_rates=[None, '18.5', '12.0', None])
+        policy = self._publish(rate_bands=rate_bands, on_time_points=30)
+        self.assertEqual(policy.version, 1)
+        
+        # The version 0 persisted score is ignored
+        self.assertEqual(
+            CreditScoreService.get_credit_score(self.customer.customer_id),
+            CreditScoreService.calculate_credit_score_breakdown(self.customer.customer_id)['credit_score']
+        )
+        response = self.client.post('/check-eligibility/', self.eligibility_request, format='json')
+        self.assertEqual(response.data['policy_version'], 1)
+        self.assertEqual(response.data['corrected_interest_rate'], '18.50')
+        
+        response = self.client.post('/create-loan/', self.eligibility_request, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['policy_version'], 1)
+        loan = Loan.objects.get(loan_id=response.data['loan_id'])
+        self.assertEqual(loan.policy_version, 1)
+        self.assertEqual(loan.interest_rate, Decimal('18.50'))
+    
+    def test_other_processes_pick_up_new_versions(self):
+        """Versions published elsewhere are loaded once the reload interval has passed"""
+        from django.test import override_settings
+        from .models import CreditPolicy
+        from .policy import active_policy
+        
+        self.assertEqual(active_policy().version, 0)
+        CreditPolicy.objects.create(version=1, rules=dict(self.rules, new_customer_score=60))
+        self.assertEqual(active_policy().version, 0)
+        
+        with override_settings(CREDIT_POLICY={'RELOAD_INTERVAL': 0}):
+            policy = active_policy()
+            self.assertEqual(policy.version, 1)
+            self.assertEqual(policy.new_customer_score, 60)
+            self.assertIs(active_policy(), policy)
+    
+    def test_sql_score_uses_active_policy(self):
+        """with_credit_score applies the same policy bands as the Python scoring"""
+        self._publish(
+            loan_count={'bounds': [1, 5], 'points': [30, 12, 0]},
+            volume_ratio={'bounds': ['0.5', '0.9'], 'points': [25, 7, 1]},
+            on_time_points=50,
+        )
+        annotated = Customer.objects.with_credit_score().get(customer_id=self.customer.customer_id)
+        breakdown = CreditScoreService.calculate_credit_score_breakdown(self.customer.customer_id)
+        self.assertEqual((breakdown['loan_count_score'], breakdown['volume_score']), (12, 7))
+        for component in ('credit_score', 'loan_count_score', 'current_year_score', 'volume_score'):
+            self.assertEqual(getattr(annotated, component), breakdown[component])
+        self.assertAlmostEqual(annotated.on_time_score, breakdown['on_time_score'])
+
+
+class PolicyBacktestTest(TestCase):
+    def setUp(self):
+        from datetime import date
+        
+        year = date.today().year
+        # (customer, amount, rate, tenure, emis paid on time, start, end)
+        self.loans = []
+        specs = [
+            (Decimal('120000'), [
+                (Decimal('300000'), Decimal('8.0'), 24, 24, date(year - 2, 3, 1), date(year - 1, 3, 1)),
+                (Decimal('200000'), Decimal('11.0'), 12, 5, date(year - 1, 6, 1), date(year - 1, 12, 1)),
+                (Decimal('400000'), Decimal('12.5'), 36, 10, date(year - 1, 9, 1), date(year + 2, 9, 1)),
+                (Decimal('250000'), Decimal('9.0'), 12, 2, date(year, 1, 10), date(year, 12, 10)),
+                (Decimal('150000'), Decimal('14.0'), 6, 0, date(year, 2, 10), date(year, 8, 10)),
+            ]),
+            (Decimal('200000'), [
+                (Decimal('500000'), Decimal('0'), 10, 10, date(year - 1, 1, 1), date(year - 1, 11, 1)),
+                (Decimal('900000'), Decimal('10.0'), 24, 24, date(year - 1, 1, 1), date(year + 1, 1, 1)),
+                (Decimal('2500000'), Decimal('17.0'), 60, 3, date(year, 3, 1), date(year + 5, 3, 1)),
+            ]),
+            (Decimal('25000'), [
+                (Decimal('100000'), Decimal('10.0'), 12, 12, date(year, 1, 1), date(year + 1, 1, 1)),
+            ]),
+            # Late, short loans this year up to 83% of the limit: the last one scores 30
+            (Decimal('20000'), [
+                (Decimal('150000'), Decimal('10.0'), 1, 0, date(year, 1, day), date(year, 1, day + 1))
+                for day in (1, 3, 5, 7)
+            ] + [
+                (Decimal('10000'), Decimal('10.0'), 12, 0, date(year, 1, 9), date(year + 1, 1, 9)),
+            ]),
+        ]
+        for index, (salary, loans) in enumerate(specs):
+            customer = Customer.objects.create(
+                first_name="Backtest",
+                last_name=str(index),
+                age=30 + index,
+                phone_number=9876900000 + index,
+                monthly_salary=salary
+            )
+            for amount, rate, tenure, paid, start, end in loans:
+                loan = Loan.objects.create(
+                    customer=customer, loan_amount=amount, interest_rate=rate, tenure=tenure,
+                    emis_paid_on_time=paid, start_date=start, end_date=end
+                )
+                self.loans.append(Loan.objects.select_related('customer').get(pk=loan.pk))
+    
+    def _expected(self, policy):
+        """Per-loan decisions from the service code on naively rebuilt inputs"""
+        expected = {}
+        for loan in self.loans:
+            customer = loan.customer
+            earlier = [
+                other for other in self.loans
+                if other.customer_id == loan.customer_id
+                and (other.start_date, other.loan_id) < (loan.start_date, loan.loan_id)
+            ]
+            breakdown = CreditScoreService.score_from_aggregates(
+                customer.approved_limit,
+                len(earlier),
+                sum(other.emis_paid_on_time >= other.tenure for other in earlier),
+                sum(other.start_date.year == loan.start_date.year for other in earlier),
+                sum((other.loan_amount for other in earlier), Decimal('0')),
+                policy=policy
+            )
+            current_emis = sum(
+                (other.monthly_repayment for other in earlier if other.end_date >= loan.start_date),
+                Decimal('0')
+            )
+            decision = LoanEligibilityService.decide(
+                breakdown['credit_score'], current_emis, customer.monthly_salary,
+                loan.loan_amount, loan.interest_rate, loan.tenure, policy
+            )
+            expected[loan.loan_id] = (breakdown['credit_score'], decision)
+        return expected
+    
+    def _candidate(self):
+        from .policy import DEFAULT_RULES, compile_policy
+        
+        rules = json.loads(json.dumps(DEFAULT_RULES))
+        rules['rate_bands'] = {
+            'bounds': [30, 50],
+            'approve': [False, True, True],
+            'min_rates': [None, '14.0', None],
+        }
+        return compile_policy(rules, 99)
+    
+    def test_vectorized_decisions_match_services(self):
+        """The columnar book and kernel reproduce the service decision of every loan"""
+        from .backtest import DecisionBook, policy_arrays
+        from .policy import DEFAULT_RULES, compile_policy
+        from .vectorized import APPROVED, REJECTED_EMI, evaluate_policy
+        
+        book = DecisionBook.load(chunk_size=2)
+        self.assertEqual(sorted(book.loan_id.tolist()), sorted(loan.loan_id for loan in self.loans))
+        for policy in (compile_policy(DEFAULT_RULES, 0), self._candidate()):
+            expected = self._expected(policy)
+            result = evaluate_policy(book.columns(), policy_arrays(policy))
+            for i, loan_id in enumerate(book.loan_id.tolist()):
+                credit_score, decision = expected[loan_id]
+                with self.subTest(version=policy.version, loan_id=loan_id):
+                    self.assertEqual(result['credit_score'][i], credit_score)
+                    self.assertEqual(result['outcome'][i] == APPROVED, decision['approval'])
+                    if decision['message'] == 'EMI exceeds 50% of monthly salary':
+                        self.assertEqual(result['outcome'][i], REJECTED_EMI)
+                    self.assertEqual(result['interest_rate'][i], float(decision['corrected_interest_rate']))
+                    self.assertAlmostEqual(
+                        result['monthly_installment'][i], float(decision['monthly_installment']), places=6
+                    )
+    
+    def test_report_counts_flips_and_rate_changes(self):
+        """The report matches the per-loan diff and does not depend on chunking"""
+        from .backtest import DecisionBook, run_backtest
+        from .policy import DEFAULT_RULES, compile_policy
+        
+        baseline, candidate = compile_policy(DEFAULT_RULES, 0), self._candidate()
+        before, after = self._expected(baseline), self._expected(candidate)
+        flips = {
+            loan_id for loan_id in before if before[loan_id][1]['approval'] != after[loan_id][1]['approval']
+        }
+        raised = sum(
+            before[loan_id][1]['approval'] and after[loan_id][1]['approval']
+            and after[loan_id][1]['corrected_interest_rate'] > before[loan_id][1]['corrected_interest_rate']
+            for loan_id in before
+        )
+        self.assertTrue(flips and raised)
+        
+        book = DecisionBook.load()
+        report = run_backtest(book, baseline, candidate)
+        summary = report['summary']
+        self.assertEqual(report['baseline_version'], 0)
+        self.assertEqual(report['candidate_version'], 99)
+        self.assertEqual(summary['loans'], len(self.loans))
+        self.assertEqual(summary['approved_before'], sum(d['approval'] for _, d in before.values()))
+        self.assertEqual(summary['approved_after'], sum(d['approval'] for _, d in after.values()))
+        self.assertEqual(summary['flipped_to_rejected'] + summary['flipped_to_approved'], len(flips))
+        self.assertEqual(summary['rate_raised'], raised)
+        self.assertEqual({example['loan_id'] for example in report['flipped_examples']}, flips)
+        self.assertEqual(
+            sum(segment['loans'] for segment in report['segments']['score_band'].values()), len(self.loans)
+        )
+        self.assertEqual(
+            sum(segment['flipped_to_rejected'] for segment in report['segments']['start_year'].values()),
+            summary['flipped_to_rejected']
+        )
+        
+        chunked = run_backtest(book, baseline, candidate, workers=2, chunk_size=3)
+        for key in ('summary', 'outcomes', 'segments', 'flipped_examples'):
+            self.assertEqual(chunked[key], report[key])
+
+
+class IdentityMapTest(APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Identity",
+            last_name="Mapped",
+            age=36,
+            phone_number=9876610000,
+            monthly_salary=Decimal('100000')
+        )
+        Loan.objects.create(
+            customer=self.customer,
+            loan_amount=Decimal('100000'),
+            tenure=12,
+            interest_rate=Decimal('14.0'),
+            emis_paid_on_time=4,
+            start_date='2024-01-01',
+            end_date='2099-12-31'
+        )
+    
+    def _selects(self, queries, table):
+        return [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']
+        ]
+    
+    def test_create_loan_loads_customer_and_loans_once(self):
+        """Eligibility, scoring, the EMI check and booking share one customer and one loan set load"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/create-loan/', {
+                'customer_id': self.customer.customer_id,
+                'loan_amount': 50000,
+                'interest_rate': 14,
+                'tenure': 12
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self._selects(queries.captured_queries, 'customers')), 1)
+        self.assertEqual(len(self._selects(queries.captured_queries, 'loans')), 1)
+    
+    def test_unit_of_work_caches_until_writes(self):
+        """Repeated lookups, misses included, hit the map; writes and the end of the unit drop entries"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .identity import get_customer, get_loans, unit_of_work
+        
+        customer_id = self.customer.customer_id
+        with unit_of_work():
+            with CaptureQueriesContext(connection) as queries:
+                customer = get_customer(customer_id)
+                self.assertIs(get_customer(customer_id), customer)
+                loans = get_loans(customer_id)
+                self.assertIs(get_loans(customer_id), loans)
+                self.assertIs(loans[0].customer, customer)
+                for _ in range(2):
+                    with self.assertRaises(Customer.DoesNotExist):
+                        get_customer(999999)
+            self.assertEqual(len(queries), 3)
+            
+            Loan.objects.create(
+                customer=customer, loan_amount=Decimal('20000'), tenure=6, interest_rate=Decimal('12.0'),
+                start_date='2024-06-01', end_date='2024-11-30'
+            )
+            self.assertEqual(len(get_loans(customer_id)), 2)
+            self.assertIsNot(get_customer(customer_id), customer)
+        
+        with CaptureQueriesContext(connection) as queries:
+            get_customer(customer_id)
+            get_customer(customer_id)
+        self.assertEqual(len(queries), 2)
+
+
+class ShardMapTest(TestCase):
+    def test_jump_hash_only_moves_customers_to_the_new_shard(self):
+        from .sharding import ShardMap
+        
+        three = ShardMap(['shard_0', 'shard_1', 'shard_2'])
+        four = ShardMap(['shard_0', 'shard_1', 'shard_2', 'shard_3'])
+        customer_ids = range(1, 4001)
+        
+        moved = [cid for cid in customer_ids if three.shard_for(cid) != four.shard_for(cid)]
+        self.assertTrue(all(four.shard_for(cid) == 'shard_3' for cid in moved))
+        self.assertAlmostEqual(len(moved) / len(customer_ids), 0.25, delta=0.05)
+        self.assertEqual([three.shard_for(cid) for cid in customer_ids],
+                         [three.shard_for(cid) for cid in customer_ids])
+    
+    def test_range_strategy(self):
+        from .sharding import ShardMap
+        
+        shards = ShardMap(['shard_0', 'shard_1'], 'range', [(1000, 'shard_0'), (None, 'shard_1')])
+        self.assertEqual(shards.shard_for(999), 'shard_0')
+        self.assertEqual(shards.shard_for(1000), 'shard_1')
+        with self.assertRaises(ValueError):
+            ShardMap(['shard_0'], 'range', [(1000, 'shard_0')])
+    
+    def test_unsharded_setup_uses_default(self):
+        from .sharding import ShardRouter, assign_ids, shard_aliases, shard_for
+        from django.test import override_settings
+        
+        with override_settings(SHARDING=dict(settings.SHARDING, SHARDS=[])):
+            self.assertEqual(shard_aliases(), ['default'])
+            self.assertEqual(shard_for(42), 'default')
+            customer = Customer(first_name="A", last_name="B", age=30,
+                                phone_number=9000000001, monthly_salary=Decimal('50000'))
+            assign_ids([customer])
+            self.assertIsNone(customer.pk)
+            self.assertIsNone(ShardRouter().db_for_read(Customer))
+
+
+@skipUnless(len(settings.SHARDING['SHARDS']) >= 2, 'needs SHARD_DATABASE_URLS with two shards')
+class ShardedDatabaseTest(APITestCase):
+    databases = '__all__'
+    
+    def setUp(self):
+        from .sharding import _allocator
+        _allocator.reset()
+    
+    def _register(self, count):
+        response = self.client.post('/register/batch/', [
+            {'first_name': f'Shard{i}', 'last_name': 'Test', 'age': 30,
+             'monthly_income': 50000, 'phone_number': 9100000000 + i}
+            for i in range(count)
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return [result['customer_id'] for result in response.data['results']]
+    
+    def _located(self, customer_ids):
+        return {
+            alias: set(Customer.objects.using(alias).filter(
+                customer_id__in=customer_ids).values_list('customer_id', flat=True))
+            for alias in settings.SHARDING['SHARDS']
+        }
+    
+    def test_customers_and_loans_live_on_their_shard(self):
+        from .sharding import shard_for
+        
+        customer_ids = self._register(20)
+        self.assertEqual(len(set(customer_ids)), 20)
+        for alias, located in self._located(customer_ids).items():
+            self.assertEqual(located, {cid for cid in customer_ids if shard_for(cid) == alias})
+        
+        customer_id = customer_ids[0]
+        response = self.client.post('/create-loan/', {
+            'customer_id': customer_id, 'loan_amount': 100000,
+            'interest_rate': 10, 'tenure': 12
+        }, format='json')
+        self.assertTrue(response.data['loan_approved'])
+        loan_id = response.data['loan_id']
+        self.assertTrue(Loan.objects.using(shard_for(customer_id)).filter(loan_id=loan_id).exists())
+        
+        response = self.client.get(f'/view-loan/{loan_id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f'/view-loans/{customer_id}/')
+        self.assertEqual(len(response.data), 1)
+    
+    def test_rebalance_moves_customers_to_new_shard(self):
+        from django.core.management import call_command
+        from django.test import override_settings
+        from io import StringIO
+        from .sharding import shard_for
+        
+        customer_ids = self._register(20)
+        sharding = dict(settings.SHARDING, SHARDS=list(reversed(settings.SHARDING['SHARDS'])))
+        with override_settings(SHARDING=sharding):
+            call_command('rebalance_shards', stdout=StringIO())
+            for alias, located in self._located(customer_ids).items():
+                self.assertEqual(located, {cid for cid in customer_ids if shard_for(cid) == alias})
+    
+    def test_book_wide_reads_span_all_shards(self):
+        from datetime import date
+        from .exports import export_rows
+        from .simulation import LoanBook
+        from .sharding import shard_for
+        
+        customer_ids = self._register(20)
+        borrowers = [
+            next(cid for cid in customer_ids if shard_for(cid) == alias)
+            for alias in settings.SHARDING['SHARDS']
+        ]
+        loan_ids = []
+        for customer_id in borrowers:
+            response = self.client.post('/create-loan/', {
+                'customer_id': customer_id, 'loan_amount': 100000,
+                'interest_rate': 10, 'tenure': 12
+            }, format='json')
+            loan_ids.append(response.data['loan_id'])
+        
+        fields, rows = export_rows('loans')
+        self.assertEqual([row[0] for row in rows], sorted(loan_ids))
+        self.assertEqual(len(LoanBook.load_active()), len(borrowers))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/payments/', [
+                {'payment_reference': f'SHARD-{loan_id}', 'loan_id': loan_id,
+                 'amount': '9000.00', 'paid_on': str(date.today())}
+                for loan_id in loan_ids
+            ], format='json')
+        self.assertEqual(response.data['posted'], len(loan_ids))
+        for customer_id, loan_id in zip(borrowers, loan_ids):
+            loan = Loan.objects.using(shard_for(customer_id)).get(loan_id=loan_id)
+            self.assertEqual(loan.emis_paid_on_time, 1)
+        
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 7}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/customers/', params)
+            seen.extend(customer['customer_id'] for customer in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(customer_ids))
\ No newline at end of file
@@ -0,0 +1,406 @@
+"""
+Production traffic capture and replay.
+
+TrafficCaptureMiddleware samples requests to the core endpoints into
+gzip-compressed NDJSON files under TRAFFIC_CAPTURE['DIR']: one line per
+request with its arrival time, method, path, JSON body, status and
+duration. Customer ids, names and phone numbers are replaced with keyed
+HMAC pseudonyms, so the same customer keeps the same pseudonym within a
+capture without revealing who it is.
+
+``replay`` re-issues a capture against the in-process WSGI application at
+the original pace (or sped up) with a pool of concurrent clients, and
+``compare_reports`` diffs the per-endpoint latency and throughput of two
+replays, e.g. of two builds.
+"""
+import atexit
+import glob
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+_CUSTOMER_FIELDS = {'customer_id'}
+_NAME_FIELDS = {'first_name', 'last_name'}
+_PHONE_FIELDS = {'phone_number'}
+
+
+class Pseudonymizer:
+    """Keyed, stable pseudonyms for customer identifiers"""
+    
+    def __init__(self, secret):
+        self.key = hashlib.sha256(f'loans.traffic:{secret}'.encode()).digest()
+    
+    def _digest(self, kind, value):
+        return hmac.new(self.key, f'{kind}:{value}'.encode(), hashlib.sha256).digest()
+    
+    def customer_id(self, value):
+        return int.from_bytes(self._digest('customer', value)[:6], 'big') % 10 ** 9 + 1
+    
+    def name(self, value):
+        return 'anon-' + self._digest('name', value)[:4].hex()
+    
+    def phone_number(self, value):
+        return 9 * 10 ** 9 + int.from_bytes(self._digest('phone', value)[:6], 'big') % 10 ** 9
+    
+    def body(self, data):
+        """Copy of a parsed JSON body with customer identifiers replaced"""
+        if isinstance(data, list):
+            return [self.body(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        
+        anonymized = {}
+        for field, value in data.items():
+            if value is None or isinstance(value, (dict, list)):
+                anonymized[field] = self.body(value)
+            elif field in _CUSTOMER_FIELDS:
+                anonymized[field] = self.customer_id(value)
+            elif field in _NAME_FIELDS:
+                anonymized[field] = self.name(value)
+            elif field in _PHONE_FIELDS:
+                anonymized[field] = self.phone_number(value)
+            else:
+                anonymized[field] = value
+        return anonymized
+
+
+class _CaptureWriter:
+    """Appends records to one gzip NDJSON file per process and hour"""
+    
+    FLUSH_EVERY = 100
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._name = None
+        self._pending = 0
+    
+    def write(self, record):
+        line = json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+        options = settings.TRAFFIC_CAPTURE
+        name = os.path.join(
+            str(options['DIR']),
+            f"capture-{datetime.now(timezone.utc).strftime('%Y%m%dT%H')}-{os.getpid()}.ndjson.gz"
+        )
+        with self._lock:
+            if name != self._name:
+                self._close()
+                os.makedirs(os.path.dirname(name), exist_ok=True)
+                # Appending adds a gzip member; readers see one continuous stream
+                self._file = gzip.open(name, 'at', encoding='utf-8')
+                self._name = name
+            self._file.write(line)
+            self._pending += 1
+            if self._pending >= self.FLUSH_EVERY:
+                self._file.flush()
+                self._pending = 0
+    
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = self._name = None
+            self._pending = 0
+    
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_writer = _CaptureWriter()
+atexit.register(_writer.close)
+
+
+class TrafficCaptureMiddleware:
+    """
+    Samples requests to TRAFFIC_CAPTURE['VIEWS'] into the capture files.
+    Removed from the middleware chain when capture is disabled.
+    """
+    
+    def __init__(self, get_response):
+        options = settings.TRAFFIC_CAPTURE
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = options['SAMPLE_RATE']
+        self.views = set(options['VIEWS'])
+        self.max_body_size = options['MAX_BODY_SIZE']
+        self.pseudonymizer = Pseudonymizer(options['SECRET'])
+    
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        
+        # Resolve before touching the body: reading request.body enforces
+        # DATA_UPLOAD_MAX_MEMORY_SIZE, which the views' stream parsing does not
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return self.get_response(request)
+        if match.url_name not in self.views:
+            return self.get_response(request)
+        
+        body = self._body(request)
+        arrived_at = time.time()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - started
+        
+        try:
+            _writer.write(self._record(request, match, body, response, arrived_at, duration))
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not capture request to {request.path}: {str(e)}")
+        return response
+    
+    def _body(self, request):
+        """The raw request body, or None if it is larger than MAX_BODY_SIZE"""
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return None
+        if length > self.max_body_size:
+            return None
+        return request.body
+    
+    def _record(self, request, match, body, response, arrived_at, duration):
+        path = request.path
+        if 'customer_id' in match.kwargs:
+            from django.urls import reverse
+            kwargs = dict(match.kwargs)
+            kwargs['customer_id'] = self.pseudonymizer.customer_id(kwargs['customer_id'])
+            path = reverse(match.view_name, kwargs=kwargs)
+        
+        record = {
+            'ts': round(arrived_at, 6),
+            'view': match.url_name,
+            'method': request.method,
+            'path': path,
+            'query': request.META.get('QUERY_STRING', ''),
+            'body': None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+        }
+        if body is None:
+            record['body_omitted'] = 'too large'
+        elif body:
+            if request.content_type == 'application/json':
+                record['body'] = self.pseudonymizer.body(json.loads(body))
+            else:
+                # Only JSON bodies can be anonymized; others are not kept
+                record['body_omitted'] = request.content_type
+        return record
+
+
+def load_capture(paths):
+    """Records of the given capture files (or directories), in arrival order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.ndjson.gz'))))
+        else:
+            files.append(path)
+    
+    records = []
+    for name in files:
+        with gzip.open(name, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    # Stable sort: ties keep the file order, so the replay order is deterministic
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def customer_remapper(customer_ids):
+    """
+    Map the pseudonymous customer ids of a capture onto existing customers,
+    so replays against another database hit real rows. Equal pseudonyms map
+    to the same customer, preserving repeat traffic.
+    """
+    customer_ids = sorted(customer_ids)
+    if not customer_ids:
+        return lambda value: value
+    
+    def remap(value):
+        digest = hashlib.sha256(str(value).encode()).digest()
+        return customer_ids[int.from_bytes(digest[:8], 'big') % len(customer_ids)]
+    return remap
+
+
+def _remap_record(record, remap):
+    def remap_body(data):
+        if isinstance(data, list):
+            return [remap_body(item) for item in data]
+        if isinstance(data, dict):
+            return {
+                field: remap(value) if field in _CUSTOMER_FIELDS and value is not None
+                else remap_body(value)
+                for field, value in data.items()
+            }
+        return data
+    
+    record = dict(record, body=remap_body(record.get('body')))
+    if record['view'] == 'view_customer_loans':
+        prefix, _, customer_id = record['path'].rstrip('/').rpartition('/')
+        record['path'] = f'{prefix}/{remap(int(customer_id))}/'
+    return record
+
+
+def _environ(record):
+    body = b''
+    if record.get('body') is not None:
+        body = json.dumps(record['body']).encode()
+    return {
+        'REQUEST_METHOD': record['method'],
+        'PATH_INFO': record['path'],
+        'QUERY_STRING': record.get('query', ''),
+        'SERVER_NAME': 'replay',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'localhost',
+        'CONTENT_TYPE': 'application/json' if body else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def _issue(application, record):
+    statuses = []
+    started = time.perf_counter()
+    response = application(
+        _environ(record), lambda status, headers, exc_info=None: statuses.append(status)
+    )
+    try:
+        for _ in response:
+            pass
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return int(statuses[0].split()[0]), time.perf_counter() - started
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def replay(records, application=None, speedup=1.0, concurrency=8, remap=None):
+    """
+    Re-issue captured requests against a WSGI application (the project's by
+    default). Requests start at their captured offsets divided by
+    ``speedup``; 0 sends them as fast as the ``concurrency`` clients allow.
+    Returns a per-endpoint report of latencies, throughput and statuses.
+    """
+    if application is None:
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+    if remap is not None:
+        records = [_remap_record(record, remap) for record in records]
+    
+    results = []
+    lags = []
+    
+    def run(record):
+        try:
+            status_code, seconds = _issue(application, record)
+        except Exception as e:
+            logger.error(f"Replayed {record['method']} {record['path']} raised {e!r}")
+            status_code, seconds = 599, None
+        results.append((record['view'], status_code, seconds, record.get('status')))
+    
+    started = time.perf_counter()
+    first_ts = records[0]['ts'] if records else 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            if speedup > 0:
+                due = (record['ts'] - first_ts) / speedup
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lags.append(-delay)
+            executor.submit(run, record)
+    elapsed = time.perf_counter() - started
+    
+    by_view = defaultdict(list)
+    for result in results:
+        by_view[result[0]].append(result)
+    
+    endpoints = {}
+    for view, view_results in sorted(by_view.items()):
+        latencies = sorted(seconds * 1000 for _, _, seconds, _ in view_results if seconds is not None)
+        statuses = defaultdict(int)
+        for _, status_code, _, _ in view_results:
+            statuses[str(status_code)] += 1
+        endpoints[view] = {
+            'requests': len(view_results),
+            'throughput_rps': round(len(view_results) / elapsed, 3) if elapsed > 0 else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50_ms': _percentile(latencies, 0.5),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'errors': sum(1 for _, status_code, _, _ in view_results if status_code >= 500),
+            'status_mismatches': sum(
+                1 for _, status_code, _, captured in view_results
+                if captured is not None and status_code != captured
+            ),
+            'statuses': dict(statuses),
+        }
+    
+    return {
+        'requests': len(results),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 3) if elapsed > 0 else None,
+        'speedup': speedup,
+        'concurrency': concurrency,
+        'max_schedule_lag_ms': round(max(lags) * 1000, 3) if lags else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+def compare_reports(baseline, candidate):
+    """Per-endpoint changes from a baseline replay report to a candidate one"""
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return None
+        return round((new - old) / old * 100, 1)
+    
+    comparison = {}
+    for view in sorted(set(baseline['endpoints']) | set(candidate['endpoints'])):
+        old = baseline['endpoints'].get(view, {})
+        new = candidate['endpoints'].get(view, {})
+        comparison[view] = {
+            metric: {
+                'baseline': old.get(metric),
+                'candidate': new.get(metric),
+                'change_pct': change(old.get(metric), new.get(metric)),
+            }
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'errors')
+        }
+    return comparison
\ No newline at end of file
@@ -3,8 +3,23 @@ from . import views
 
 urlpatterns = [
     path('register/', views.register_customer, name='register_customer'),
+    path('register/batch/', views.register_customers_batch, name='register_customers_batch'),
+    path('customers/', views.search_customers, name='search_customers'),
     path('check-eligibility/', views.check_eligibility, name='check_eligibility'),
+    path('check-eligibility/grid/', views.check_eligibility_grid, name='check_eligibility_grid'),
+    path('check-eligibility/max-amount/', views.max_loan_amount, name='max_loan_amount'),
     path('create-loan/', views.create_loan, name='create_loan'),
+    path('create-loan/async/', views.create_loan_async, name='create_loan_async'),
+    path('loan-applications/<uuid:application_id>/', views.loan_application, name='loan_application'),
     path('view-loan/<int:loan_id>/', views.view_loan, name='view_loan'),
     path('view-loans/<int:customer_id>/', views.view_customer_loans, name='view_customer_loans'),
+    path('payments/', views.post_payments, name='post_payments'),
+    path('export/<str:dataset>.<str:file_format>', views.export_book, name='export_book'),
+    path('ingestion/<str:task_id>/', views.ingestion_status, name='ingestion_status'),
+    path('metrics/coalescing/', views.coalescing_metrics, name='coalescing_metrics'),
+    path('metrics/slow-queries/', views.slow_query_metrics, name='slow_query_metrics'),
+    path('profiles/', views.request_profiles, name='request_profiles'),
+    path('profiles/<str:profile_id>.json', views.request_profile, {'extension': 'json'}, name='request_profile'),
+    path('profiles/<str:profile_id>.prof', views.request_profile, {'extension': 'prof'}, name='request_profile_raw'),
+    path('portfolio/loss-simulation/', views.portfolio_loss_simulation, name='portfolio_loss_simulation'),
 ]
\ No newline at end of file
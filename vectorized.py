@@ -0,0 +1,168 @@
+"""
+NumPy kernels for loan book analytics.
+
+These functions only depend on NumPy so they can run in worker processes
+without a configured Django environment.
+"""
+import numpy as np
+
+
+def monthly_rate(annual_rate):
+    """Convert annual interest rates in percent to monthly rates"""
+    return np.asarray(annual_rate, dtype=np.float64) / (12 * 100)
+
+
+def annuity_payment(principal, annual_rate, tenure_months):
+    """Vectorized form of LoanEligibilityService.calculate_emi (unrounded)"""
+    principal = np.asarray(principal, dtype=np.float64)
+    rate = monthly_rate(annual_rate)
+    n = np.asarray(tenure_months, dtype=np.float64)
+    
+    growth = (1 + rate) ** n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emi = principal * rate * growth / (growth - 1)
+    return np.where(rate == 0, principal / n, emi)
+
+
+def remaining_balance(principal, annual_rate, monthly_payment, payments_made):
+    """Outstanding principal after a number of annuity payments"""
+    principal = np.asarray(principal, dtype=np.float64)
+    rate = monthly_rate(annual_rate)
+    payment = np.asarray(monthly_payment, dtype=np.float64)
+    k = np.asarray(payments_made, dtype=np.float64)
+    
+    growth = (1 + rate) ** k
+    with np.errstate(divide='ignore', invalid='ignore'):
+        balance = principal * growth - payment * (growth - 1) / rate
+    balance = np.where(rate == 0, principal - payment * k, balance)
+    return np.maximum(balance, 0.0)
+
+
+def outstanding_principal(principal, annual_rate, tenure_months, payments_made):
+    """
+    Principal left on annuity loans after a number of their EMIs, from the
+    schedule alone: P * ((1 + r)^n - (1 + r)^k) / ((1 + r)^n - 1), or
+    P * (n - k) / n interest free. Unlike remaining_balance it does not
+    depend on the rounded EMI, so it is exactly 0 once all EMIs are paid.
+    """
+    principal = np.asarray(principal, dtype=np.float64)
+    rate = monthly_rate(annual_rate)
+    n = np.asarray(tenure_months, dtype=np.float64)
+    k = np.clip(np.asarray(payments_made, dtype=np.float64), 0, n)
+    
+    growth = (1 + rate) ** n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        balance = principal * (growth - (1 + rate) ** k) / (growth - 1)
+        balance = np.where(rate == 0, principal * (n - k) / n, balance)
+    return np.where(n > 0, balance, 0.0)
+
+
+def simulate_loss_batch(book, seed_sequence, scenarios, loan_chunk_size,
+                        bucket_count, factor_loading, loss_given_default):
+    """
+    Simulate default paths for one batch of scenarios.
+    
+    ``book`` maps column names to equal-length arrays: principal, rate,
+    monthly_payment, payments_made, remaining_emis, monthly_hazard and
+    bucket. Each scenario draws one systematic factor that scales every
+    loan's hazard, then a default month per loan from the geometric
+    distribution; a loan defaults if that month falls inside its remaining
+    tenure and loses ``loss_given_default`` of its balance at that point.
+    Loans are processed ``loan_chunk_size`` at a time to bound memory at
+    ``scenarios * loan_chunk_size`` floats.
+    
+    Returns an array of shape (scenarios, bucket_count) of losses.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    systematic = rng.standard_normal(scenarios)
+    stress = np.exp(factor_loading * systematic - factor_loading ** 2 / 2)[:, None]
+    
+    losses = np.zeros((scenarios, bucket_count))
+    loan_count = len(book['principal'])
+    
+    for start in range(0, loan_count, loan_chunk_size):
+        chunk = slice(start, start + loan_chunk_size)
+        hazard = np.clip(book['monthly_hazard'][chunk] * stress, 1e-12, 1 - 1e-12)
+        
+        # Month (1-based, from now) of the first default under a constant hazard
+        uniforms = rng.random(hazard.shape)
+        default_month = np.ceil(np.log1p(-uniforms) / np.log1p(-hazard))
+        defaulted = (default_month >= 1) & (default_month <= book['remaining_emis'][chunk])
+        
+        exposure = remaining_balance(
+            book['principal'][chunk],
+            book['rate'][chunk],
+            book['monthly_payment'][chunk],
+            book['payments_made'][chunk] + np.maximum(default_month - 1, 0)
+        )
+        loan_losses = np.where(defaulted, exposure * loss_given_default, 0.0)
+        
+        buckets = book['bucket'][chunk]
+        for bucket in range(bucket_count):
+            mask = buckets == bucket
+            if mask.any():
+                losses[:, bucket] += loan_losses[:, mask].sum(axis=1)
+    
+    return losses
+
+
+# Decision outcomes of evaluate_policy
+APPROVED, REJECTED_SCORE, REJECTED_EMI = 0, 1, 2
+
+
+def evaluate_policy(book, policy):
+    """
+    Vectorized CreditScoreService.score_from_aggregates followed by
+    LoanEligibilityService.decide for every row of ``book``.
+    
+    ``book`` maps column names to equal-length arrays of the score inputs
+    (total_loans, loans_paid_on_time, current_year_loans, total_volume,
+    approved_limit), the EMI inputs (current_emis, monthly_salary) and the
+    request (loan_amount, interest_rate, tenure). ``policy`` holds the band
+    tables of a credit policy as arrays (see loans.backtest.policy_arrays).
+    
+    Returns arrays of the credit score, outcome (APPROVED, REJECTED_SCORE
+    or REJECTED_EMI), corrected interest rate and monthly installment.
+    """
+    total_loans = np.asarray(book['total_loans'], dtype=np.float64)
+    volume = np.asarray(book['total_volume'], dtype=np.float64)
+    limit = np.asarray(book['approved_limit'], dtype=np.float64)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        on_time = (book['loans_paid_on_time'] / total_loans) * policy['on_time_points']
+        volume_ratio = volume / limit
+    components = (
+        on_time
+        + policy['loan_count_points'][np.searchsorted(policy['loan_count_bounds'], total_loans, side='left')]
+        + policy['current_year_points'][
+            np.searchsorted(policy['current_year_bounds'], book['current_year_loans'], side='left')
+        ]
+        + policy['volume_points'][np.searchsorted(policy['volume_bounds'], volume_ratio, side='left')]
+    )
+    score = np.where(
+        total_loans == 0, policy['new_customer_score'],
+        np.where(volume > limit, 0, np.clip(np.trunc(np.nan_to_num(components)), 0, 100))
+    )
+    
+    rate = np.asarray(book['interest_rate'], dtype=np.float64)
+    emi = _rounded_emi(book['loan_amount'], rate, book['tenure'])
+    over_limit = book['current_emis'] + emi > np.asarray(book['monthly_salary'], dtype=np.float64) * 0.5
+    
+    band = np.searchsorted(policy['rate_bounds'], score, side='left')
+    min_rate = policy['rate_min'][band]
+    corrected = np.where(np.isnan(min_rate) | (rate >= min_rate), rate, min_rate)
+    outcome = np.where(
+        over_limit, REJECTED_EMI, np.where(policy['rate_approve'][band], APPROVED, REJECTED_SCORE)
+    )
+    
+    # Rejections keep the requested rate and its installment, as decide() does
+    approved = outcome == APPROVED
+    corrected = np.where(approved, corrected, rate)
+    emi = np.where(approved & (corrected != rate), _rounded_emi(book['loan_amount'], corrected, book['tenure']), emi)
+    return {'credit_score': score, 'outcome': outcome, 'interest_rate': corrected, 'monthly_installment': emi}
+
+
+def _rounded_emi(principal, annual_rate, tenure_months):
+    """annuity_payment rounded to the cent unless interest free, like calculate_emi"""
+    emi = annuity_payment(principal, annual_rate, tenure_months)
+    return np.where(monthly_rate(annual_rate) == 0, emi, np.round(emi, 2))
\ No newline at end of file
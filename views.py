@@ -1,19 +1,41 @@
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from datetime import date, timedelta
-from .models import Customer, Loan
+from django.http import StreamingHttpResponse, FileResponse
+from django.db import IntegrityError, transaction
+from django.conf import settings
+from django.urls import reverse
+from celery.result import AsyncResult
+from datetime import date
+from .models import Customer, Loan, ArchivedLoan, LoanApplication
 from .serializers import (
     CustomerRegistrationSerializer, CustomerResponseSerializer,
+    CustomerSearchSerializer, CustomerRankingSerializer,
     LoanEligibilitySerializer, LoanEligibilityResponseSerializer,
-    LoanCreateSerializer, LoanCreateResponseSerializer,
-    LoanDetailSerializer, CustomerLoanSerializer
+    LoanEligibilityGridSerializer, LoanEligibilityGridResponseSerializer,
+    MaxLoanAmountSerializer, MaxLoanAmountResponseSerializer,
+    LoanCreateSerializer, LoanCreateResponseSerializer, LoanApplicationSerializer,
+    LoanDetailSerializer, CustomerLoanSerializer,
+    PaymentSerializer, PaymentBatchResponseSerializer
 )
-from .services import LoanEligibilityService
+from .services import (
+    CustomerService, LoanEligibilityService, LoanOriginationService, PaymentService
+)
+from .simulation import run_portfolio_simulation
+from .coalescing import single_flight, coalescing_stats
+from .identity import get_customer, get_loans
+from .idempotency import idempotent
+from .exports import DATASETS, FORMATS, stream_export
+from .profiling import list_profiles, profile_path
+from .querylog import slow_query_stats
+from .sharding import routed_by_customer, scatter
+from .tasks import schedule_origination
 
 
 @api_view(['POST'])
+@idempotent
 def register_customer(request):
     """
     Register a new customer with approved limit based on salary
@@ -29,6 +51,59 @@ def register_customer(request):
 
 
 @api_view(['POST'])
+@idempotent
+def register_customers_batch(request):
+    """
+    Register a batch of customers; returns the assigned customer ids in
+    input order together with per-item validation errors
+    """
+    serializer = CustomerRegistrationSerializer(data=request.data, many=True)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    customers = serializer.save()
+    
+    results = []
+    for index, (customer, errors) in enumerate(zip(customers, serializer.item_errors)):
+        if customer is None:
+            results.append({'index': index, 'errors': errors})
+        else:
+            results.append(dict(CustomerResponseSerializer(customer).data, index=index))
+    
+    created = sum(customer is not None for customer in customers)
+    response_data = {
+        'created': created,
+        'failed': len(customers) - created,
+        'results': results
+    }
+    response_status = status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+    return Response(response_data, status=response_status)
+
+
+@api_view(['GET'])
+def search_customers(request):
+    """
+    List customers with their credit score, score components and EMI
+    headroom computed in SQL. Supports min_credit_score, max_credit_score,
+    min_emi_headroom, ordering and keyset pagination through cursor
+    """
+    serializer = CustomerSearchSerializer(data=request.query_params)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    customers, next_cursor = CustomerService.search_customers(**serializer.validated_data)
+    
+    response_data = {
+        'results': CustomerRankingSerializer(customers, many=True).data,
+        'next_cursor': next_cursor
+    }
+    return Response(response_data, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@routed_by_customer
 def check_eligibility(request):
     """
     Check loan eligibility based on credit score and other criteria
@@ -40,12 +115,15 @@ def check_eligibility(request):
     
     data = serializer.validated_data
     
-    # Check eligibility using service
-    eligibility_result = LoanEligibilityService.check_eligibility(
-        customer_id=data['customer_id'],
-        loan_amount=data['loan_amount'],
-        interest_rate=data['interest_rate'],
-        tenure=data['tenure']
+    # Check eligibility using service; identical concurrent checks share one computation
+    eligibility_result = single_flight('check_eligibility').do(
+        (data['customer_id'], data['loan_amount'], data['interest_rate'], data['tenure']),
+        lambda: LoanEligibilityService.check_eligibility(
+            customer_id=data['customer_id'],
+            loan_amount=data['loan_amount'],
+            interest_rate=data['interest_rate'],
+            tenure=data['tenure']
+        )
     )
     
     response_data = {
@@ -56,12 +134,93 @@ def check_eligibility(request):
         'tenure': data['tenure'],
         'monthly_installment': eligibility_result['monthly_installment']
     }
+    if 'policy_version' in eligibility_result:
+        response_data['policy_version'] = eligibility_result['policy_version']
     
     response_serializer = LoanEligibilityResponseSerializer(response_data)
     return Response(response_serializer.data, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
+@routed_by_customer
+def check_eligibility_grid(request):
+    """
+    Check loan eligibility for every combination of the given loan amounts,
+    tenures and interest rates of one customer
+    """
+    serializer = LoanEligibilityGridSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    try:
+        grid = LoanEligibilityService.evaluate_grid(
+            customer_id=data['customer_id'],
+            loan_amounts=data['loan_amounts'],
+            tenures=data['tenures'],
+            interest_rates=data['interest_rates']
+        )
+    except Customer.DoesNotExist:
+        return Response(
+            {'error': 'Customer not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    response_serializer = LoanEligibilityGridResponseSerializer({
+        'customer_id': data['customer_id'],
+        'policy_version': grid['policy_version'],
+        'cells': grid['cells']
+    })
+    return Response(response_serializer.data, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@routed_by_customer
+def max_loan_amount(request):
+    """
+    Largest loan amount a customer is eligible for at a given interest rate
+    and tenure
+    """
+    serializer = MaxLoanAmountSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    try:
+        result = LoanEligibilityService.max_loan_amount(
+            customer_id=data['customer_id'],
+            interest_rate=data['interest_rate'],
+            tenure=data['tenure']
+        )
+    except Customer.DoesNotExist:
+        return Response(
+            {'error': 'Customer not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    response_data = {
+        'customer_id': data['customer_id'],
+        'approval': result['approval'],
+        'message': result['message'],
+        'interest_rate': data['interest_rate'],
+        'corrected_interest_rate': result['corrected_interest_rate'],
+        'tenure': data['tenure'],
+        'max_loan_amount': result['max_loan_amount'],
+        'monthly_installment': result['monthly_installment'],
+        'policy_version': result['policy_version']
+    }
+    
+    response_serializer = MaxLoanAmountResponseSerializer(response_data)
+    return Response(response_serializer.data, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@idempotent
+@routed_by_customer
 def create_loan(request):
     """
     Process a new loan based on eligibility
@@ -87,25 +246,22 @@ def create_loan(request):
             'customer_id': data['customer_id'],
             'loan_approved': False,
             'message': eligibility_result['message'],
-            'monthly_installment': eligibility_result['monthly_installment']
+            'monthly_installment': eligibility_result['monthly_installment'],
+            'policy_version': eligibility_result.get('policy_version')
         }
         response_serializer = LoanCreateResponseSerializer(response_data)
         return Response(response_serializer.data, status=status.HTTP_200_OK)
     
     # Create the loan
     try:
-        customer = Customer.objects.get(customer_id=data['customer_id'])
+        customer = get_customer(data['customer_id'])
         
         # Use corrected interest rate
         final_interest_rate = eligibility_result['corrected_interest_rate']
         
-        loan = Loan.objects.create(
-            customer=customer,
-            loan_amount=data['loan_amount'],
-            tenure=data['tenure'],
-            interest_rate=final_interest_rate,
-            start_date=date.today(),
-            end_date=date.today() + timedelta(days=data['tenure'] * 30)  # Approximate
+        loan = LoanOriginationService.book_loan(
+            customer, data['loan_amount'], final_interest_rate, data['tenure'],
+            policy_version=eligibility_result['policy_version']
         )
         
         response_data = {
@@ -113,7 +269,8 @@ def create_loan(request):
             'customer_id': data['customer_id'],
             'loan_approved': True,
             'message': 'Loan approved and created successfully',
-            'monthly_installment': loan.monthly_repayment
+            'monthly_installment': loan.monthly_repayment,
+            'policy_version': loan.policy_version
         }
         
         response_serializer = LoanCreateResponseSerializer(response_data)
@@ -131,34 +288,260 @@ def create_loan(request):
         return Response(response_serializer.data, status=status.HTTP_404_NOT_FOUND)
 
 
+@api_view(['POST'])
+@idempotent
+@routed_by_customer
+def create_loan_async(request):
+    """
+    Queue a loan application for the origination workers and return 202
+    with the application to poll
+    """
+    serializer = LoanCreateSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    application = LoanApplication.objects.create(**serializer.validated_data)
+    # Idempotency keys wrap the view in a transaction; enqueue once the application is visible
+    transaction.on_commit(schedule_origination)
+    
+    return Response(
+        LoanApplicationSerializer(application).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': reverse('loan_application', args=[application.application_id])}
+    )
+
+
+@api_view(['GET'])
+def loan_application(request, application_id):
+    """
+    Status of a queued loan application; once decided it carries the
+    create_loan response fields
+    """
+    def find_application():
+        return LoanApplication.objects.filter(application_id=application_id).first()
+    
+    application = next(
+        (found for _, found in scatter(find_application) if found is not None), None
+    )
+    if application is None:
+        return Response({'error': 'Loan application not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response(LoanApplicationSerializer(application).data, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 def view_loan(request, loan_id):
     """
     View loan details and customer details
     """
-    try:
-        loan = Loan.objects.select_related('customer').get(loan_id=loan_id)
-        serializer = LoanDetailSerializer(loan)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    except Loan.DoesNotExist:
+    def find_loan():
+        loan = Loan.objects.select_related('customer').filter(loan_id=loan_id).first()
+        if loan is None:
+            loan = ArchivedLoan.objects.select_related('customer').filter(loan_id=loan_id).first()
+        return loan
+    
+    # Loans are keyed by customer, so without a customer_id every shard is asked
+    loan = next((found for _, found in scatter(find_loan) if found is not None), None)
+    
+    if loan is None:
         return Response(
             {'error': 'Loan not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    
+    serializer = LoanDetailSerializer(loan)
+    return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
+@routed_by_customer
 def view_customer_loans(request, customer_id):
     """
     View all current loan details by customer id
     """
+    def load_loans():
+        get_customer(customer_id)
+        return CustomerLoanSerializer(get_loans(customer_id), many=True).data
+    
     try:
-        customer = Customer.objects.get(customer_id=customer_id)
-        loans = Loan.objects.filter(customer=customer)
-        serializer = CustomerLoanSerializer(loans, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = single_flight('view_customer_loans').do(customer_id, load_loans)
+        return Response(data, status=status.HTTP_200_OK)
     except Customer.DoesNotExist:
         return Response(
             {'error': 'Customer not found'}, 
             status=status.HTTP_404_NOT_FOUND
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['GET'])
+def portfolio_loss_simulation(request):
+    """
+    Monte Carlo loss report for the active loan book, cached per day,
+    scenario count and seed
+    """
+    try:
+        scenarios = int(request.query_params.get('scenarios', 10000))
+        seed = int(request.query_params.get('seed', 0))
+    except ValueError:
+        return Response(
+            {'error': 'scenarios and seed must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    max_scenarios = settings.PORTFOLIO_SIMULATION['MAX_SCENARIOS']
+    if not 1 <= scenarios <= max_scenarios:
+        return Response(
+            {'error': f'scenarios must be between 1 and {max_scenarios}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if seed < 0:
+        return Response(
+            {'error': 'seed must be a non-negative integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    report = run_portfolio_simulation(scenarios=scenarios, seed=seed)
+    return Response(report, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def coalescing_metrics(request):
+    """
+    Calls and coalesced calls per coalesced endpoint in this process
+    """
+    return Response(coalescing_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def slow_query_metrics(request):
+    """
+    Slow statements seen by this process, aggregated per query shape
+    """
+    return Response(slow_query_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def request_profiles(request):
+    """
+    Most recent stored request profiles, newest first
+    """
+    try:
+        limit = int(request.query_params.get('limit', 50))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(list_profiles(limit=max(limit, 0)), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def request_profile(request, profile_id, extension='json'):
+    """
+    Download a stored profile: the JSON summary with call-tree timings and
+    SQL, or the raw cProfile data (.prof)
+    """
+    path = profile_path(profile_id, extension)
+    if path is None:
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    content_type = 'application/json' if extension == 'json' else 'application/octet-stream'
+    return FileResponse(
+        open(path, 'rb'), as_attachment=True,
+        filename=f'{profile_id}.{extension}', content_type=content_type
+    )
+
+
+@api_view(['GET'])
+def ingestion_status(request, task_id):
+    """
+    State of an ingestion task, with rows processed, rows per second and
+    ETA while it is running
+    """
+    result = AsyncResult(task_id)
+    
+    response_data = {
+        'task_id': task_id,
+        'state': result.state,
+        'progress': None,
+        'result': None
+    }
+    if result.state == 'PROGRESS':
+        response_data['progress'] = result.info
+    elif result.successful():
+        response_data['result'] = result.result
+    elif result.failed():
+        response_data['result'] = {'status': 'error', 'message': str(result.result)}
+    
+    return Response(response_data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_book(request, dataset, file_format):
+    """
+    Stream all customers or loans as CSV or NDJSON, optionally filtered by
+    start_date and end_date (YYYY-MM-DD)
+    """
+    if dataset not in DATASETS or file_format not in FORMATS:
+        return Response(
+            {'error': f'Unknown export {dataset}.{file_format}'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        start_date = date.fromisoformat(start_date) if start_date else None
+        end_date = date.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        return Response(
+            {'error': 'start_date and end_date must be dates in YYYY-MM-DD format'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    response = StreamingHttpResponse(
+        stream_export(dataset, file_format, start_date, end_date),
+        content_type=FORMATS[file_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{file_format}"'
+    return response
+
+
+MAX_PAYMENT_BATCH_SIZE = 10000
+
+
+@api_view(['POST'])
+def post_payments(request):
+    """
+    Post one repayment event or a batch of them; events already posted
+    under the same payment_reference are ignored
+    """
+    many = isinstance(request.data, list)
+    if many and len(request.data) > MAX_PAYMENT_BATCH_SIZE:
+        return Response(
+            {'error': f'At most {MAX_PAYMENT_BATCH_SIZE} payments can be posted per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    serializer = PaymentSerializer(data=request.data, many=many)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    payments = serializer.validated_data if many else [serializer.validated_data]
+    
+    try:
+        result = PaymentService.post_payments(payments)
+    except IntegrityError:
+        # A concurrent batch posted or applied one of these references first;
+        # posting and applying are idempotent, so the batch can be retried safely
+        return Response(
+            {'error': 'Conflicting concurrent payment batch, retry the request'},
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    response_serializer = PaymentBatchResponseSerializer(result)
+    return Response(response_serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file